@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_KM = 6371
+
+# Donor groups each recipient group can safely receive from
+BLOOD_COMPATIBILITY = {
+    'A+': ['A+', 'A-', 'O+', 'O-'],
+    'A-': ['A-', 'O-'],
+    'B+': ['B+', 'B-', 'O+', 'O-'],
+    'B-': ['B-', 'O-'],
+    'AB+': ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'],
+    'AB-': ['A-', 'B-', 'AB-', 'O-'],
+    'O+': ['O+', 'O-'],
+    'O-': ['O-'],
+}
+
+# Leaving a unit unfilled costs more the more urgent the request is, so
+# scarce donors go to critical patients first and distance only breaks ties
+URGENCY_WEIGHTS = {'Critical': 4.0, 'High': 3.0, 'Medium': 2.0, 'Low': 1.0}
+UNFILLED_UNIT_COST = 100000.0
+
+# Patient statuses that still take part in allocation
+OPEN_STATUSES = ('Pending', 'Matched', 'No Match', 'Partially Allocated')
+
+# Bounds on the nearest donors considered per unit
+DEFAULT_CANDIDATES = 10
+MAX_CANDIDATES = 100
+
+
+class DonorAllocator:
+    def __init__(self, candidates=DEFAULT_CANDIDATES):
+        # Nearest compatible donors considered per unit, on top of the
+        # patient's own unit count so multi-unit requests can be filled
+        self.candidates = candidates
+
+    def build_slots(self, patients_df):
+        """Expand each patient into one slot per unit still needed"""
+        units = patients_df['units_remaining'].clip(lower=0).to_numpy(dtype=np.int64)
+        return np.repeat(np.arange(len(patients_df)), units)
+
+    def candidate_edges(self, patients_df, donors_df, slots):
+        """Collect (slot, donor, distance_km) edges to nearby compatible donors"""
+        slot_rows, donor_cols, costs = [], [], []
+        patient_coords = np.radians(patients_df[['latitude', 'longitude']].to_numpy(dtype=float))
+        donor_coords = np.radians(donors_df[['latitude', 'longitude']].to_numpy(dtype=float))
+        donor_groups = donors_df['blood_group'].to_numpy()
+        slot_patients = patients_df['blood_group'].to_numpy()[slots]
+
+        for recipient_group, donor_group_list in BLOOD_COMPATIBILITY.items():
+            group_slots = np.flatnonzero(slot_patients == recipient_group)
+            if len(group_slots) == 0:
+                continue
+            compatible = np.flatnonzero(np.isin(donor_groups, donor_group_list))
+            if len(compatible) == 0:
+                continue
+
+            # Query once per patient, then fan results out to its slots
+            group_patients, slot_to_patient = np.unique(slots[group_slots], return_inverse=True)
+            max_units = int(patients_df['units_remaining'].to_numpy()[group_patients].max())
+            k = min(len(compatible), self.candidates + max_units)
+            tree = BallTree(donor_coords[compatible], metric='haversine')
+            distances, indices = tree.query(patient_coords[group_patients], k=k)
+
+            slot_rows.append(np.repeat(group_slots, k))
+            donor_cols.append(compatible[indices[slot_to_patient]].ravel())
+            costs.append(distances[slot_to_patient].ravel() * EARTH_RADIUS_KM)
+
+        if not slot_rows:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, np.array([], dtype=float)
+        return np.concatenate(slot_rows), np.concatenate(donor_cols), np.concatenate(costs)
+
+    def allocate(self, patients_df, donors_df):
+        """Assign at most one patient unit to each donor with minimum total cost
+
+        patients_df needs id, blood_group, urgency, units_remaining, latitude
+        and longitude; donors_df needs id, blood_group, latitude and longitude.
+        Returns a DataFrame of patient_id, donor_id and distance_km.
+        """
+        columns = ['patient_id', 'donor_id', 'distance_km']
+        if patients_df.empty or donors_df.empty:
+            return pd.DataFrame(columns=columns)
+
+        patients_df = patients_df.reset_index(drop=True)
+        donors_df = donors_df.reset_index(drop=True)
+        slots = self.build_slots(patients_df)
+        if len(slots) == 0:
+            return pd.DataFrame(columns=columns)
+
+        rows, cols, distances = self.candidate_edges(patients_df, donors_df, slots)
+
+        # Every slot also gets a private "unfilled" column, which keeps the
+        # problem feasible when donors run out
+        n_slots, n_donors = len(slots), len(donors_df)
+        weights = patients_df['urgency'].map(URGENCY_WEIGHTS).fillna(1.0).to_numpy()[slots]
+        slot_index = np.arange(n_slots)
+        rows = np.concatenate([rows, slot_index])
+        cols = np.concatenate([cols, n_donors + slot_index])
+        # Offset real edges slightly so zero-distance pairs stay explicit edges
+        costs = np.concatenate([distances + 1e-6, UNFILLED_UNIT_COST * weights])
+
+        graph = csr_matrix((costs, (rows, cols)), shape=(n_slots, n_donors + n_slots))
+        matched_cols = min_weight_full_bipartite_matching(graph)[1]
+
+        filled = matched_cols < n_donors
+        filled_slots = slot_index[filled]
+        filled_donors = matched_cols[filled]
+        # Indexing with no filled slots gives back a sparse matrix, not costs
+        matched_costs = (np.asarray(graph[filled_slots, filled_donors]).ravel() - 1e-6 if filled.any()
+                         else np.array([], dtype=float))
+
+        return pd.DataFrame({
+            'patient_id': patients_df['id'].to_numpy()[slots[filled_slots]],
+            'donor_id': donors_df['id'].to_numpy()[filled_donors],
+            'distance_km': matched_costs,
+        }, columns=columns)
+
+
+def load_open_patients(conn):
+    """Read open patient requests with the units still left to allocate"""
+    placeholders = ', '.join('?' for _ in OPEN_STATUSES)
+    patients_df = pd.read_sql(f'''
+        SELECT p.id, p.blood_group, p.location, p.urgency, p.latitude, p.longitude,
+               p.units_needed - COUNT(a.id) AS units_remaining
+        FROM patients p
+        LEFT JOIN donor_allocations a ON a.patient_id = p.id
+        WHERE p.status IN ({placeholders})
+        GROUP BY p.id
+        HAVING units_remaining > 0
+    ''', conn, params=list(OPEN_STATUSES))
+    return patients_df
+
+
+def load_free_donors(conn, shards=None):
+    """Read available donors that are not already allocated to a patient
+
+    With a ShardRouter the donors are gathered from every shard and the
+    allocations, which stay in conn, are filtered out afterwards.
+    """
+    if shards is None:
+        return pd.read_sql('''
+            SELECT id, blood_group, location, latitude, longitude
+            FROM donors
+            WHERE availability = 'Available'
+              AND id NOT IN (SELECT donor_id FROM donor_allocations)
+        ''', conn)
+    donors_df = pd.concat(shards.scatter(lambda shard_conn: pd.read_sql(
+        "SELECT id, blood_group, location, latitude, longitude FROM donors WHERE availability = 'Available'",
+        shard_conn)), ignore_index=True)
+    allocated = {row[0] for row in conn.execute('SELECT donor_id FROM donor_allocations')}
+    return donors_df[~donors_df['id'].isin(allocated)].reset_index(drop=True)
+
+
+def mark_allocated(conn, donor_ids, shards=None):
+    """Set availability to Allocated, in conn or on each donor's own shard"""
+    if shards is None:
+        conn.executemany("UPDATE donors SET availability = 'Allocated' WHERE id = ?",
+                         [(donor_id,) for donor_id in donor_ids])
+        return
+    by_shard = {}
+    for donor_id in donor_ids:
+        by_shard.setdefault(shards.shard_for_id(donor_id), []).append((donor_id,))
+    for shard, params in by_shard.items():
+        shard_conn = shard.connect()
+        try:
+            shard_conn.executemany("UPDATE donors SET availability = 'Allocated' WHERE id = ?", params)
+            shard_conn.commit()
+        finally:
+            shard_conn.close()
+
+
+def fill_missing_coordinates(patients_df, donors_df):
+    """Place patients without coordinates at the centre of donors in their location"""
+    missing = patients_df['latitude'].isna() | patients_df['longitude'].isna()
+    if not missing.any():
+        return patients_df
+
+    located = donors_df.dropna(subset=['latitude', 'longitude'])
+    centres = located.groupby('location')[['latitude', 'longitude']].mean()
+    overall = located[['latitude', 'longitude']].mean()
+
+    patients_df = patients_df.copy()
+    for col in ['latitude', 'longitude']:
+        guess = patients_df.loc[missing, 'location'].map(centres[col]).fillna(overall[col])
+        patients_df.loc[missing, col] = guess
+    return patients_df
+
+
+def run_allocation(conn, candidates=DEFAULT_CANDIDATES, shards=None):
+    """Allocate free donors to all open patients and persist the result
+
+    The write lock is taken before the free donors are read, so a
+    concurrent run waits and then only sees the donors this one left.
+    With donor shards the allocations commit first and the donors are
+    then marked on their shards; until then donor_allocations alone
+    keeps them out of the next run.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        summary, donor_ids = _allocate(conn, candidates, shards)
+        if shards is None:
+            mark_allocated(conn, donor_ids)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    if shards is not None:
+        mark_allocated(conn, donor_ids, shards)
+    return summary
+
+
+def _allocate(conn, candidates, shards):
+    patients_df = load_open_patients(conn)
+    donors_df = load_free_donors(conn, shards).dropna(subset=['latitude', 'longitude'])
+    patients_df = fill_missing_coordinates(patients_df, donors_df)
+    patients_df = patients_df.dropna(subset=['latitude', 'longitude'])
+
+    allocations = DonorAllocator(candidates=candidates).allocate(patients_df, donors_df)
+
+    cursor = conn.cursor()
+    cursor.executemany(
+        'INSERT INTO donor_allocations (patient_id, donor_id, distance_km) VALUES (?, ?, ?)',
+        [(int(p), int(d), float(km)) for p, d, km in allocations.itertuples(index=False)]
+    )
+
+    # Patients are fully allocated once every remaining unit got a donor
+    allocated_units = allocations.groupby('patient_id').size()
+    remaining = patients_df.set_index('id')['units_remaining']
+    status_updates = []
+    for patient_id, units in allocated_units.items():
+        status = 'Allocated' if units >= remaining[patient_id] else 'Partially Allocated'
+        status_updates.append((status, int(patient_id)))
+    cursor.executemany('UPDATE patients SET status = ? WHERE id = ?', status_updates)
+
+    return {
+        'patients_considered': int(len(patients_df)),
+        'donors_considered': int(len(donors_df)),
+        'units_requested': int(patients_df['units_remaining'].sum()) if not patients_df.empty else 0,
+        'units_allocated': int(len(allocations)),
+        'patients_fully_allocated': sum(1 for status, _ in status_updates if status == 'Allocated'),
+    }, [int(d) for d in allocations['donor_id']]
@@ -1,35 +1,74 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
 import sqlite3
+import click
 import pandas as pd
 import numpy as np
 from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import math
 import hashlib
+import os
+import time
+import zlib
+from allocation import BLOOD_COMPATIBILITY, DEFAULT_CANDIDATES, MAX_CANDIDATES, run_allocation
+from serialization import table_columns, parse_fields, fetch_projected, dumps_rows, compress_body
+from events import dashboard_events
+from reporting import GRANULARITIES, init_rollups, backfill_rollups, request_report
+from archival import (ARCHIVE_AFTER_DAYS, ARCHIVE_PATH, attach_archive, init_archive, archive_closed_requests,
+                       patient_history)
+from write_batcher import GroupCommitWriter
+from capture import TrafficRecorder
+from schema import begin_schema_setup, mark_schema_current
+from notifications import init_outbox, enqueue_donor_notifications, transport_from_env, NotificationDispatcher
+from sharding import ShardRouter, init_email_registry
+from snapshot import ReadSnapshot, init_change_log
+from features import FEATURE_SCHEMA_PATH, FeatureSchema
+from donor_search import DonorQuery, init_search_indexes, check_plans
+from parallel_matching import ParallelKNN
+from health import Readiness, database_status
+import reservations
+import availability_windows
+from backup import BackupService, restore_snapshot
+from static_assets import StaticAssets
+from single_flight import SingleFlight
+from density import CELL_DEGREES, DensityMap, init_density, backfill_density, read_density
+import slow_queries
 
-app = Flask(__name__)
+# Page templates and style.css live next to this file
+app = Flask(__name__, template_folder='.', static_folder=None)
 app.secret_key = 'blood_bank_secret_key_2024'
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('blood_bank.db')
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            user_type TEXT NOT NULL,
-            created_date TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Donors table
-    cursor.execute('''
+# Fingerprinted, precompressed assets behind url_for('static', ...)
+static_assets = StaticAssets(app.root_path)
+static_assets.init_app(app)
+
+# Bump whenever init_db changes tables, indexes, triggers or seed data;
+# startup skips all of init_db while the database is at this version
+SCHEMA_VERSION = '11'
+
+# Tables whose change counters back the API ETags
+VERSIONED_TABLES = ['donors', 'blood_inventory']
+# Seconds clients may reuse an API response before revalidating
+API_CACHE_MAX_AGE = 5
+
+# Contacts matched donors in the background; BLOOD_BANK_NOTIFY picks the transport
+notification_dispatcher = NotificationDispatcher('blood_bank.db', transport_from_env())
+
+# Opt-in traffic capture for replay.py, e.g. BLOOD_BANK_CAPTURE=traffic.jsonl
+if os.environ.get('BLOOD_BANK_CAPTURE'):
+    TrafficRecorder(os.environ['BLOOD_BANK_CAPTURE']).init_app(app)
+
+# Donor registrations arrive in bursts at blood drives, so they share commits
+donor_writer = GroupCommitWriter('blood_bank.db')
+
+# In-memory copies of the tables behind the read-only routes, kept
+# current from change_log so reads never wait on writers
+read_snapshot = ReadSnapshot('blood_bank.db', {
+    'donors': {'index': ['blood_group', 'availability'], 'tokens': ['location']},
+    'blood_inventory': {'index': ['blood_group']},
+})
+
+DONORS_TABLE_SQL = '''
         CREATE TABLE IF NOT EXISTS donors (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
@@ -46,8 +85,93 @@ def init_db():
             longitude REAL,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
+    '''
+
+# Matches fetched from the index before dropping donors who cannot be
+# called soon enough, and the number of donors contacted per request
+MATCH_CANDIDATES = 20
+MATCH_DONORS = 5
+# Hours within which a matched donor must be callable, by urgency
+URGENCY_WINDOW_HOURS = {'Critical': 0, 'High': 6, 'Medium': 24, 'Low': 72}
+
+# Donor shards, when BLOOD_BANK_SHARDS configures them; None keeps every
+# donor in blood_bank.db
+donor_shards = ShardRouter.from_env()
+
+# Scheduled online snapshots, when BLOOD_BANK_BACKUP_INTERVAL sets a period,
+# of every database a restore needs: main, archive and donor shards
+backup_service = BackupService.from_env('blood_bank.db', [ARCHIVE_PATH] + (
+    [shard.path for shard in donor_shards.shards] if donor_shards else []))
+
+def init_table_versions(cursor, tables):
+    """Create table_versions and the triggers that bump it for each table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            last_modified TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for table in tables:
+        cursor.execute('INSERT OR IGNORE INTO table_versions (table_name) VALUES (?)', (table,))
+        for event in ['INSERT', 'UPDATE', 'DELETE']:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1, last_modified = CURRENT_TIMESTAMP
+                    WHERE table_name = '{table}';
+                END
+            ''')
+
+def init_donor_shard(cursor):
+    """Schema for a donor shard file"""
+    cursor.execute(DONORS_TABLE_SQL)
+    init_search_indexes(cursor)
+    init_table_versions(cursor, ['donors'])
+    init_donor_density(cursor)
+    availability_windows.init_windows(cursor)
+
+def init_donor_density(cursor):
+    """Density grid triggers, seeded from any donors that predate them"""
+    init_density(cursor)
+    if (cursor.execute('SELECT COUNT(*) FROM donor_density').fetchone()[0] == 0
+            and cursor.execute('SELECT COUNT(*) FROM donors WHERE latitude IS NOT NULL').fetchone()[0] > 0):
+        backfill_density(cursor)
+
+# Database initialization
+def init_db():
+    if donor_shards:
+        donor_shards.init_shards(init_donor_shard, SCHEMA_VERSION)
+    
+    # Workers booting together wait on the write lock, and only the first
+    # one through actually runs the setup below
+    conn = sqlite3.connect('blood_bank.db', timeout=30)
+    # WAL lets readers carry on while inventory reservations commit; the
+    # mode is stored in the database file, so this is a no-op once set
+    conn.execute('PRAGMA journal_mode=WAL')
+    # ATTACH is refused inside a transaction, so the archive joins first
+    attach_archive(conn)
+    if not begin_schema_setup(conn, 'app', SCHEMA_VERSION):
+        conn.close()
+        return
+    cursor = conn.cursor()
+    
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            user_type TEXT NOT NULL,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP
+        )
     ''')
     
+    # Donors table
+    cursor.execute(DONORS_TABLE_SQL)
+    init_search_indexes(cursor)
+    
     # Patients table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS patients (
@@ -77,17 +201,76 @@ def init_db():
         )
     ''')
     
+    # Patient coordinates were added after the first release
+    patient_columns = [row[1] for row in cursor.execute('PRAGMA table_info(patients)')]
+    for col in ['latitude', 'longitude']:
+        if col not in patient_columns:
+            cursor.execute(f'ALTER TABLE patients ADD COLUMN {col} REAL')
+    
+    # Donor allocations table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS donor_allocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            donor_id INTEGER NOT NULL UNIQUE,
+            distance_km REAL,
+            allocated_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES patients (id),
+            FOREIGN KEY (donor_id) REFERENCES donors (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_allocations_patient ON donor_allocations (patient_id)')
+    
+    # Table versions, bumped by triggers on every write so readers can
+    # detect changes without touching the rows themselves
+    init_table_versions(cursor, VERSIONED_TABLES)
+    init_change_log(cursor, VERSIONED_TABLES)
+    
+    # Keep the dashboard sort and the archival sweep off full scans
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_request_date ON patients (request_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_status_date ON patients (status, request_date)')
+    # Archived requests keep the hot table's columns
+    init_archive(cursor)
+    
+    # Outbox of donor notifications awaiting delivery
+    init_outbox(cursor)
+    
+    # Donor counts per map cell, blood group and availability
+    init_donor_density(cursor)
+    
+    # When donors can be called, behind an interval index
+    availability_windows.init_windows(cursor)
+    
+    # Hourly and daily request rollups, seeded from any existing requests
+    init_rollups(cursor)
+    if (cursor.execute('SELECT COUNT(*) FROM request_rollups_daily').fetchone()[0] == 0
+            and cursor.execute('SELECT COUNT(*) FROM patients').fetchone()[0] > 0):
+        backfill_rollups(conn, commit=False)
+    
+    # Earlier releases inserted a fresh inventory row per group on every
+    # boot; keep the oldest row of each group and make the insert idempotent
+    cursor.execute('DELETE FROM blood_inventory WHERE id NOT IN (SELECT MIN(id) FROM blood_inventory GROUP BY blood_group)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_blood_group ON blood_inventory (blood_group)')
+    
     # Insert default blood groups
     blood_groups = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
     for bg in blood_groups:
         cursor.execute('INSERT OR IGNORE INTO blood_inventory (blood_group, units_available) VALUES (?, ?)', (bg, 0))
     
+    # Units held for patients until used, released or expired
+    reservations.init_reservations(cursor)
+    
+    # Donor emails claimed across all shards
+    init_email_registry(cursor)
+    if donor_shards:
+        donor_shards.register_emails(conn)
+    
     # Create default admin user
     admin_password = hashlib.sha256('admin123'.encode()).hexdigest()
     cursor.execute('INSERT OR IGNORE INTO users (username, email, password, user_type) VALUES (?, ?, ?, ?)',
                   ('admin', 'admin@bloodbank.com', admin_password, 'admin'))
     
-    conn.commit()
+    mark_schema_current(conn, 'app', SCHEMA_VERSION)
     conn.close()
 
 # Password hashing
@@ -96,47 +279,110 @@ def hash_password(password):
 
 # KNN Donor Matching Algorithm
 class DonorMatcher:
-    def __init__(self):
-        self.scaler = StandardScaler()
-        self.label_encoders = {}
-        self.knn = NearestNeighbors(n_neighbors=5, metric='euclidean')
-    
-    def prepare_features(self, donors_df):
-        """Prepare features for KNN algorithm"""
-        # Encode categorical variables
-        categorical_columns = ['blood_group', 'location', 'health_status', 'availability']
-        
-        for col in categorical_columns:
-            if col not in self.label_encoders:
-                self.label_encoders[col] = LabelEncoder()
-            donors_df[col] = self.label_encoders[col].fit_transform(donors_df[col].astype(str))
-        
-        # Calculate days since last donation
-        donors_df['last_donation_days'] = donors_df['last_donation_date'].apply(
-            lambda x: (datetime.now() - datetime.strptime(x, '%Y-%m-%d')).days if x and x != 'None' else 365
-        )
-        
-        # Select features for KNN
-        features = ['blood_group', 'age', 'last_donation_days', 'latitude', 'longitude']
-        return donors_df[features]
+    def __init__(self, schema_path=FEATURE_SCHEMA_PATH):
+        self.schema_path = schema_path
+        self.schema = None
+        # Fitted KNN index for the most recent (schema, donors) key
+        self._index = (None, None)
+        self.index_size = 0
+        self.index_build_seconds = None
+        self.index_built_at = None
+        # Available donors as of a donors table version
+        self._donors = (None, None)
+        # Requests that arrive together, e.g. during an incident, share
+        # these steps instead of each repeating them
+        self.donor_reads = SingleFlight('donor_reads')
+        self.index_builds = SingleFlight('index_builds')
+        self.matches = SingleFlight('matches')
+        self.flights = [self.donor_reads, self.index_builds, self.matches]
+    
+    def load_schema(self, donors_df):
+        """Load the saved feature schema, fitting it from donors_df the first time"""
+        if self.schema is None:
+            self.schema = FeatureSchema.load_or_fit(donors_df, self.schema_path)
+        return self.schema
+    
+    def prepare_features(self, df):
+        """Encode donors or a patient with the shared feature schema"""
+        return self.load_schema(df).transform(df)
+    
+    def fitted_index(self, donors_df, cache_key=None):
+        """KNN index over donors_df, reused while cache_key and the schema are unchanged
+
+        cache_key must change whenever the donor rows do, e.g. the donors
+        table version; None always refits.
+        """
+        key = (self.load_schema(donors_df).fingerprint, cache_key)
+        cached_key, knn = self._index
+        if cache_key is None:
+            return self._fit(donors_df, key)
+        if cached_key != key:
+            knn = self.index_builds.do(key, self._fit, donors_df, key)
+        return knn
+    
+    def _fit(self, donors_df, key):
+        start = time.perf_counter()
+        knn = NearestNeighbors(metric='euclidean')
+        knn.fit(self.prepare_features(donors_df))
+        self._index = (key, knn)
+        self.index_size = len(donors_df)
+        self.index_build_seconds = time.perf_counter() - start
+        self.index_built_at = time.time()
+        return knn
+    
+    def available_donors(self, conn):
+        """The donors table version and its available donors as a frame, read once per version
+
+        Both are read in one transaction, so a frame, and any index
+        fitted to it, is never keyed to a version it does not match.
+        """
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute('BEGIN')
+        try:
+            donors_version, _ = get_table_version(conn, 'donors')
+            cached_version, donors_df = self._donors
+            if cached_version != donors_version:
+                donors_df = self.donor_reads.do(donors_version, self._read_donors, conn, donors_version)
+        finally:
+            if own_transaction:
+                conn.commit()
+        return donors_version, donors_df
+    
+    def _read_donors(self, conn, donors_version):
+        donors_df = pd.read_sql('SELECT * FROM donors WHERE availability = "Available"', conn)
+        self._donors = (donors_version, donors_df)
+        return donors_df
+    
+    def patient_key(self, patient_data):
+        """A patient's encoded features, rounded so that requests matching identically share a key"""
+        features = self.prepare_features(pd.DataFrame([patient_data]))[0]
+        return tuple(np.round(features, 3).tolist())
+    
+    def match_patient(self, patient_data, donors_df, donors_version, k=5):
+        """find_matching_donors, shared with identical requests being matched at the same moment
+
+        Requests are identical when their encoded features, k and the
+        donors version agree. Each caller gets its own copies of the rows.
+        """
+        self.load_schema(donors_df)
+        key = (self.schema.fingerprint, donors_version, k, self.patient_key(patient_data))
+        matches = self.matches.do(key, self.find_matching_donors, patient_data, donors_df, k, donors_version)
+        return [dict(donor) for donor in matches]
     
-    def find_matching_donors(self, patient_data, donors_df, k=5):
+    def find_matching_donors(self, patient_data, donors_df, k=5, cache_key=None):
         """Find k nearest donors for a patient"""
         try:
-            # Prepare donor features
-            donor_features = self.prepare_features(donors_df.copy())
+            knn = self.fitted_index(donors_df, cache_key)
             
-            # Fit KNN model
-            self.knn.fit(donor_features)
-            
-            # Prepare patient features
+            # Encode the patient with the same schema as the donors
             patient_features = self.prepare_features(pd.DataFrame([patient_data]))
             
             # Find nearest neighbors
-            distances, indices = self.knn.kneighbors(patient_features)
+            distances, indices = knn.kneighbors(patient_features, n_neighbors=min(k, len(donors_df)))
             
             # Get matching donors
-            matching_donors = donors_df.iloc[indices[0]]
+            matching_donors = donors_df.iloc[indices[0]].copy()
             matching_donors['distance_score'] = distances[0]
             
             return matching_donors.to_dict('records')
@@ -144,10 +390,52 @@ class DonorMatcher:
         except Exception as e:
             print(f"Error in KNN matching: {e}")
             return []
+    
+    def match_batch(self, patients_df, donors_df, k=5, workers=None):
+        """Find k nearest donors for each patient, spreading the queries over workers"""
+        schema = self.load_schema(donors_df)
+        with ParallelKNN(schema.transform(donors_df), workers) as knn:
+            distances, indices = knn.query(schema.transform(patients_df), k)
+        donors = donors_df.to_dict('records')
+        return [[dict(donors[j], distance_score=float(d)) for d, j in zip(row_distances, row_indices)]
+                for row_distances, row_indices in zip(distances, indices)]
+
+# One matcher per process so the feature schema and donor index are reused
+donor_matcher = DonorMatcher()
+
+# Donor counts per map cell, cached until donors change
+donor_density = DensityMap()
+
+# Warm-up progress reported by /readyz
+readiness = Readiness()
+
+def warm_up(readiness):
+    """Load the donor store and build the matching index before taking traffic"""
+    start = time.perf_counter()
+    donors = read_snapshot.get('donors')
+    readiness.record('donor_snapshot', len(donors.rows), time.perf_counter() - start)
+    
+    # Sharded requests rank donors per shard instead of through the KNN index
+    if donor_shards:
+        conn = get_db_connection()
+        unmigrated = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
+        conn.close()
+        if unmigrated:
+            raise RuntimeError(f'{unmigrated} donors in blood_bank.db are in no shard; '
+                               'run flask migrate-donors-to-shards')
+        return
+    start = time.perf_counter()
+    conn = get_db_connection()
+    donors_version, donors_df = donor_matcher.available_donors(conn)
+    conn.close()
+    if not donors_df.empty:
+        # Same cache key as patient_request, so the first request reuses this fit
+        donor_matcher.fitted_index(donors_df, cache_key=donors_version)
+    readiness.record('matching_index', len(donors_df), time.perf_counter() - start)
 
 # Helper functions
 def get_db_connection():
-    conn = sqlite3.connect('blood_bank.db')
+    conn = slow_queries.connect('blood_bank.db', timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -168,17 +456,131 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return distance
 
 def update_blood_inventory(blood_group, units_change):
-    """Update blood inventory"""
+    """Update blood inventory, returning False if it would leave the group below zero units"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # Conditional in the same statement, so concurrent updates cannot
+    # both pass a check and drive the count negative
     cursor.execute(
-        'UPDATE blood_inventory SET units_available = units_available + ?, last_updated = CURRENT_TIMESTAMP WHERE blood_group = ?',
-        (units_change, blood_group)
+        'UPDATE blood_inventory SET units_available = units_available + ?, last_updated = CURRENT_TIMESTAMP '
+        'WHERE blood_group = ? AND units_available + ? >= 0',
+        (units_change, blood_group, units_change)
     )
+    updated = cursor.rowcount == 1
     
     conn.commit()
+    if updated:
+        inventory_changed(conn, [blood_group])
     conn.close()
+    return updated
+
+def inventory_changed(conn, blood_groups):
+    """Refresh the inventory snapshot and push the changed groups to the dashboard"""
+    read_snapshot.catch_up()
+    for blood_group in blood_groups:
+        item = conn.execute(
+            'SELECT blood_group, units_available, last_updated FROM blood_inventory WHERE blood_group = ?',
+            (blood_group,)
+        ).fetchone()
+        if item:
+            dashboard_events.publish('inventory', dict(item))
+
+def versioned_density(conn):
+    """The donors version and the density rows, read in one transaction"""
+    conn.execute('BEGIN')
+    try:
+        version, _ = get_table_version(conn, 'donors')
+        return version, read_density(conn)
+    finally:
+        conn.commit()
+
+def density_grid():
+    """The donor density grid, re-read only after donors change"""
+    if donor_shards:
+        versions = tuple(donor_shards.scatter(lambda conn: get_table_version(conn, 'donors')[0]))
+        
+        def read():
+            results = donor_shards.scatter(versioned_density)
+            return tuple(version for version, _ in results), [row for _, rows in results for row in rows]
+        return donor_density.get(versions, read)
+    conn = get_db_connection()
+    try:
+        # Version and rows in one read transaction, so the grid is never
+        # keyed to a version its rows do not match
+        conn.execute('BEGIN')
+        version, _ = get_table_version(conn, 'donors')
+        return donor_density.get(version, lambda: (version, read_density(conn)))
+    finally:
+        conn.commit()
+        conn.close()
+
+def get_table_version(conn, table):
+    """Return (version, last_modified) for a table tracked in table_versions"""
+    row = conn.execute(
+        'SELECT version, last_modified FROM table_versions WHERE table_name = ?', (table,)
+    ).fetchone()
+    last_modified = datetime.strptime(row['last_modified'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return row['version'], last_modified
+
+def conditional_json(table, shards=None):
+    """Serve a table as JSON, or 304 if the client copy is current
+
+    Supports ?fields=a,b to project columns and gzips large bodies for
+    clients that accept it. Rows come from the read snapshot, or with a
+    ShardRouter from every shard, the ETag combining the shard versions.
+    """
+    if shards is None:
+        snapshot = read_snapshot.get(table)
+        columns = snapshot.columns
+        version, last_modified = snapshot.state()
+    else:
+        conn = shards.shards[0].connect()
+        columns = table_columns(conn, table)
+        conn.close()
+        versions = shards.scatter(lambda shard_conn: get_table_version(shard_conn, table))
+        version = '.'.join(str(v) for v, _ in versions)
+        last_modified = max(modified for _, modified in versions)
+    
+    try:
+        fields = parse_fields(request.args.get('fields', ''), columns)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    etag = f'{table}-{version}'
+    if 'fields' in request.args:
+        etag += f"-{zlib.crc32(','.join(fields).encode()):08x}"
+    gzip_etag = f'{etag}-gzip'
+    
+    # If-None-Match takes precedence over If-Modified-Since
+    if request.if_none_match:
+        matched = [tag for tag in (etag, gzip_etag) if request.if_none_match.contains(tag)]
+        not_modified = bool(matched)
+        if matched:
+            etag = matched[0]
+    else:
+        not_modified = bool(request.if_modified_since) and last_modified <= request.if_modified_since
+    
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        if shards is None:
+            rows = snapshot.project(fields)
+        else:
+            parts = shards.scatter(lambda shard_conn: fetch_projected(shard_conn, table, fields)[1])
+            rows = [row for part in parts for row in part]
+        body, encoding = compress_body(dumps_rows(fields, rows), 'gzip' in request.accept_encodings)
+        response = app.response_class(body, mimetype='application/json')
+        if encoding:
+            response.content_encoding = encoding
+            etag = gzip_etag
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.vary.add('Accept-Encoding')
+    response.cache_control.private = True
+    response.cache_control.max_age = API_CACHE_MAX_AGE
+    return response
 
 # Authentication decorator
 def login_required(f):
@@ -192,6 +594,68 @@ def login_required(f):
     return decorated_function
 
 # Routes
+@app.before_request
+def start_warm_up():
+    # Under a WSGI server the first request, usually a /readyz probe,
+    # starts the warm-up; app.run() warms up before listening instead
+    readiness.start(warm_up)
+    backup_service.start()
+    # Rows queued before a restart are sent without waiting for a new match
+    notification_dispatcher.start()
+
+@app.after_request
+def compress_html(response):
+    # Pages are rendered per request, so they are compressed on the way out;
+    # static assets arrive already compressed
+    if (response.mimetype == 'text/html' and response.status_code == 200 and not response.is_streamed
+            and 'Content-Encoding' not in response.headers):
+        body, encoding = compress_body(response.get_data(), 'gzip' in request.accept_encodings)
+        if encoding:
+            response.set_data(body)
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+def health_report():
+    """Database reachability, warm-up progress and index freshness"""
+    reachable, detail = database_status('blood_bank.db')
+    now = time.time()
+    report = {
+        'database': {'reachable': reachable, ('latency_ms' if reachable else 'error'): detail},
+        'warmup': readiness.report(),
+        'matching_index': {
+            'size': donor_matcher.index_size,
+            'build_seconds': round(donor_matcher.index_build_seconds, 4) if donor_matcher.index_built_at else None,
+            'age_seconds': round(now - donor_matcher.index_built_at, 1) if donor_matcher.index_built_at else None,
+        },
+        'coalescing': {flight.name: flight.stats() for flight in donor_matcher.flights},
+        'snapshot': {
+            'refreshes': read_snapshot.refreshes,
+            'refresh_age_seconds': round(now - read_snapshot.checked_at, 3) if read_snapshot.checked_at else None,
+        },
+        'backup': {
+            'interval_minutes': backup_service.interval_minutes,
+            'age_seconds': round(now - backup_service.last['taken'], 1) if backup_service.last else None,
+            'error': backup_service.error,
+        },
+    }
+    return report, reachable
+
+@app.route('/healthz')
+def healthz():
+    report, reachable = health_report()
+    report['status'] = 'ok' if reachable else 'database unreachable'
+    return jsonify(report), 200 if reachable else 503
+
+@app.route('/readyz')
+def readyz():
+    report, reachable = health_report()
+    ready = reachable and readiness.ready
+    # report['warmup'] carries the error, failure count and time to the next retry
+    report['status'] = ('ready' if ready else 'not ready' if not reachable
+                        else 'warm-up failed' if readiness.error else 'warming up')
+    return jsonify(report), 200 if ready else 503
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -272,18 +736,19 @@ def donor_register():
             latitude = np.random.uniform(12.0, 13.0)
             longitude = np.random.uniform(77.0, 78.0)
             
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
+            insert_sql = '''
                 INSERT INTO donors (user_id, name, email, phone, blood_group, age, location, 
                                  last_donation_date, health_status, latitude, longitude)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (session['user_id'], name, email, phone, blood_group, age, location, 
-                  last_donation, health_status, latitude, longitude))
-            
-            conn.commit()
-            conn.close()
+            '''
+            params = (session['user_id'], name, email, phone, blood_group, age, location, 
+                      last_donation, health_status, latitude, longitude)
+            if donor_shards:
+                donor_shards.insert_donor(insert_sql, params, latitude, longitude, email)
+            else:
+                donor_writer.submit(insert_sql, params)
+                # The donor sees their registration on their very next page
+                read_snapshot.catch_up()
             
             flash('Donor registered successfully!', 'success')
             return redirect(url_for('index'))
@@ -307,42 +772,67 @@ def patient_request():
             units_needed = int(request.form['units_needed'])
             urgency = request.form['urgency']
             
+            # Generate patient coordinates
+            patient_lat = np.random.uniform(12.0, 13.0)
+            patient_lon = np.random.uniform(77.0, 78.0)
+            
             conn = get_db_connection()
             cursor = conn.cursor()
             
             cursor.execute('''
-                INSERT INTO patients (user_id, name, email, phone, blood_group, age, location, units_needed, urgency)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (session['user_id'], name, email, phone, blood_group, age, location, units_needed, urgency))
+                INSERT INTO patients (user_id, name, email, phone, blood_group, age, location, units_needed, urgency,
+                                      latitude, longitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (session['user_id'], name, email, phone, blood_group, age, location, units_needed, urgency,
+                  patient_lat, patient_lon))
             
             patient_id = cursor.lastrowid
             conn.commit()
+            dashboard_events.publish('patient_request', {
+                'id': patient_id, 'name': name, 'blood_group': blood_group, 'units_needed': units_needed,
+                'urgency': urgency, 'status': 'Pending', 'request_date': datetime.now().strftime('%Y-%m-%d %H:%M')
+            })
             
-            # Find matching donors using KNN
-            donors_df = pd.read_sql('SELECT * FROM donors WHERE availability = "Available"', conn)
+            # Find matching donors using KNN, or with a sharded registry
+            # gather the nearest compatible donors from each region
+            if donor_shards:
+                # The density grid bounds the search to a radius that holds enough donors
+                radius_km = density_grid().search_radius_km(
+                    patient_lat, patient_lon, MATCH_CANDIDATES, BLOOD_COMPATIBILITY.get(blood_group, [blood_group]))
+                donors_df = pd.DataFrame(donor_shards.find_nearest_donors(
+                    blood_group, patient_lat, patient_lon, k=MATCH_CANDIDATES, radius_km=radius_km))
+            else:
+                donors_version, donors_df = donor_matcher.available_donors(conn)
             
             if not donors_df.empty:
-                matcher = DonorMatcher()
-                
-                # Generate patient coordinates
-                patient_lat = np.random.uniform(12.0, 13.0)
-                patient_lon = np.random.uniform(77.0, 78.0)
+                if donor_shards:
+                    matching_donors = donors_df.to_dict('records')
+                else:
+                    patient_features = {
+                        'blood_group': blood_group,
+                        'age': age,
+                        'location': location,
+                        'latitude': patient_lat,
+                        'longitude': patient_lon
+                    }
+                    
+                    matching_donors = donor_matcher.match_patient(patient_features, donors_df, donors_version,
+                                                                  k=MATCH_CANDIDATES)
+                # Nearest neighbours can be of any group; only contact donors whose blood the patient can take
+                matching_donors = callable_matches(conn, compatible_donors(matching_donors, blood_group), urgency,
+                                                   units_needed)
                 
-                patient_features = {
-                    'blood_group': blood_group,
-                    'age': age,
-                    'location': location,
-                    'last_donation_date': datetime.now().strftime('%Y-%m-%d'),
-                    'latitude': patient_lat,
-                    'longitude': patient_lon
-                }
-                
-                matching_donors = matcher.find_matching_donors(patient_features, donors_df)
-                
-                # Update patient status
-                cursor.execute('UPDATE patients SET status = ? WHERE id = ?', 
-                             ('Matched' if matching_donors else 'No Match', patient_id))
+                # Update patient status and queue donor notifications in one transaction
+                status = 'Matched' if matching_donors else 'No Match'
+                cursor.execute('UPDATE patients SET status = ? WHERE id = ?', (status, patient_id))
+                enqueue_donor_notifications(cursor, patient_id, {
+                    'blood_group': blood_group, 'units_needed': units_needed,
+                    'urgency': urgency, 'location': location
+                }, matching_donors)
                 conn.commit()
+                dashboard_events.publish('match_status', {'id': patient_id, 'status': status})
+                if matching_donors:
+                    notification_dispatcher.wake()
                 
                 conn.close()
                 
@@ -358,28 +848,165 @@ def patient_request():
     
     return render_template('patient_request.html')
 
+def compatible_donors(donors, blood_group):
+    """The donors whose blood a patient of blood_group can receive"""
+    compatible = BLOOD_COMPATIBILITY.get(blood_group, [])
+    return [donor for donor in donors if donor['blood_group'] in compatible]
+
+def callable_matches(conn, donors, urgency, units_needed=1):
+    """The best of donors who can be called within their urgency's window
+
+    At least MATCH_DONORS are kept, or one per unit needed when that is more.
+    """
+    start, end = availability_windows.time_range(hours=URGENCY_WINDOW_HOURS.get(urgency, 0))
+    donor_ids = [int(donor['id']) for donor in donors]
+    if donor_shards:
+        by_shard = {}
+        for donor_id in donor_ids:
+            by_shard.setdefault(donor_shards.shard_for_id(donor_id), []).append(donor_id)
+        callable_ids = set()
+        for shard, shard_ids in by_shard.items():
+            shard_conn = shard.connect()
+            try:
+                callable_ids |= availability_windows.callable_donors(shard_conn, shard_ids, start, end)
+            finally:
+                shard_conn.close()
+    else:
+        callable_ids = availability_windows.callable_donors(conn, donor_ids, start, end)
+    return [donor for donor in donors if int(donor['id']) in callable_ids][:max(MATCH_DONORS, int(units_needed))]
+
+def find_donors(query, regions=None):
+    """Run a DonorQuery against the donor shards or blood_bank.db"""
+    if query.latitude is not None and query.radius_km is None and query.counted_by_density():
+        # Nearest-first searches only need the area holding limit donors;
+        # the margin covers DonorQuery's equirectangular distances
+        radius_km = density_grid().search_radius_km(query.latitude, query.longitude, query.limit, query.groups())
+        if radius_km is not None:
+            query.radius_km = radius_km * 1.01
+    if donor_shards:
+        shards = donor_shards.by_name(regions) if regions else None
+        parts = donor_shards.scatter(query.run, shards)
+        donors = [donor for part in parts for donor in part]
+        if query.latitude is not None:
+            donors.sort(key=lambda donor: (donor['distance_km'], donor['id']))
+        else:
+            donors.sort(key=lambda donor: donor['id'])
+        return donors[:query.limit]
+    
+    conn = get_db_connection()
+    donors = query.run(conn)
+    conn.close()
+    return donors
+
 @app.route('/search/donors')
 def search_donors():
     blood_group = request.args.get('blood_group', '')
     location = request.args.get('location', '')
     
-    conn = get_db_connection()
+    try:
+        query = DonorQuery.from_args(request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return render_template('search_donors.html', donors=[], search_blood_group=blood_group)
     
-    query = 'SELECT * FROM donors WHERE availability = "Available"'
-    params = []
+    # ?region=north,south limits a sharded search to those shards
+    regions = request.args.get('region')
+    if query.is_basic() and not donor_shards:
+        equals = {'availability': 'Available'}
+        if blood_group:
+            equals['blood_group'] = blood_group
+        donors = read_snapshot.get('donors').search(equals, {'location': location} if location else None)
+    else:
+        donors = find_donors(query, regions.split(',') if regions else None)
     
-    if blood_group:
-        query += ' AND blood_group = ?'
-        params.append(blood_group)
+    return render_template('search_donors.html', donors=donors, search_blood_group=blood_group)
+
+@app.route('/api/donors/search')
+def api_search_donors():
+    try:
+        query = DonorQuery.from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    regions = request.args.get('region')
+    return jsonify(find_donors(query, regions.split(',') if regions else None))
+
+@app.route('/api/donors/density')
+def api_donor_density():
+    blood_group = request.args.get('blood_group') or None
+    compatible_for = request.args.get('compatible_for') or None
+    for name, group in [('blood_group', blood_group), ('compatible_for', compatible_for)]:
+        if group is not None and group not in BLOOD_COMPATIBILITY:
+            return jsonify({'error': f'Unknown {name}: {group}'}), 400
+    # ?availability=any counts every donor
+    availability = request.args.get('availability', 'Available')
+    if availability == 'any':
+        availability = None
+    groups = DonorQuery(blood_groups=[blood_group] if blood_group else None, compatible_for=compatible_for).groups()
     
-    if location:
-        query += ' AND location LIKE ?'
-        params.append(f'%{location}%')
+    grid = density_grid()
+    response = jsonify({
+        'cell_degrees': CELL_DEGREES,
+        'blood_groups': groups,
+        'availability': availability,
+        'cells': grid.heatmap(groups, availability),
+    })
+    version = grid.version if not isinstance(grid.version, tuple) else '.'.join(map(str, grid.version))
+    response.set_etag(f'density-{version}')
+    response.cache_control.private = True
+    response.cache_control.max_age = API_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+def donor_connection(donor_id):
+    """A connection to the database holding a donor, its shard when sharded"""
+    if donor_shards:
+        return donor_shards.shard_for_id(donor_id).connect()
+    return get_db_connection()
+
+@app.route('/api/donors/<int:donor_id>/availability', methods=['GET', 'POST'])
+@login_required
+def api_donor_availability(donor_id):
+    conn = donor_connection(donor_id)
+    donor = conn.execute('SELECT id, user_id FROM donors WHERE id = ?', (donor_id,)).fetchone()
+    if donor is None:
+        conn.close()
+        return jsonify({'error': 'Donor not found'}), 404
+    # Donors manage their own schedule, admins anyone's
+    if session.get('user_type') != 'admin' and donor['user_id'] != session.get('user_id'):
+        conn.close()
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        try:
+            availability_windows.add_windows(conn, donor_id, availability_windows.parse_windows(data))
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
+        windows = availability_windows.list_windows(conn, donor_id)
+        conn.close()
+        return jsonify(windows), 201
     
-    donors = conn.execute(query, params).fetchall()
+    windows = availability_windows.list_windows(conn, donor_id)
     conn.close()
+    return jsonify(windows)
+
+@app.route('/api/donors/<int:donor_id>/availability/<int:window_id>', methods=['DELETE'])
+@login_required
+def api_delete_donor_availability(donor_id, window_id):
+    conn = donor_connection(donor_id)
+    donor = conn.execute('SELECT id, user_id FROM donors WHERE id = ?', (donor_id,)).fetchone()
+    if donor is None:
+        conn.close()
+        return jsonify({'error': 'Donor not found'}), 404
+    if session.get('user_type') != 'admin' and donor['user_id'] != session.get('user_id'):
+        conn.close()
+        return jsonify({'error': 'Admin privileges required'}), 403
     
-    return render_template('search_donors.html', donors=donors, search_blood_group=blood_group)
+    deleted = availability_windows.delete_window(conn, donor_id, window_id)
+    conn.close()
+    if not deleted:
+        return jsonify({'error': 'Window not found'}), 404
+    return jsonify({'deleted': window_id})
 
 @app.route('/admin/dashboard')
 @login_required
@@ -391,7 +1018,11 @@ def admin_dashboard():
     conn = get_db_connection()
     
     # Get statistics
-    total_donors = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
+    if donor_shards:
+        total_donors = sum(donor_shards.scatter(lambda shard_conn: shard_conn.execute(
+            'SELECT COUNT(*) FROM donors').fetchone()[0]))
+    else:
+        total_donors = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
     total_patients = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
     blood_inventory = conn.execute('SELECT * FROM blood_inventory').fetchall()
     recent_requests = conn.execute('SELECT * FROM patients ORDER BY request_date DESC LIMIT 10').fetchall()
@@ -404,24 +1035,414 @@ def admin_dashboard():
                          blood_inventory=blood_inventory,
                          recent_requests=recent_requests)
 
-@app.route('/api/donors')
-def api_donors():
+@app.route('/admin/slow-queries')
+@login_required
+def admin_slow_queries():
+    if session.get('user_type') != 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    records = slow_queries.read_log()
+    return render_template('slow_queries.html',
+                         queries=slow_queries.worst_offenders(records),
+                         record_count=len(records),
+                         threshold_ms=slow_queries.threshold_ms())
+
+@app.route('/admin/allocate', methods=['POST'])
+@login_required
+def admin_allocate():
+    if session.get('user_type') != 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    
     conn = get_db_connection()
-    donors = conn.execute('SELECT * FROM donors').fetchall()
+    summary = run_allocation(conn, shards=donor_shards)
     conn.close()
+    read_snapshot.catch_up()
+    dashboard_events.publish('allocation', summary)
     
-    donors_list = [dict(donor) for donor in donors]
-    return jsonify(donors_list)
+    flash(f"Allocated {summary['units_allocated']} of {summary['units_requested']} requested units "
+          f"across {summary['patients_considered']} pending patients.", 'success')
+    return redirect(url_for('admin_dashboard'))
 
-@app.route('/api/inventory')
-def api_inventory():
+@app.route('/api/allocations', methods=['GET', 'POST'])
+@login_required
+def api_allocations():
+    if request.method == 'POST':
+        if session.get('user_type') != 'admin':
+            return jsonify({'error': 'Admin privileges required'}), 403
+        candidates = request.args.get('candidates', str(DEFAULT_CANDIDATES)).strip()
+        if not candidates.isdigit() or not 1 <= int(candidates) <= MAX_CANDIDATES:
+            return jsonify({'error': f'candidates must be a whole number between 1 and {MAX_CANDIDATES}'}), 400
+        conn = get_db_connection()
+        summary = run_allocation(conn, candidates=int(candidates), shards=donor_shards)
+        conn.close()
+        read_snapshot.catch_up()
+        dashboard_events.publish('allocation', summary)
+        return jsonify(summary)
+    
+    conn = get_db_connection()
+    allocations = conn.execute('SELECT * FROM donor_allocations ORDER BY patient_id, id').fetchall()
+    conn.close()
+    
+    return jsonify([dict(allocation) for allocation in allocations])
+
+@app.route('/api/inventory/reservations', methods=['GET', 'POST'])
+@login_required
+def api_reservations():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    conn = get_db_connection()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or request.form
+        blood_group = data.get('blood_group')
+        try:
+            # Form fields arrive as text; JSON units must already be whole,
+            # so 1.7 is refused rather than truncated
+            units = data.get('units')
+            if isinstance(units, str) and units.strip().isdigit():
+                units = int(units)
+            ttl_minutes = float(data.get('ttl_minutes', reservations.DEFAULT_TTL_MINUTES))
+            patient_id = int(data['patient_id']) if data.get('patient_id') else None
+            reservation_id = reservations.reserve(conn, blood_group, units, patient_id, ttl_minutes)
+        except (TypeError, ValueError) as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
+        if reservation_id is None:
+            item = conn.execute('SELECT units_available FROM blood_inventory WHERE blood_group = ?',
+                                (blood_group,)).fetchone()
+            conn.close()
+            if item is None:
+                return jsonify({'error': f'Unknown blood group: {blood_group}'}), 400
+            return jsonify({'error': f"Only {item['units_available']} units of {blood_group} available"}), 409
+        inventory_changed(conn, [blood_group])
+        reservation = conn.execute('SELECT * FROM inventory_reservations WHERE id = ?', (reservation_id,)).fetchone()
+        conn.close()
+        return jsonify(dict(reservation)), 201
+    
+    limit = request.args.get('limit', reservations.DEFAULT_LIST_LIMIT, type=int)
+    if limit < 1:
+        conn.close()
+        return jsonify({'error': f'limit must be between 1 and {reservations.MAX_LIST_LIMIT}'}), 400
+    returned = reservations.expire_reservations(conn)
+    if returned:
+        inventory_changed(conn, returned)
+    query = 'SELECT * FROM inventory_reservations'
+    params = []
+    status = request.args.get('status')
+    if status:
+        query += ' WHERE status = ?'
+        params.append(status)
+    query += ' ORDER BY id DESC LIMIT ?'
+    params.append(min(limit, reservations.MAX_LIST_LIMIT))
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    
+    return jsonify([dict(row) for row in rows])
+
+@app.route('/api/inventory/reservations/<int:reservation_id>/<action>', methods=['POST'])
+@login_required
+def api_close_reservation(reservation_id, action):
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    if action not in ('release', 'consume'):
+        return jsonify({'error': f'Unknown action: {action}'}), 404
+    
     conn = get_db_connection()
-    inventory = conn.execute('SELECT * FROM blood_inventory').fetchall()
+    if action == 'release':
+        blood_group = reservations.release(conn, reservation_id)
+    else:
+        blood_group = reservations.consume(conn, reservation_id)
+    if blood_group is None:
+        conn.close()
+        return jsonify({'error': 'Reservation is not active'}), 409
+    if action == 'release':
+        inventory_changed(conn, [blood_group])
+    reservation = conn.execute('SELECT * FROM inventory_reservations WHERE id = ?', (reservation_id,)).fetchone()
     conn.close()
     
-    inventory_list = [dict(item) for item in inventory]
-    return jsonify(inventory_list)
+    return jsonify(dict(reservation))
+
+@app.route('/api/stream/dashboard')
+@login_required
+def stream_dashboard():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    # Browsers send Last-Event-ID on reconnect so missed events are replayed
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    return app.response_class(
+        dashboard_events.stream(last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/reports/requests')
+@login_required
+def api_request_report():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    granularity = request.args.get('granularity', 'daily')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+    
+    conn = get_db_connection()
+    rows = request_report(
+        conn, granularity,
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+        blood_group=request.args.get('blood_group'),
+        urgency=request.args.get('urgency')
+    )
+    conn.close()
+    
+    return jsonify([dict(row) for row in rows])
+
+@app.route('/api/patients/history')
+@login_required
+def api_patient_history():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    conn = get_db_connection()
+    rows = patient_history(
+        conn,
+        blood_group=request.args.get('blood_group'),
+        status=request.args.get('status'),
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+        limit=min(request.args.get('limit', 100, type=int), 10000)
+    )
+    conn.close()
+    
+    return jsonify([dict(row) for row in rows])
+
+@app.route('/api/archive/run', methods=['POST'])
+@login_required
+def api_archive_run():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    conn = get_db_connection()
+    moved = archive_closed_requests(conn, request.args.get('days', ARCHIVE_AFTER_DAYS, type=int))
+    conn.close()
+    
+    return jsonify({'archived': moved})
+
+@app.route('/api/backups', methods=['GET', 'POST'])
+@login_required
+def api_backups():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    if request.method == 'POST':
+        try:
+            return jsonify(backup_service.backup_now()), 201
+        except (sqlite3.Error, OSError) as e:
+            return jsonify({'error': f'Backup failed: {e}'}), 500
+    
+    return jsonify(backup_service.report())
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild the request rollup tables from hot and archived requests"""
+    conn = attach_archive(get_db_connection())
+    backfill_rollups(conn, sources=('main.patients', 'archive.patients'))
+    conn.close()
+    print('Request rollups rebuilt.')
+
+@app.cli.command('archive-requests')
+@click.option('--days', default=ARCHIVE_AFTER_DAYS, help='Archive closed requests older than this many days.')
+def archive_requests_command(days):
+    """Move old closed patient requests into the archive database"""
+    conn = get_db_connection()
+    moved = archive_closed_requests(conn, days)
+    conn.close()
+    print(f'Archived {moved} requests.')
+
+@app.cli.command('backup-db')
+def backup_db_command():
+    """Take an online snapshot of every database and prune old ones"""
+    run = backup_service.backup_now()
+    for db_path, stats in run['databases'].items():
+        print(f"Backed up {db_path}: {stats['pages']} pages ({stats['bytes']} bytes) to {stats['path']} in {stats['seconds']}s, "
+              f"{stats['steps']} steps, {stats['restarts']} restarts.")
+    for db_path in run['skipped']:
+        print(f'Skipped {db_path}: no such file')
+    for path in run['pruned']:
+        print(f'Pruned {path}')
+
+@app.cli.command('restore-backup')
+@click.argument('scratch_dir')
+@click.option('--at', 'at', default=None, help='Restore the newest snapshots taken at or before this time (YYYY-MM-DD HH:MM:SS).')
+@click.option('--snapshot', default=None, help='Restore only this snapshot file instead.')
+def restore_backup_command(scratch_dir, at, snapshot):
+    """Restore the main, archive and shard snapshots into SCRATCH_DIR and verify them, leaving the live databases alone"""
+    try:
+        if snapshot is None:
+            results = backup_service.restore(scratch_dir, datetime.strptime(at, '%Y-%m-%d %H:%M:%S') if at else None)
+        else:
+            os.makedirs(scratch_dir, exist_ok=True)
+            result = restore_snapshot(snapshot, os.path.join(scratch_dir, os.path.basename(snapshot)))
+            results = {snapshot: dict(result, snapshot=snapshot)}
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if results.get(backup_service.db_path, True) is None:
+        raise click.ClickException('No snapshot found.')
+    failures = []
+    for db_path, result in results.items():
+        if result is None:
+            print(f'{db_path}: no snapshot, skipped')
+            continue
+        print(f"Restored {result['snapshot']} to {scratch_dir} in {result['seconds']}s: "
+              f"integrity {'ok' if result['ok'] else 'FAILED'}")
+        for table, count in sorted(result['tables'].items()):
+            print(f'  {table}: {count} rows')
+        if not result['ok']:
+            failures.append(f"{db_path}: {'; '.join(result['integrity'])}")
+    if failures:
+        raise click.ClickException(' | '.join(failures))
+
+@app.cli.command('migrate-donors-to-shards')
+@click.option('--batch-size', default=500, help='Donors moved per commit.')
+def migrate_donors_command(batch_size):
+    """Move donors registered before sharding out of blood_bank.db into their shards"""
+    if not donor_shards:
+        raise click.ClickException('BLOOD_BANK_SHARDS is not set.')
+    init_db()
+    conn = get_db_connection()
+    moved = donor_shards.migrate_donors(conn, [('donor_allocations', 'donor_id'), ('notification_outbox', 'donor_id')],
+                                        batch_size)
+    conn.close()
+    print(f'Moved {moved} donors into {len(donor_shards.shards)} shards.')
+
+@app.cli.command('expire-reservations')
+def expire_reservations_command():
+    """Return the units of overdue inventory reservations"""
+    conn = get_db_connection()
+    returned = reservations.expire_reservations(conn)
+    conn.close()
+    for blood_group, units in sorted(returned.items()):
+        print(f'{blood_group}: {units} units returned')
+    print(f'Expired reservations returned {sum(returned.values())} units.')
+
+@app.cli.command('purge-availability-windows')
+def purge_availability_windows_command():
+    """Delete donor availability windows that have already ended"""
+    conns = [shard.connect() for shard in donor_shards.shards] if donor_shards else [get_db_connection()]
+    deleted = 0
+    for conn in conns:
+        deleted += availability_windows.purge_past_windows(conn)
+        conn.close()
+    print(f'Purged {deleted} ended availability windows.')
+
+@app.cli.command('refit-features')
+def refit_features_command():
+    """Refit the matcher's feature scaling from the current donors"""
+    if donor_shards:
+        donors_df = pd.concat(donor_shards.scatter(lambda shard_conn: pd.read_sql('SELECT * FROM donors', shard_conn)),
+                              ignore_index=True)
+    else:
+        conn = get_db_connection()
+        donors_df = pd.read_sql('SELECT * FROM donors', conn)
+        conn.close()
+    schema = FeatureSchema.fit(donors_df)
+    schema.save(FEATURE_SCHEMA_PATH)
+    print(f'Feature schema {schema.fingerprint} fitted from {len(donors_df)} donors.')
+
+@app.cli.command('check-search-plans')
+@click.option('--live', is_flag=True, help='Plan against blood_bank.db and its statistics instead of a fresh schema.')
+def check_search_plans_command(live):
+    """Fail if any donor search filter combination plans a table scan"""
+    if live:
+        init_db()
+        conn = get_db_connection()
+    else:
+        # The schema a search runs against, shard or not, built from scratch
+        conn = sqlite3.connect(':memory:')
+        init_donor_shard(conn.cursor())
+    problems = check_plans(conn)
+    conn.close()
+    for combo, sql, plan in problems:
+        print(f"{' + '.join(combo) or 'no filters'}:")
+        for line in plan:
+            print(f'    {line}')
+    if problems:
+        raise SystemExit(f'{len(problems)} search plans regressed.')
+    print('All donor search plans use their index.')
+
+@app.cli.command('rematch-pending')
+@click.option('--workers', type=int, default=None,
+              help='Worker processes; defaults to BLOOD_BANK_MATCH_WORKERS or one per core.')
+def rematch_pending_command(workers):
+    """Match every Pending or No Match request against the available donors"""
+    conn = get_db_connection()
+    patients_df = pd.read_sql("SELECT * FROM patients WHERE status IN ('Pending', 'No Match')", conn)
+    donor_query = 'SELECT * FROM donors WHERE availability = "Available"'
+    if donor_shards:
+        donors_df = pd.concat(donor_shards.scatter(lambda shard_conn: pd.read_sql(donor_query, shard_conn)),
+                              ignore_index=True)
+    else:
+        donors_df = pd.read_sql(donor_query, conn)
+    if patients_df.empty or donors_df.empty:
+        conn.close()
+        print(f'Nothing to match: {len(patients_df)} open requests, {len(donors_df)} available donors.')
+        return
+    
+    matches = donor_matcher.match_batch(patients_df, donors_df, k=min(MATCH_CANDIDATES, len(donors_df)),
+                                        workers=workers)
+    
+    # The same filters as a new request: compatible blood, callable in time
+    cursor = conn.cursor()
+    matched = 0
+    for patient, donors in zip(patients_df.to_dict('records'), matches):
+        donors = callable_matches(conn, compatible_donors(donors, patient['blood_group']), patient['urgency'],
+                                  patient['units_needed'])
+        status = 'Matched' if donors else 'No Match'
+        cursor.execute('UPDATE patients SET status = ? WHERE id = ?', (status, patient['id']))
+        enqueue_donor_notifications(cursor, patient['id'], patient, donors)
+        matched += bool(donors)
+    conn.commit()
+    conn.close()
+    print(f'Matched {matched} of {len(matches)} requests against {len(donors_df)} donors.')
+
+@app.route('/api/notifications')
+@login_required
+def api_notifications():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    query = '''
+        SELECT id, patient_id, donor_id, recipient, status, attempts, next_attempt_at, last_error,
+               created_date, sent_date
+        FROM notification_outbox
+    '''
+    params = []
+    if request.args.get('patient_id'):
+        query += ' WHERE patient_id = ?'
+        params.append(request.args.get('patient_id', type=int))
+    query += ' ORDER BY id DESC LIMIT 500'
+    
+    conn = get_db_connection()
+    notifications = conn.execute(query, params).fetchall()
+    conn.close()
+    
+    return jsonify([dict(notification) for notification in notifications])
+
+@app.route('/api/donors')
+def api_donors():
+    return conditional_json('donors', donor_shards)
+
+@app.route('/api/inventory')
+def api_inventory():
+    return conditional_json('blood_inventory')
 
 if __name__ == '__main__':
     init_db()
+    readiness.run(warm_up)
+    backup_service.start()
+    # Deliver anything left in the outbox by a previous run
+    notification_dispatcher.wake()
     app.run(debug=True, host='0.0.0.0', port=5000)
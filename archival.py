@@ -0,0 +1,104 @@
+"""Hot/cold archival of closed patient requests into an attached database"""
+
+ARCHIVE_PATH = 'blood_bank_archive.db'
+# Closed requests older than this many days move to the archive
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+
+# Requests in these states will not change again
+CLOSED_STATUSES = ('Allocated',)
+
+
+def patient_columns(conn, schema='main'):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info(patients)')]
+
+
+def attach_archive(conn, path=ARCHIVE_PATH):
+    """Attach the archive database as 'archive' unless it already is"""
+    attached = [row[1] for row in conn.execute('PRAGMA database_list')]
+    if 'archive' not in attached:
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    return conn
+
+
+def init_archive(cursor):
+    """Bring the attached archive's patients table in line with main's
+
+    Runs inside init_db's schema setup, after the hot patients table and
+    its migrations, so the read and archive paths never issue DDL.
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS archive.patients AS SELECT * FROM main.patients WHERE 0')
+    # Columns added to the hot table after the archive was created
+    archived = set(patient_columns(cursor, 'archive'))
+    for row in cursor.execute('PRAGMA main.table_info(patients)').fetchall():
+        if row[1] not in archived:
+            cursor.execute(f'ALTER TABLE archive.patients ADD COLUMN {row[1]} {row[2]}')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_archive_patients_id ON patients (id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_patients_date ON patients (request_date)')
+
+
+def archive_closed_requests(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move closed requests older than the cutoff to the archive in batches
+
+    Each batch is copied and deleted in short transactions so writers
+    are never blocked for long. SQLite only commits across two database
+    files atomically with a rollback journal, not under WAL, so the copy
+    is committed to the archive before the rows are deleted from main,
+    and only rows the archive holds are deleted. Copies use INSERT OR
+    REPLACE, so an interrupted run is safe to repeat. Returns the number
+    of rows moved.
+    """
+    attach_archive(conn)
+    columns = ', '.join(patient_columns(conn))
+    placeholders = ', '.join('?' for _ in CLOSED_STATUSES)
+    cutoff = f'-{int(older_than_days)} days'
+    moved = 0
+
+    while True:
+        ids = [row[0] for row in conn.execute(f'''
+            SELECT id FROM main.patients
+            WHERE status IN ({placeholders}) AND request_date < datetime('now', ?)
+            ORDER BY id LIMIT ?
+        ''', (*CLOSED_STATUSES, cutoff, batch_size)).fetchall()]
+        if not ids:
+            break
+
+        id_list = ', '.join('?' for _ in ids)
+        conn.execute(f'INSERT OR REPLACE INTO archive.patients ({columns}) '
+                     f'SELECT {columns} FROM main.patients WHERE id IN ({id_list})', ids)
+        conn.commit()
+        conn.execute(f'DELETE FROM main.patients WHERE id IN ({id_list}) '
+                     f'AND id IN (SELECT id FROM archive.patients WHERE id IN ({id_list}))', ids + ids)
+        conn.commit()
+        moved += len(ids)
+
+    return moved
+
+
+def patient_history(conn, blood_group=None, status=None, start=None, end=None, limit=100):
+    """Query hot and archived requests together, newest first"""
+    attach_archive(conn)
+    clauses, params = [], []
+    if blood_group:
+        clauses.append('blood_group = ?')
+        params.append(blood_group)
+    if status:
+        clauses.append('status = ?')
+        params.append(status)
+    if start:
+        clauses.append('request_date >= ?')
+        params.append(start)
+    if end:
+        clauses.append('request_date <= ?')
+        params.append(end)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    columns = ', '.join(patient_columns(conn))
+    return conn.execute(f'''
+        SELECT * FROM (
+            SELECT {columns} FROM main.patients
+            UNION ALL
+            SELECT {columns} FROM archive.patients
+        ) {where}
+        ORDER BY request_date DESC LIMIT ?
+    ''', (*params, limit)).fetchall()
@@ -0,0 +1,347 @@
+"""Donor availability windows behind an interval index
+
+A donor's availability column says whether they donate at all; windows
+say when they can be called. An 'available' window is either one-off
+(from one date and time to another) or weekly (a weekday and time of
+day, optionally only between two dates). An 'away' window is a one-off
+absence such as a holiday. Donors without available windows can be
+called at any time they are not away.
+
+Triggers keep every window in an R*Tree for its shape: one-off
+available windows and away windows each on a time axis, weekly windows
+on a minute-of-the-week axis and a second axis for the dates they are
+valid between. "Which windows cover time T" is then a stabbing query
+costing about log(windows) plus the matches, instead of a read of every
+schedule. Each shape has its own tree because an axis on which boxes
+have no extent, such as a kind, gives every box zero area and leaves
+the R*Tree nothing to choose nodes by. A window's id is its donor's id
+shifted left WINDOW_ID_BITS plus a number of its own, so the trees
+yield donors straight from the ids they store instead of looking each
+match up.
+
+Times are naive local datetimes, stored as minutes since 1970-01-01.
+"""
+from datetime import date, datetime, timedelta
+
+KINDS = ('available', 'away')
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+EPOCH = datetime(1970, 1, 1)
+# Open ends of the time axis; rtree_i32 coordinates are 32-bit integers
+NO_START, NO_END = -2 ** 31, 2 ** 31 - 1
+# Low bits of a window id that number the donor's windows
+WINDOW_ID_BITS = 16
+# Longest one-off window accepted, so a typo cannot block a donor for decades
+MAX_WINDOW_DAYS = 366
+
+
+def to_minutes(moment):
+    return int((moment - EPOCH).total_seconds() // 60)
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+
+def minute_of_week(minutes):
+    """Minute of the week, Monday 00:00 being 0, of a time in minutes since 1970"""
+    # 1970-01-01 was a Thursday
+    return (minutes + 3 * MINUTES_PER_DAY) % MINUTES_PER_WEEK
+
+
+# R*Tree per window shape: (axes, which windows, their coordinates). The
+# boxes are closed and windows half-open, hence the - 1 on every end.
+INDEXES = {
+    'donor_available_index': ('time_min, time_max', "{row}.kind = 'available' AND NOT {row}.weekly",
+                              '{row}.starts, {row}.ends - 1'),
+    'donor_weekly_index': ('week_min, week_max, time_min, time_max', '{row}.weekly',
+                           f'{{row}}.starts, {{row}}.ends - 1, IFNULL({{row}}.valid_from, {NO_START}), '
+                           f'IFNULL({{row}}.valid_until, {NO_END} + 1) - 1'),
+    'donor_away_index': ('time_min, time_max', "{row}.kind = 'away'", '{row}.starts, {row}.ends - 1'),
+}
+
+
+def index_sql(row):
+    """Add a donor_windows row (NEW) to the index for its shape"""
+    return ''.join(f'INSERT INTO {name} SELECT {row}.id, {values.format(row=row)} '
+                   f'WHERE {condition.format(row=row)};\n'
+                   for name, (_, condition, values) in INDEXES.items())
+
+
+def unindex_sql(row):
+    return ''.join(f'DELETE FROM {name} WHERE id = {row}.id;\n' for name in INDEXES)
+
+
+def count_sql(row, delta):
+    """Add delta to the available window count of row's donor"""
+    return f'''
+        INSERT INTO donor_schedules (donor_id, windows) SELECT {row}.donor_id, {delta}
+        WHERE {row}.kind = 'available'
+        ON CONFLICT (donor_id) DO UPDATE SET windows = windows + excluded.windows;
+        DELETE FROM donor_schedules WHERE donor_id = {row}.donor_id AND windows <= 0;
+    '''
+
+
+def init_windows(cursor):
+    """Create donor_windows, its interval index and the triggers that keep them current"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS donor_windows (
+            id INTEGER PRIMARY KEY CHECK (id >> {WINDOW_ID_BITS} = donor_id),
+            donor_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('available', 'away')),
+            weekly INTEGER NOT NULL DEFAULT 0 CHECK (weekly = 0 OR kind = 'available'),
+            starts INTEGER NOT NULL,
+            ends INTEGER NOT NULL,
+            valid_from INTEGER,
+            valid_until INTEGER,
+            created TEXT DEFAULT CURRENT_TIMESTAMP,
+            CHECK (starts < ends AND (weekly = 0 OR (starts >= 0 AND ends <= {MINUTES_PER_WEEK}))),
+            FOREIGN KEY (donor_id) REFERENCES donors (id)
+        )
+    ''')
+    for name, (axes, _, _) in INDEXES.items():
+        cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING rtree_i32(id, {axes})')
+    # Available window count per donor with any, the "has a schedule" test
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS donor_schedules (
+            donor_id INTEGER PRIMARY KEY,
+            windows INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_windows_on_insert AFTER INSERT ON donor_windows
+        BEGIN
+            {index_sql('NEW')}
+            {count_sql('NEW', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_windows_on_delete AFTER DELETE ON donor_windows
+        BEGIN
+            {unindex_sql('OLD')}
+            {count_sql('OLD', -1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_windows_on_update AFTER UPDATE ON donor_windows
+        BEGIN
+            {unindex_sql('OLD')}
+            {index_sql('NEW')}
+            {count_sql('OLD', -1)}
+            {count_sql('NEW', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_windows_on_donor_delete AFTER DELETE ON donors
+        BEGIN
+            DELETE FROM donor_windows WHERE id BETWEEN OLD.id << {WINDOW_ID_BITS} AND ((OLD.id + 1) << {WINDOW_ID_BITS}) - 1;
+        END
+    ''')
+
+
+def parse_moment(value, name):
+    """A datetime from 'YYYY-MM-DD HH:MM', the ISO 'T' form, or a date meaning its midnight"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    text = str(value or '').strip().replace('T', ' ')
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f'{name} must be a YYYY-MM-DD HH:MM date and time')
+
+
+def parse_time_of_day(value, name):
+    try:
+        moment = datetime.strptime(str(value or '').strip(), '%H:%M')
+    except ValueError:
+        raise ValueError(f'{name} must be a HH:MM time') from None
+    return moment.hour * 60 + moment.minute
+
+
+def parse_windows(data):
+    """donor_windows rows (kind, weekly, starts, ends, valid_from, valid_until) for a request
+
+    One-off windows give starts and ends; weekly ones give weekdays
+    (names or a comma-separated string), start_time and end_time, and
+    optionally valid_from and valid_until dates. A weekly window ending
+    at or before its start runs past midnight, so one given for
+    Sunday 22:00-02:00 becomes two rows, Sunday night and Monday morning.
+    Raises ValueError for anything malformed.
+    """
+    kind = data.get('kind') or 'available'
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+
+    weekdays = data.get('weekdays')
+    if not weekdays:
+        starts = to_minutes(parse_moment(data.get('starts'), 'starts'))
+        ends = to_minutes(parse_moment(data.get('ends'), 'ends'))
+        if ends <= starts:
+            raise ValueError('ends must be after starts')
+        if ends - starts > MAX_WINDOW_DAYS * MINUTES_PER_DAY:
+            raise ValueError(f'A window may last at most {MAX_WINDOW_DAYS} days')
+        return [(kind, 0, starts, ends, None, None)]
+
+    if kind != 'available':
+        raise ValueError('Only available windows can repeat weekly')
+    if isinstance(weekdays, str):
+        weekdays = weekdays.split(',')
+    days = []
+    for day in weekdays:
+        day = str(day).strip().lower()[:3]
+        if day not in WEEKDAYS:
+            raise ValueError(f"weekdays must be among {', '.join(WEEKDAYS)}")
+        days.append(WEEKDAYS.index(day))
+    start_time = parse_time_of_day(data.get('start_time'), 'start_time')
+    end_time = parse_time_of_day(data.get('end_time'), 'end_time')
+    length = (end_time - start_time) % MINUTES_PER_DAY or MINUTES_PER_DAY
+    valid_from = data.get('valid_from')
+    valid_until = data.get('valid_until')
+    valid_from = to_minutes(parse_moment(valid_from, 'valid_from')) if valid_from else None
+    valid_until = to_minutes(parse_moment(valid_until, 'valid_until')) if valid_until else None
+    if valid_from is not None and valid_until is not None and valid_until <= valid_from:
+        raise ValueError('valid_until must be after valid_from')
+
+    rows = []
+    for day in sorted(set(days)):
+        starts = day * MINUTES_PER_DAY + start_time
+        ends = starts + length
+        if ends <= MINUTES_PER_WEEK:
+            rows.append((kind, 1, starts, ends, valid_from, valid_until))
+        else:
+            rows.append((kind, 1, starts, MINUTES_PER_WEEK, valid_from, valid_until))
+            rows.append((kind, 1, 0, ends - MINUTES_PER_WEEK, valid_from, valid_until))
+    return rows
+
+
+def window_ids(donor_id):
+    """The first and last window id a donor can have"""
+    low = donor_id << WINDOW_ID_BITS
+    return low, low + (1 << WINDOW_ID_BITS) - 1
+
+
+def free_window_ids(conn, donor_id, count):
+    """count unused window ids for a donor, after its newest if there is room"""
+    low, high = window_ids(donor_id)
+    last = conn.execute('SELECT MAX(id) FROM donor_windows WHERE id BETWEEN ? AND ?', (low, high)).fetchone()[0]
+    first = low if last is None else last + 1
+    if first + count - 1 <= high:
+        return list(range(first, first + count))
+    used = {row[0] for row in conn.execute('SELECT id FROM donor_windows WHERE id BETWEEN ? AND ?', (low, high))}
+    free = [window_id for window_id in range(low, high + 1) if window_id not in used][:count]
+    if len(free) < count:
+        raise ValueError(f'A donor can have at most {1 << WINDOW_ID_BITS} windows')
+    return free
+
+
+def add_windows(conn, donor_id, rows):
+    """Insert parse_windows rows for a donor and commit; returns the new ids"""
+    # Take the write lock first so concurrent adds cannot pick the same ids
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        ids = free_window_ids(conn, donor_id, len(rows))
+        conn.executemany(
+            'INSERT INTO donor_windows (id, donor_id, kind, weekly, starts, ends, valid_from, valid_until) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(window_id, donor_id) + tuple(row) for window_id, row in zip(ids, rows)]
+        )
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return ids
+
+
+def delete_window(conn, donor_id, window_id):
+    """Delete one of a donor's windows; True if it existed"""
+    deleted = conn.execute('DELETE FROM donor_windows WHERE id = ? AND id BETWEEN ? AND ?',
+                           (window_id,) + window_ids(donor_id)).rowcount
+    conn.commit()
+    return deleted == 1
+
+
+def purge_past_windows(conn, before=None):
+    """Delete one-off windows, and weekly ones past valid_until, that ended before before (default: now)"""
+    cutoff = to_minutes(before or datetime.now())
+    deleted = conn.execute(
+        'DELETE FROM donor_windows WHERE CASE WHEN weekly THEN valid_until ELSE ends END <= ?', (cutoff,)
+    ).rowcount
+    conn.commit()
+    return deleted
+
+
+def describe(row):
+    """A donor_windows row as a dict with readable times"""
+    window = {'id': row['id'], 'donor_id': row['donor_id'], 'kind': row['kind'], 'weekly': bool(row['weekly'])}
+    if row['weekly']:
+        starts, ends = row['starts'], row['ends']
+        window['weekday'] = WEEKDAYS[starts // MINUTES_PER_DAY]
+        window['start_time'] = f'{starts % MINUTES_PER_DAY // 60:02d}:{starts % 60:02d}'
+        window['end_time'] = f'{(ends - starts // MINUTES_PER_DAY * MINUTES_PER_DAY) // 60 % 24:02d}:{ends % 60:02d}'
+        for name in ('valid_from', 'valid_until'):
+            window[name] = from_minutes(row[name]).strftime('%Y-%m-%d %H:%M') if row[name] is not None else None
+    else:
+        window['starts'] = from_minutes(row['starts']).strftime('%Y-%m-%d %H:%M')
+        window['ends'] = from_minutes(row['ends']).strftime('%Y-%m-%d %H:%M')
+    return window
+
+
+def list_windows(conn, donor_id):
+    rows = conn.execute('SELECT * FROM donor_windows WHERE id BETWEEN ? AND ? ORDER BY weekly, starts, id',
+                        window_ids(donor_id)).fetchall()
+    return [describe(row) for row in rows]
+
+
+def time_range(start=None, hours=None):
+    """(start, end) minutes for "at start" or "within hours of start"; start defaults to now"""
+    start = to_minutes(start or datetime.now())
+    return start, start + max(int(round((hours or 0) * 60)), 1)
+
+
+def week_ranges(start, end):
+    """Closed minute-of-week ranges covered by the minutes [start, end)"""
+    if end - start >= MINUTES_PER_WEEK:
+        return [(0, MINUTES_PER_WEEK - 1)]
+    first, last = minute_of_week(start), minute_of_week(end - 1)
+    if first <= last:
+        return [(first, last)]
+    return [(first, MINUTES_PER_WEEK - 1), (0, last)]
+
+
+def callable_sql(start, end, donor_id='donors.id'):
+    """A condition, and its parameters, true for donors who can be called during [start, end)
+
+    The donor must have an available window overlapping the range, or no
+    available windows at all, and must not be away for the whole range.
+    The window lookups are stabbing queries on the R*Trees, evaluated
+    once per statement rather than once per donor.
+    """
+    overlapping = [f'SELECT id >> {WINDOW_ID_BITS} FROM donor_available_index WHERE time_min < ? AND time_max >= ?']
+    params = [end, start]
+    for low, high in week_ranges(start, end):
+        overlapping.append(f'SELECT id >> {WINDOW_ID_BITS} FROM donor_weekly_index '
+                           'WHERE week_min <= ? AND week_max >= ? AND time_min < ? AND time_max >= ?')
+        params.extend([high, low, end, start])
+    sql = (f"({donor_id} IN ({' UNION ALL '.join(overlapping)}) "
+           f'OR NOT EXISTS (SELECT 1 FROM donor_schedules WHERE donor_schedules.donor_id = {donor_id})) '
+           f'AND {donor_id} NOT IN (SELECT id >> {WINDOW_ID_BITS} FROM donor_away_index '
+           'WHERE time_min <= ? AND time_max >= ?)')
+    params.extend([start, end - 1])
+    return sql, params
+
+
+def callable_donors(conn, donor_ids, start, end):
+    """The subset of donor_ids who can be called during [start, end)"""
+    donor_ids = list(donor_ids)
+    if not donor_ids:
+        return set()
+    condition, params = callable_sql(start, end, 'id')
+    rows = conn.execute(
+        f"SELECT id FROM donors WHERE id IN ({', '.join('?' for _ in donor_ids)}) AND {condition}",
+        donor_ids + params
+    ).fetchall()
+    return {row[0] for row in rows}
@@ -0,0 +1,261 @@
+"""Online backups of the live database with timestamped snapshots
+
+Snapshots are taken with SQLite's online backup API a few hundred pages
+at a time, pausing between steps. Under WAL the copy runs inside one
+read transaction, so it captures a single point in time while writers
+carry on. Without WAL the source is only locked for one step at a time,
+but a write from another connection restarts the copy; if that keeps
+happening it finishes with a single-step copy. Snapshots are written
+under a temporary name and renamed into place, so a snapshot file is
+always complete.
+
+A BackupService covers several database files, the main one plus the
+archive and any donor shards, each with its own series of snapshots
+named after the file. The files are copied one after another, so each
+snapshot is consistent on its own but the set is not one point in time.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+BACKUP_DIR = 'backups'
+# Pages copied per step and the pause between steps
+PAGES_PER_STEP = 256
+STEP_PAUSE_SECONDS = 0.005
+# Stepped attempts abandoned because writers kept restarting them
+MAX_RESTARTS = 3
+# Snapshots kept by the scheduled service
+KEEP_SNAPSHOTS = 24
+
+SNAPSHOT_PATTERN = re.compile(r'^(?P<name>.+)-(?P<taken>\d{8}-\d{6})\.db$')
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def online_backup(source_path, dest_path, pages=PAGES_PER_STEP, pause=STEP_PAUSE_SECONDS, max_restarts=MAX_RESTARTS):
+    """Copy source_path to dest_path without holding up readers or writers
+
+    Returns a dict with the seconds taken, pages copied, number of steps
+    and restarts, and whether it fell back to a single-step copy.
+    max_restarts=None never falls back.
+    """
+    tmp_path = f'{dest_path}.{os.getpid()}.tmp'
+    stats = {'steps': 0, 'restarts': 0, 'single_step': False}
+    remaining_before = [None]
+
+    def progress(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        # A step that copied pages but left no fewer remaining started over
+        if status == sqlite3.SQLITE_OK and remaining_before[0] is not None and remaining >= remaining_before[0]:
+            stats['restarts'] += 1
+            if max_restarts is not None and stats['restarts'] > max_restarts:
+                raise BackupRestarted()
+        remaining_before[0] = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    start = time.perf_counter()
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        dest = sqlite3.connect(tmp_path)
+        try:
+            try:
+                source.backup(dest, pages=pages, progress=progress)
+            except BackupRestarted:
+                stats['single_step'] = True
+                source.backup(dest)
+            if dest.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                raise sqlite3.DatabaseError(f'Backup of {source_path} failed its integrity check')
+        finally:
+            dest.close()
+        os.replace(tmp_path, dest_path)
+    finally:
+        source.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    stats['seconds'] = round(time.perf_counter() - start, 4)
+    stats['bytes'] = os.path.getsize(dest_path)
+    return stats
+
+
+def snapshot_name(db_path, taken=None):
+    base = os.path.splitext(os.path.basename(db_path))[0]
+    return f'{base}-{(taken or datetime.now()).strftime("%Y%m%d-%H%M%S")}.db'
+
+
+def list_snapshots(directory, db_path):
+    """Snapshots of db_path in directory as (taken datetime, path), oldest first"""
+    base = os.path.splitext(os.path.basename(db_path))[0]
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    snapshots = []
+    for name in names:
+        match = SNAPSHOT_PATTERN.match(name)
+        if match and match.group('name') == base:
+            taken = datetime.strptime(match.group('taken'), '%Y%m%d-%H%M%S')
+            snapshots.append((taken, os.path.join(directory, name)))
+    return sorted(snapshots)
+
+
+def prune_snapshots(directory, db_path, keep=KEEP_SNAPSHOTS):
+    """Delete all but the newest keep snapshots, returning the deleted paths"""
+    snapshots = list_snapshots(directory, db_path)
+    expired = [path for _, path in snapshots[:max(len(snapshots) - keep, 0)]]
+    for path in expired:
+        os.remove(path)
+    return expired
+
+
+def find_snapshot(directory, db_path, at=None):
+    """The newest snapshot taken at or before at (default: now), or None"""
+    snapshots = [path for taken, path in list_snapshots(directory, db_path) if at is None or taken <= at]
+    return snapshots[-1] if snapshots else None
+
+
+def restore_snapshots(directory, db_paths, scratch_dir, at=None):
+    """Restore the newest snapshot at or before at of every database into scratch_dir
+
+    Each database is restored under its own file name and checked as
+    restore_snapshot does. Returns {db_path: result}, with None for a
+    database that has no snapshot by then.
+    """
+    live = {os.path.abspath(path) for path in db_paths}
+    for db_path in db_paths:
+        if os.path.abspath(os.path.join(scratch_dir, os.path.basename(db_path))) in live:
+            raise ValueError(f'Refusing to restore over the live database {db_path}')
+    os.makedirs(scratch_dir, exist_ok=True)
+    results = {}
+    for db_path in db_paths:
+        snapshot = find_snapshot(directory, db_path, at)
+        scratch_path = os.path.join(scratch_dir, os.path.basename(db_path))
+        results[db_path] = None
+        if snapshot is not None:
+            results[db_path] = dict(restore_snapshot(snapshot, scratch_path), snapshot=snapshot)
+    return results
+
+
+def restore_snapshot(snapshot_path, scratch_path):
+    """Restore a snapshot to scratch_path and check it
+
+    Never touches the live database. Returns the integrity check result
+    and the row count of every table in the restored copy.
+    """
+    stats = online_backup(snapshot_path, scratch_path, pages=-1, pause=0)
+    conn = sqlite3.connect(scratch_path)
+    try:
+        integrity = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+    return {'path': scratch_path, 'ok': integrity == ['ok'], 'integrity': integrity,
+            'tables': counts, 'seconds': stats['seconds']}
+
+
+class BackupService:
+    """Snapshot db_path and extra_paths every interval_minutes from a background thread
+
+    Several workers may each run a service over the same directory; a
+    worker skips its turn when another has taken a snapshot within the
+    interval, so the schedule holds without coordination. Extra files
+    that do not exist yet, such as an archive nothing has been moved to,
+    are skipped.
+    """
+
+    def __init__(self, db_path, directory=BACKUP_DIR, interval_minutes=None, keep=KEEP_SNAPSHOTS, extra_paths=()):
+        self.db_path = db_path
+        self.db_paths = [db_path] + list(extra_paths)
+        names = [os.path.splitext(os.path.basename(path))[0] for path in self.db_paths]
+        if len(set(names)) != len(names):
+            raise ValueError(f'Backed up databases need distinct file names: {", ".join(self.db_paths)}')
+        self.directory = directory
+        self.interval_minutes = interval_minutes
+        self.keep = keep
+        self.last = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, db_path, extra_paths=()):
+        """Build a service from BLOOD_BANK_BACKUP_INTERVAL, _DIR and _KEEP
+
+        The interval is in minutes; unset or 0 leaves the schedule off.
+        """
+        return cls(db_path, os.environ.get('BLOOD_BANK_BACKUP_DIR', BACKUP_DIR),
+                   float(os.environ.get('BLOOD_BANK_BACKUP_INTERVAL', 0)) or None,
+                   int(os.environ.get('BLOOD_BANK_BACKUP_KEEP', KEEP_SNAPSHOTS)), extra_paths)
+
+    def start(self):
+        """Start the schedule if one is configured and it is not running yet"""
+        if not self.interval_minutes:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='backup', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            snapshots = list_snapshots(self.directory, self.db_path)
+            due_in = 0
+            if snapshots:
+                due_in = self.interval_minutes * 60 - (datetime.now() - snapshots[-1][0]).total_seconds()
+            if due_in > 0:
+                time.sleep(due_in)
+                continue
+            try:
+                self.backup_now()
+            except (sqlite3.Error, OSError) as e:
+                self.error = str(e)
+                print(f'Backup failed: {e}')
+                time.sleep(60)
+
+    def backup_now(self):
+        """Snapshot every database and prune old snapshots
+
+        Returns {'taken', 'seconds', 'databases': {db_path: backup stats
+        with its snapshot path}, 'skipped', 'pruned'}.
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            start = time.perf_counter()
+            taken = datetime.now()
+            run = {'databases': {}, 'skipped': [], 'pruned': []}
+            for db_path in self.db_paths:
+                if db_path != self.db_path and not os.path.exists(db_path):
+                    run['skipped'].append(db_path)
+                    continue
+                path = os.path.join(self.directory, snapshot_name(db_path, taken))
+                run['databases'][db_path] = dict(online_backup(db_path, path), path=path)
+                run['pruned'] += prune_snapshots(self.directory, db_path, self.keep)
+            run['seconds'] = round(time.perf_counter() - start, 4)
+            run['taken'] = time.time()
+            self.last, self.error = run, None
+            return run
+
+    def restore(self, scratch_dir, at=None):
+        return restore_snapshots(self.directory, self.db_paths, scratch_dir, at)
+
+    def report(self):
+        return {
+            'interval_minutes': self.interval_minutes,
+            'keep': self.keep,
+            'last': self.last,
+            'error': self.error,
+            'snapshots': {db_path: [{'taken': taken.isoformat(), 'path': path, 'bytes': os.path.getsize(path)}
+                                    for taken, path in reversed(list_snapshots(self.directory, db_path))]
+                          for db_path in self.db_paths},
+        }
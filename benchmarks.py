@@ -0,0 +1,752 @@
+"""Performance benchmarks for the blood bank system.
+
+Run all benchmarks with ``python benchmarks.py`` or pick some by name,
+e.g. ``python benchmarks.py allocation``.
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+# Rough population frequencies so synthetic data has realistic scarcity
+BLOOD_GROUP_WEIGHTS = [0.30, 0.06, 0.09, 0.02, 0.04, 0.01, 0.39, 0.09]
+URGENCIES = ['Low', 'Medium', 'High', 'Critical']
+
+BENCHMARKS = {}
+
+
+def benchmark(f):
+    BENCHMARKS[f.__name__.replace('bench_', '')] = f
+    return f
+
+
+def timed(f, *args, repeat=1, **kwargs):
+    """Return the best wall time of f over repeat runs and its last result"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def synthetic_donors(n, rng):
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'blood_group': rng.choice(BLOOD_GROUPS, size=n, p=BLOOD_GROUP_WEIGHTS),
+        'location': rng.choice(['North', 'South', 'East', 'West', 'Central'], size=n),
+        'latitude': rng.uniform(12.0, 13.0, size=n),
+        'longitude': rng.uniform(77.0, 78.0, size=n),
+    })
+
+
+def synthetic_patients(n, rng):
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'blood_group': rng.choice(BLOOD_GROUPS, size=n, p=BLOOD_GROUP_WEIGHTS),
+        'location': rng.choice(['North', 'South', 'East', 'West', 'Central'], size=n),
+        'urgency': rng.choice(URGENCIES, size=n),
+        'units_remaining': rng.integers(1, 4, size=n),
+        'latitude': rng.uniform(12.0, 13.0, size=n),
+        'longitude': rng.uniform(77.0, 78.0, size=n),
+    })
+
+
+@benchmark
+def bench_allocation():
+    from allocation import DonorAllocator
+
+    rng = np.random.default_rng(42)
+    allocator = DonorAllocator()
+    for n_patients, n_donors in [(500, 2000), (2000, 8000), (5000, 20000)]:
+        patients_df = synthetic_patients(n_patients, rng)
+        donors_df = synthetic_donors(n_donors, rng)
+        seconds, allocations = timed(allocator.allocate, patients_df, donors_df)
+        units = int(patients_df['units_remaining'].sum())
+        print(f'allocation: {n_patients} patients / {units} units / {n_donors} donors '
+              f'-> {len(allocations)} allocated in {seconds:.3f}s')
+
+
+@benchmark
+def bench_templates():
+    from flask import render_template, render_template_string
+    import blood_bank
+
+    donors = synthetic_donors(20, np.random.default_rng(0)).assign(
+        name='Donor', phone='123', age=30, match_score=1.5).to_dict('records')
+    pages = {
+        'base': {'total_donors': 100, 'total_patients': 50},
+        'register_donor': {},
+        'request_blood': {},
+        'search_donors': {'donors': donors},
+        'stats': {'total_donors': 100, 'total_patients': 50,
+                  'blood_stats': dict.fromkeys(BLOOD_GROUPS, 12)},
+        'results': {'donors': donors, 'patient_blood_group': 'A+'},
+    }
+    n = 200
+    with blood_bank.app.test_request_context('/search_donors'):
+        for name, context in pages.items():
+            source = blood_bank.TEMPLATES[name]
+            inline, _ = timed(lambda: [render_template_string(source, **context) for _ in range(n)])
+            cached, _ = timed(lambda: [render_template(name, **context) for _ in range(n)])
+            print(f'templates: {name:<15} inline {inline / n * 1000:.3f}ms/page, '
+                  f'cached {cached / n * 1000:.3f}ms/page ({inline / cached:.1f}x)')
+
+
+def synthetic_donor_db(n, rng):
+    """Build an in-memory SQLite donors table shaped like app.py's"""
+    import sqlite3
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE donors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL, phone TEXT NOT NULL, blood_group TEXT NOT NULL,
+            age INTEGER NOT NULL, location TEXT NOT NULL, last_donation_date TEXT,
+            health_status TEXT DEFAULT 'Good', availability TEXT DEFAULT 'Available',
+            latitude REAL, longitude REAL
+        )
+    ''')
+    donors_df = synthetic_donors(n, rng)
+    conn.executemany(
+        'INSERT INTO donors (user_id, name, email, phone, blood_group, age, location, '
+        'last_donation_date, latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [(1, f'Donor {i}', f'donor{i}@example.com', f'98{i:08d}', bg, int(age), loc, '2024-01-15', lat, lon)
+         for i, (bg, age, loc, lat, lon) in enumerate(zip(
+             donors_df['blood_group'], rng.integers(18, 65, size=n), donors_df['location'],
+             donors_df['latitude'], donors_df['longitude']))]
+    )
+    conn.commit()
+    return conn
+
+
+@benchmark
+def bench_serialization():
+    import sqlite3
+    from flask import Flask, jsonify
+    import serialization
+    from serialization import table_columns, fetch_projected, dumps_rows, compress_body
+
+    n = 100000
+    conn = synthetic_donor_db(n, np.random.default_rng(0))
+    columns = table_columns(conn, 'donors')
+    app = Flask(__name__)
+
+    def baseline():
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute('SELECT * FROM donors').fetchall()
+        conn.row_factory = None
+        return jsonify([dict(row) for row in rows]).get_data()
+
+    def fast(fields):
+        return dumps_rows(*fetch_projected(conn, 'donors', fields))
+
+    def report(label, f):
+        seconds, body = timed(f, repeat=3)
+        print(f'serialization: {label:<32} {len(body) / 1e6:7.2f}MB in {seconds:.3f}s '
+              f'= {len(body) / seconds / 1e6:7.1f}MB/s, {n / seconds:,.0f} rows/s')
+
+    encoder = 'orjson' if serialization.orjson is not None else 'json'
+    with app.app_context():
+        report('jsonify(dict(row))', baseline)
+    report(f'tuples + {encoder}, all fields', lambda: fast(columns))
+    report(f'tuples + {encoder}, 3 fields', lambda: fast(['id', 'blood_group', 'latitude']))
+    report(f'tuples + {encoder} + gzip, all', lambda: compress_body(fast(columns), True)[0])
+
+
+@benchmark
+def bench_reports():
+    import sqlite3
+    from reporting import init_rollups, backfill_rollups, request_report
+
+    n = 500000
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, blood_group TEXT NOT NULL, urgency TEXT NOT NULL,
+            units_needed INTEGER NOT NULL, status TEXT DEFAULT 'Pending', request_date TEXT
+        )
+    ''')
+    # Five years of requests at random times
+    seconds = rng.integers(0, 5 * 365 * 86400, size=n)
+    dates = (np.datetime64('2020-01-01T00:00:00') + seconds.astype('timedelta64[s]')).astype(str)
+    conn.executemany(
+        'INSERT INTO patients (blood_group, urgency, units_needed, status, request_date) VALUES (?, ?, ?, ?, ?)',
+        zip(rng.choice(BLOOD_GROUPS, size=n).tolist(), rng.choice(URGENCIES, size=n).tolist(),
+            rng.integers(1, 5, size=n).tolist(), rng.choice(['Matched', 'No Match'], size=n).tolist(),
+            [d.replace('T', ' ') for d in dates])
+    )
+    init_rollups(conn.cursor())
+    backfill_seconds, _ = timed(backfill_rollups, conn)
+    print(f'reports: backfill of {n:,} requests in {backfill_seconds:.3f}s')
+
+    scan = lambda: conn.execute('''
+        SELECT strftime('%Y-%m-%d', request_date), blood_group, urgency, COUNT(*), SUM(units_needed)
+        FROM patients WHERE blood_group = 'O-' GROUP BY 1, 2, 3
+    ''').fetchall()
+    scan_seconds, scan_rows = timed(scan, repeat=3)
+    rollup_seconds, rollup_rows = timed(request_report, conn, 'daily', blood_group='O-', repeat=3)
+    print(f'reports: 5-year daily O- report, full scan {scan_seconds * 1000:.1f}ms ({len(scan_rows)} rows), '
+          f'rollup {rollup_seconds * 1000:.1f}ms ({len(rollup_rows)} rows)')
+
+    insert_seconds, _ = timed(lambda: [conn.execute(
+        "INSERT INTO patients (blood_group, urgency, units_needed, request_date) "
+        "VALUES ('A+', 'High', 2, '2025-06-01 12:00:00')") for _ in range(10000)])
+    print(f'reports: {insert_seconds / 10000 * 1e6:.1f}us per request insert with rollup triggers')
+
+
+@benchmark
+def bench_group_commit():
+    import os
+    import sqlite3
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    from write_batcher import GroupCommitWriter
+
+    sql = 'INSERT INTO donors (name, email, blood_group) VALUES (?, ?, ?)'
+    clients, per_client = 32, 50
+
+    def fresh_db(directory, name):
+        path = os.path.join(directory, name)
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE donors (id INTEGER PRIMARY KEY, name TEXT, email TEXT UNIQUE, blood_group TEXT)')
+        conn.commit()
+        conn.close()
+        return path
+
+    def run(register):
+        with ThreadPoolExecutor(clients) as pool:
+            list(pool.map(lambda c: [register(c, i) for i in range(per_client)], range(clients)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        direct_path = fresh_db(directory, 'direct.db')
+
+        def direct(c, i):
+            # One connection, INSERT and fsync'd commit per registration
+            conn = sqlite3.connect(direct_path, timeout=60)
+            conn.execute(sql, (f'Donor {c}-{i}', f'{c}-{i}@example.com', 'O+'))
+            conn.commit()
+            conn.close()
+
+        writer = GroupCommitWriter(fresh_db(directory, 'batched.db'))
+
+        def batched(c, i):
+            writer.submit(sql, (f'Donor {c}-{i}', f'{c}-{i}@example.com', 'O+'))
+
+        total = clients * per_client
+        direct_seconds, _ = timed(run, direct)
+        batched_seconds, _ = timed(run, batched)
+        print(f'group_commit: {total} registrations from {clients} threads, '
+              f'direct {total / direct_seconds:,.0f}/s, batched {total / batched_seconds:,.0f}/s '
+              f'({writer.writes_committed / writer.batches_committed:.1f} writes per commit)')
+
+
+@benchmark
+def bench_snapshot():
+    import os
+    import sqlite3
+    import tempfile
+    import threading
+    from snapshot import ReadSnapshot, init_change_log
+    from app import init_table_versions
+
+    n, imported, searches = 50000, 20000, 1000
+    rng = np.random.default_rng(0)
+    queries = [(bg, loc) for bg, loc in zip(rng.choice(BLOOD_GROUPS, size=searches),
+                                            rng.choice(['north', 'south', 'cent', ''], size=searches))]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'donors.db')
+        source = synthetic_donor_db(n, rng)
+        conn = sqlite3.connect(path)
+        source.backup(conn)
+        init_table_versions(conn.cursor(), ['donors'])
+        init_change_log(conn.cursor(), ['donors'])
+        conn.commit()
+        conn.close()
+
+        snapshot = ReadSnapshot(path, {'donors': {'index': ['blood_group', 'availability'], 'tokens': ['location']}})
+        load_seconds, _ = timed(snapshot.get, 'donors')
+        reader = sqlite3.connect(path, timeout=60, check_same_thread=False)
+
+        def sql_search(bg, loc):
+            query = 'SELECT * FROM donors WHERE availability = "Available" AND blood_group = ?'
+            params = [bg]
+            if loc:
+                query += ' AND location LIKE ?'
+                params.append(f'%{loc}%')
+            return reader.execute(query, params).fetchall()
+
+        def snapshot_search(bg, loc):
+            return snapshot.get('donors').search({'availability': 'Available', 'blood_group': bg},
+                                                 {'location': loc} if loc else None)
+
+        def latencies(search):
+            samples = []
+            for bg, loc in queries:
+                start = time.perf_counter()
+                search(bg, loc)
+                samples.append(time.perf_counter() - start)
+            return np.percentile(samples, [50, 99]) * 1000
+
+        def bulk_import():
+            writer = sqlite3.connect(path, timeout=60)
+            for start in range(n, n + imported, 1000):
+                writer.executemany(
+                    'INSERT INTO donors (name, email, phone, blood_group, age, location) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(f'Donor {i}', f'bulk{i}@example.com', '1', 'O+', 30, 'North') for i in range(start, start + 1000)])
+                writer.commit()
+            writer.close()
+
+        print(f'snapshot: {n} donors loaded and indexed in {load_seconds:.3f}s')
+        for label, search in [('sqlite', sql_search), ('snapshot', snapshot_search)]:
+            idle = latencies(search)
+            importer = threading.Thread(target=bulk_import)
+            importer.start()
+            busy = latencies(search)
+            importer.join()
+            conn = sqlite3.connect(path)
+            conn.execute("DELETE FROM donors WHERE email LIKE 'bulk%'")
+            conn.commit()
+            conn.close()
+            print(f'snapshot: {label:<8} search p50/p99 idle {idle[0]:.3f}/{idle[1]:.3f}ms, '
+                  f'during bulk import {busy[0]:.3f}/{busy[1]:.3f}ms')
+        reader.close()
+        snapshot.close()
+
+
+@benchmark
+def bench_parallel_matching():
+    import os
+    from features import FeatureSchema
+    from parallel_matching import ParallelKNN
+
+    rng = np.random.default_rng(0)
+    n_donors, n_patients = 50000, 10000
+    donation_dates = pd.Timestamp('2026-01-01') - pd.to_timedelta(rng.integers(0, 730, size=n_donors), unit='D')
+    donors_df = synthetic_donors(n_donors, rng).assign(
+        age=rng.integers(18, 65, size=n_donors), last_donation_date=donation_dates.strftime('%Y-%m-%d'))
+    patients_df = synthetic_patients(n_patients, rng).assign(
+        age=rng.integers(18, 80, size=n_patients))
+    schema = FeatureSchema.fit(donors_df)
+    donor_features, patient_features = schema.transform(donors_df), schema.transform(patients_df)
+
+    cores = os.cpu_count() or 1
+    print(f'parallel_matching: {n_patients} patients x {n_donors} donors, k=5, {cores} cores')
+    baseline = None
+    for mode in ['process', 'thread']:
+        for workers in sorted({1, 2, 4, cores}):
+            with ParallelKNN(donor_features, workers, mode=mode) as knn:
+                knn.query(patient_features[:workers * 64])  # start the workers
+                seconds, (distances, _) = timed(knn.query, patient_features, 5)
+            baseline = baseline or seconds
+            print(f'parallel_matching: {mode:<7} {workers:>2} workers {seconds:.3f}s '
+                  f'= {n_patients / seconds:,.0f} patients/s, speedup {baseline / seconds:.2f}x')
+
+
+
+@benchmark
+def bench_reservations():
+    import os
+    import random
+    import sqlite3
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import reservations
+
+    clients, attempts = 32, 200
+    stock = {group: 300 for group in BLOOD_GROUPS}
+
+    def fresh_db(path, journal_mode):
+        conn = sqlite3.connect(path)
+        conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        conn.execute('CREATE TABLE blood_inventory (id INTEGER PRIMARY KEY, blood_group TEXT UNIQUE, '
+                     'units_available INTEGER, last_updated TEXT)')
+        conn.executemany('INSERT INTO blood_inventory (blood_group, units_available) VALUES (?, ?)', stock.items())
+        reservations.init_reservations(conn)
+        conn.commit()
+        conn.close()
+
+    def client(path, seed, failures):
+        # Every client reserves more than its share, so groups run dry
+        # and the conditional update has to turn requests away; a quarter
+        # of the holds are released again to keep units moving
+        rng = random.Random(seed)
+        conn = sqlite3.connect(path, timeout=60)
+        reserved = 0
+        for _ in range(attempts):
+            try:
+                reservation_id = reservations.reserve(conn, rng.choice(BLOOD_GROUPS), rng.randint(1, 3))
+            except sqlite3.OperationalError:
+                failures.append(1)
+                conn.rollback()
+                continue
+            if reservation_id is not None:
+                reserved += 1
+                if rng.random() < 0.25:
+                    reservations.release(conn, reservation_id)
+        conn.close()
+        return reserved
+
+    oversubscribed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for journal_mode in ['delete', 'wal']:
+            path = os.path.join(directory, f'{journal_mode}.db')
+            fresh_db(path, journal_mode)
+            failures = []
+            with ThreadPoolExecutor(clients) as pool:
+                start = time.perf_counter()
+                reserved = sum(pool.map(lambda seed: client(path, seed, failures), range(clients)))
+                seconds = time.perf_counter() - start
+
+            conn = sqlite3.connect(path)
+            available = dict(conn.execute('SELECT blood_group, units_available FROM blood_inventory'))
+            held = dict(conn.execute("SELECT blood_group, SUM(units) FROM inventory_reservations "
+                                     "WHERE status = 'Active' GROUP BY blood_group"))
+            conn.close()
+            # Every unit is either free or held by exactly one reservation
+            broken = [group for group in stock
+                      if available[group] < 0 or available[group] + held.get(group, 0) != stock[group]]
+            print(f'reservations: {journal_mode:<6} {clients} threads x {attempts} attempts, '
+                  f'{reserved} reserved in {seconds:.2f}s = {reserved / seconds:,.0f}/s, '
+                  f'{len(failures)} lock timeouts, '
+                  f'{"OVERSUBSCRIBED " + ", ".join(broken) if broken else "no oversubscription"}')
+            oversubscribed = oversubscribed or bool(broken)
+    if oversubscribed:
+        sys.exit(1)
+
+
+
+@benchmark
+def bench_backup():
+    import os
+    import sqlite3
+    import tempfile
+    import threading
+    from backup import online_backup, restore_snapshot
+
+    n = 200000
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'live.db')
+        conn = sqlite3.connect(path)
+        synthetic_donor_db(n, rng).backup(conn)
+        conn.close()
+        size_mb = os.path.getsize(path) / 1e6
+
+        def request_latencies(stop, samples):
+            # A request that reads a donor and records an update, as the app's routes do
+            conn = sqlite3.connect(path, timeout=60)
+            i = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                conn.execute('SELECT * FROM donors WHERE id = ?', (i % n + 1,)).fetchone()
+                conn.execute('UPDATE donors SET phone = ? WHERE id = ?', (f'97{i:08d}', i % n + 1))
+                conn.commit()
+                samples.append(time.perf_counter() - start)
+                i += 1
+                time.sleep(0.001)
+            conn.close()
+
+        def under_load(work):
+            stop, samples = threading.Event(), []
+            client = threading.Thread(target=request_latencies, args=(stop, samples))
+            client.start()
+            result = work()
+            stop.set()
+            client.join()
+            p50, p99 = np.percentile(samples, [50, 99]) * 1000
+            return result, p50, p99, max(samples) * 1000
+
+        dest = os.path.join(directory, 'snapshot.db')
+        for journal_mode in ['delete', 'wal']:
+            conn = sqlite3.connect(path)
+            conn.execute(f'PRAGMA journal_mode={journal_mode}')
+            conn.close()
+            _, p50, p99, worst = under_load(lambda: time.sleep(2))
+            print(f'backup: {journal_mode:<6} {n} donors, {size_mb:.0f} MB; '
+                  f'requests alone p50/p99/max {p50:.2f}/{p99:.2f}/{worst:.2f}ms')
+            for label, pages, pause in [('one step', -1, 0), ('stepped', 256, 0.005)]:
+                stats, p50, p99, worst = under_load(lambda: online_backup(path, dest, pages=pages, pause=pause))
+                print(f'backup: {journal_mode:<6} {label:<8} {stats["seconds"]:.2f}s, {stats["steps"]} steps, '
+                      f'{stats["restarts"]} restarts{" then one step" if stats["single_step"] else ""}; '
+                      f'requests p50/p99/max {p50:.2f}/{p99:.2f}/{worst:.2f}ms')
+        seconds, result = timed(restore_snapshot, dest, os.path.join(directory, 'scratch.db'))
+        print(f'backup: restore and verify {seconds:.2f}s, integrity {"ok" if result["ok"] else "FAILED"}, '
+              f'{result["tables"]["donors"]} donors')
+
+
+@benchmark
+def bench_static_assets():
+    import os
+    from flask import Flask, url_for
+    import static_assets
+
+    app = Flask(__name__, static_folder=None)
+    assets = static_assets.StaticAssets(os.path.dirname(os.path.abspath(__file__)))
+    assets.init_app(app)
+    client = app.test_client()
+    with app.test_request_context():
+        url = url_for('static', filename='style.css')
+    asset = assets.assets['style.css']
+    sizes = ', '.join(f'{encoding} {len(body):,}' for encoding, body in asset.variants.items())
+    print(f'static_assets: {url}: identity {len(asset.body):,} bytes, {sizes}'
+          f'{"" if static_assets.brotli else " (brotli not installed)"}')
+
+    requests = 2000
+    for label, path, headers in [('plain, identity', '/static/style.css', {}),
+                                 ('fingerprinted, gzip', url, {'Accept-Encoding': 'gzip, br'})]:
+        response = client.get(path, headers=headers)
+        seconds, _ = timed(lambda: [client.get(path, headers=headers) for _ in range(requests)])
+        print(f'static_assets: {label:<20} {len(response.data):>6,} bytes, '
+              f'Cache-Control: {response.headers["Cache-Control"]}, {seconds / requests * 1e6:.0f}us per request')
+    revalidated = client.get('/static/style.css', headers={'If-None-Match': f'"{asset.digest}"'})
+    print(f'static_assets: revalidating the plain URL -> {revalidated.status_code}')
+
+
+@benchmark
+def bench_single_flight():
+    import os
+    import sqlite3
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from app import DonorMatcher, init_table_versions
+
+    class Uncoalesced:
+        """Stands in for a SingleFlight so every caller computes, as before coalescing"""
+        def __init__(self, name):
+            self.name = name
+            self.computations = 0
+
+        def do(self, key, fn, *args):
+            self.computations += 1
+            return fn(*args)
+
+    n, clients, bursts = 20000, 16, 5
+    rng = np.random.default_rng(0)
+    patient = {'blood_group': 'O-', 'age': 35, 'location': 'North', 'latitude': 12.5, 'longitude': 77.5}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'donors.db')
+        conn = sqlite3.connect(path)
+        synthetic_donor_db(n, rng).backup(conn)
+        init_table_versions(conn.cursor(), ['donors'])
+        conn.commit()
+        conn.close()
+
+        def change_donors():
+            conn = sqlite3.connect(path)
+            conn.execute("UPDATE table_versions SET version = version + 1 WHERE table_name = 'donors'")
+            conn.commit()
+            conn.close()
+
+        for label, coalesce in [('uncoalesced', False), ('single-flight', True)]:
+            matcher = DonorMatcher(os.path.join(directory, 'schema.json'))
+            if not coalesce:
+                matcher.donor_reads, matcher.index_builds, matcher.matches = (
+                    Uncoalesced('donor_reads'), Uncoalesced('index_builds'), Uncoalesced('matches'))
+                matcher.flights = [matcher.donor_reads, matcher.index_builds, matcher.matches]
+            barrier = threading.Barrier(clients)
+
+            def request(_):
+                # Each burst follows a donor change, so nothing is cached yet
+                conn = sqlite3.connect(path)
+                conn.row_factory = sqlite3.Row
+                barrier.wait()
+                start = time.perf_counter()
+                version, donors_df = matcher.available_donors(conn)
+                matches = matcher.match_patient(patient, donors_df, version)
+                conn.close()
+                return time.perf_counter() - start, len(matches)
+
+            samples = []
+            start = time.perf_counter()
+            with ThreadPoolExecutor(clients) as pool:
+                for version in range(bursts):
+                    change_donors()
+                    samples.extend(seconds for seconds, _ in pool.map(request, [version] * clients))
+            total = time.perf_counter() - start
+            work = ', '.join(f'{flight.name} {flight.computations}' for flight in matcher.flights)
+            print(f'single_flight: {label:<13} {bursts} bursts of {clients} identical requests in {total:.2f}s, '
+                  f'p50/max {np.percentile(samples, 50) * 1000:.0f}/{max(samples) * 1000:.0f}ms; computed {work}')
+
+
+
+@benchmark
+def bench_density():
+    import sqlite3
+    from density import DensityGrid, init_density, backfill_density, read_density, cell_sql
+    from donor_search import DonorQuery, init_search_indexes
+
+    rng = np.random.default_rng(0)
+    points = list(zip(rng.uniform(12.0, 13.0, size=200), rng.uniform(77.0, 78.0, size=200)))
+    live_sql = (f'SELECT {cell_sql("latitude")}, {cell_sql("longitude")}, blood_group, COUNT(*) FROM donors '
+                "WHERE availability = 'Available' AND latitude IS NOT NULL GROUP BY 1, 2, 3")
+    for n in [20000, 200000]:
+        conn = synthetic_donor_db(n, rng)
+        conn.row_factory = sqlite3.Row
+        init_search_indexes(conn.cursor())
+        init_density(conn.cursor())
+        backfill_density(conn.cursor())
+        conn.commit()
+
+        live_seconds, _ = timed(lambda: conn.execute(live_sql).fetchall(), repeat=3)
+        grid_seconds, grid = timed(lambda: DensityGrid(read_density(conn), n), repeat=3)
+        heatmap_seconds, cells = timed(grid.heatmap, ['O-', 'O+'], repeat=3)
+        print(f'density: {n} donors, {len(grid.cells)} cells; live GROUP BY {live_seconds * 1000:.1f}ms, '
+              f'grid read {grid_seconds * 1000:.1f}ms, heatmap {heatmap_seconds * 1000:.2f}ms')
+
+        # Nearest-first searches, unbounded and bounded by the grid's radius
+        def search(bounded):
+            results = []
+            for lat, lon in points:
+                query = DonorQuery(blood_groups=['O-'], latitude=lat, longitude=lon, limit=20)
+                if bounded:
+                    query.radius_km = grid.search_radius_km(lat, lon, query.limit, query.groups()) * 1.01
+                results.append([donor['id'] for donor in query.run(conn)])
+            return results
+
+        unbounded_seconds, unbounded = timed(search, False)
+        bounded_seconds, bounded = timed(search, True)
+        print(f'density: nearest 20 O- donors, {len(points)} searches: unbounded '
+              f'{unbounded_seconds / len(points) * 1000:.2f}ms, grid radius {bounded_seconds / len(points) * 1000:.2f}ms '
+              f'per search, same results {unbounded == bounded}')
+
+        start = time.perf_counter()
+        conn.executemany(
+            'INSERT INTO donors (name, email, phone, blood_group, age, location, latitude, longitude) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(f'New {i}', f'new{i}@example.com', '1', 'O+', 30, 'North', lat, lon) for i, (lat, lon) in enumerate(points)])
+        conn.commit()
+        insert_seconds = time.perf_counter() - start
+        recount = conn.execute(
+            f'SELECT {cell_sql("latitude")}, {cell_sql("longitude")}, blood_group, IFNULL(availability, \'\'), '
+            'COUNT(*) FROM donors WHERE latitude IS NOT NULL GROUP BY 1, 2, 3, 4').fetchall()
+        print(f'density: {insert_seconds / len(points) * 1e6:.0f}us per donor insert including the grid trigger, '
+              f'grid matches a full recount {sorted(map(tuple, read_density(conn))) == sorted(map(tuple, recount))}')
+        conn.close()
+
+
+
+@benchmark
+def bench_availability_windows():
+    import sqlite3
+    from datetime import datetime
+    from availability_windows import (MINUTES_PER_DAY, NO_END, NO_START, WINDOW_ID_BITS, from_minutes,
+                                      init_windows, minute_of_week, to_minutes)
+    from donor_search import DonorQuery, init_search_indexes
+
+    rng = np.random.default_rng(0)
+    n_donors, n_windows = 500000, 2000000
+    conn = synthetic_donor_db(n_donors, rng)
+    conn.row_factory = sqlite3.Row
+    init_search_indexes(conn.cursor())
+    init_windows(conn.cursor())
+
+    # A year of one-off windows of up to three days, weekly windows of up
+    # to six hours, and absences of up to two months, on 80% of donors
+    base = to_minutes(datetime(2026, 1, 1))
+    kinds = rng.choice(['once', 'weekly', 'away'], size=n_windows, p=[0.6, 0.3, 0.1])
+    donor_ids = rng.integers(1, int(n_donors * 0.8) + 1, size=n_windows)
+    starts = base + rng.integers(0, 365 * MINUTES_PER_DAY, size=n_windows)
+    lengths = rng.integers(60, 72 * 60, size=n_windows)
+    week_starts = rng.integers(0, 7, size=n_windows) * MINUTES_PER_DAY + rng.integers(8, 18, size=n_windows) * 60
+    week_lengths = rng.integers(1, 7, size=n_windows) * 60
+    away_lengths = rng.integers(1, 60, size=n_windows) * MINUTES_PER_DAY
+    rows, numbered = [], {}
+    for i, kind in enumerate(kinds):
+        donor_id = int(donor_ids[i])
+        numbered[donor_id] = number = numbered.get(donor_id, -1) + 1
+        window = ((donor_id << WINDOW_ID_BITS) + number, donor_id)
+        if kind == 'weekly':
+            rows.append(window + ('available', 1, int(week_starts[i]), int(week_starts[i] + week_lengths[i])))
+        elif kind == 'away':
+            rows.append(window + ('away', 0, int(starts[i]), int(starts[i] + away_lengths[i])))
+        else:
+            rows.append(window + ('available', 0, int(starts[i]), int(starts[i] + lengths[i])))
+    start = time.perf_counter()
+    conn.executemany('INSERT INTO donor_windows (id, donor_id, kind, weekly, starts, ends) VALUES (?, ?, ?, ?, ?, ?)',
+                     rows)
+    conn.commit()
+    insert_seconds = time.perf_counter() - start
+    print(f'availability: {n_windows} windows on {n_donors} donors, {insert_seconds / n_windows * 1e6:.1f}us '
+          'per window insert including the index triggers')
+
+    # Available windows covering a moment: stabbing the R*Tree against
+    # checking every window's schedule
+    moments = [int(m) for m in base + rng.integers(0, 365 * MINUTES_PER_DAY, size=50)]
+    stab_sql = (f'SELECT id >> {WINDOW_ID_BITS} FROM donor_available_index WHERE time_min <= ?1 AND time_max >= ?1 '
+                f'UNION ALL SELECT id >> {WINDOW_ID_BITS} FROM donor_weekly_index WHERE week_min <= ?2 '
+                'AND week_max >= ?2 AND time_min <= ?1 AND time_max >= ?1')
+    scan_sql = (f"SELECT donor_id FROM donor_windows WHERE kind = 'available' AND CASE WHEN weekly "
+                f'THEN IFNULL(valid_from, {NO_START}) <= ? AND IFNULL(valid_until, {NO_END} + 1) > ? '
+                'AND starts <= ? AND ends > ? ELSE starts <= ? AND ends > ? END')
+
+    def stab_params(m):
+        return m, minute_of_week(m)
+
+    def scan_params(m):
+        return m, m, minute_of_week(m), minute_of_week(m), m, m
+
+    def count(sql, params):
+        return [conn.execute(f'SELECT COUNT(*) FROM ({sql})', params(m)).fetchone()[0] for m in moments]
+
+    stab_seconds, stabbed = timed(count, stab_sql, stab_params)
+    scan_seconds, scanned = timed(count, scan_sql, scan_params)
+    same = all(sorted(row[0] for row in conn.execute(stab_sql, stab_params(m)))
+               == sorted(row[0] for row in conn.execute(scan_sql, scan_params(m))) for m in moments[:5])
+    print(f'availability: windows covering a moment, {len(moments)} queries averaging '
+          f'{sum(stabbed) / len(moments):.0f} matches: scan {scan_seconds / len(moments) * 1000:.1f}ms, '
+          f'R*Trees {stab_seconds / len(moments) * 1000:.2f}ms per query, same results {stabbed == scanned and same}')
+
+    # Searches for callable donors at a moment or within a day of it
+    def search(hours):
+        results = []
+        for m in moments:
+            at = from_minutes(m)
+            query = DonorQuery(blood_groups=['O-'], available_at=at, available_within_hours=hours, limit=50)
+            results.append(len(query.run(conn)))
+        return results
+
+    for hours in [None, 24]:
+        search_seconds, found = timed(search, hours)
+        label = 'at a moment' if hours is None else f'within {hours}h'
+        print(f'availability: 50 callable O- donors {label}: {search_seconds / len(moments) * 1000:.1f}ms per '
+              f'search, {min(found)}-{max(found)} found')
+    plain_seconds, _ = timed(lambda: [DonorQuery(blood_groups=['O-'], limit=50).run(conn) for _ in moments])
+    print(f'availability: same search without windows {plain_seconds / len(moments) * 1000:.2f}ms')
+    conn.close()
+
+
+@benchmark
+def bench_search_plans():
+    from availability_windows import init_windows
+    from donor_search import check_plans, init_search_indexes
+
+    # Plans over a populated, analyzed table, where the planner has real
+    # statistics to be tempted away from the pinned index
+    conn = synthetic_donor_db(50000, np.random.default_rng(0))
+    init_search_indexes(conn.cursor())
+    init_windows(conn.cursor())
+    conn.execute('ANALYZE')
+    check_seconds, problems = timed(check_plans, conn)
+    conn.close()
+    for combo, sql, plan in problems:
+        print(f"search plans: {' + '.join(combo) or 'no filters'} regressed: {'; '.join(plan)}")
+    print(f'search plans: every filter combination planned in {check_seconds:.2f}s, {len(problems)} regressed')
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f'Unknown benchmark: {name} (choose from {", ".join(BENCHMARKS)})')
+            sys.exit(1)
+        BENCHMARKS[name]()
@@ -1,4 +1,5 @@
-from flask import Flask, render_template_string, request, redirect, flash
+from flask import Flask, render_template, request, redirect, flash, g
+from jinja2 import ChoiceLoader, DictLoader
 import sqlite3
 import pandas as pd
 import numpy as np
@@ -7,10 +8,19 @@ from sklearn.preprocessing import LabelEncoder
 import math
 import hashlib
 from datetime import datetime
+from write_batcher import GroupCommitWriter
+from schema import begin_schema_setup, mark_schema_current
+import slow_queries
 
 app = Flask(__name__)
 app.secret_key = 'blood_bank_secret_key'
 
+# Bump whenever init_db changes tables or sample data
+SCHEMA_VERSION = '1'
+
+# Registrations are committed in small groups by a single writer thread
+donor_writer = GroupCommitWriter('blood_bank.db')
+
 # HTML Templates
 INDEX_HTML = '''
 <!DOCTYPE html>
@@ -334,9 +344,28 @@ RESULTS_HTML = '''
 {% endblock %}
 '''
 
+# Register the template constants by name so Jinja compiles each one once
+# and serves it from its template cache on later renders. This also lets
+# the pages resolve {% extends "base" %}.
+TEMPLATES = {
+    'base': INDEX_HTML,
+    'register_donor': REGISTER_DONOR_HTML,
+    'request_blood': REQUEST_BLOOD_HTML,
+    'search_donors': SEARCH_DONORS_HTML,
+    'stats': STATS_HTML,
+    'results': RESULTS_HTML,
+}
+app.jinja_env.loader = ChoiceLoader([DictLoader(TEMPLATES), app.jinja_env.loader])
+# STATS_HTML scales its bars with max()
+app.jinja_env.globals['max'] = max
+
 # Database Setup
 def init_db():
-    conn = sqlite3.connect('blood_bank.db')
+    # Skip the DDL and sample-data check entirely once set up
+    conn = slow_queries.connect('blood_bank.db', timeout=30)
+    if not begin_schema_setup(conn, 'blood_bank', SCHEMA_VERSION):
+        conn.close()
+        return
     cursor = conn.cursor()
     
     # Donors table
@@ -384,7 +413,7 @@ def init_db():
             sample_donors
         )
     
-    conn.commit()
+    mark_schema_current(conn, 'blood_bank', SCHEMA_VERSION)
     conn.close()
 
 # KNN Algorithm Class
@@ -407,7 +436,7 @@ class BloodDonorMatcher:
     
     def find_matching_donors(self, patient_blood_group, patient_age=30):
         """Find matching donors using KNN algorithm"""
-        conn = sqlite3.connect('blood_bank.db')
+        conn = slow_queries.connect('blood_bank.db')
         donors_df = pd.read_sql('SELECT * FROM donors', conn)
         conn.close()
         
@@ -440,17 +469,24 @@ class BloodDonorMatcher:
         
         return matching_donors
 
+def get_system_counts():
+    """Return (total_donors, total_patients), queried at most once per request"""
+    if 'system_counts' not in g:
+        conn = slow_queries.connect('blood_bank.db')
+        total_donors = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
+        total_patients = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
+        conn.close()
+        g.system_counts = (total_donors, total_patients)
+    return g.system_counts
+
 # Flask Routes
 @app.route('/')
 def index():
-    conn = sqlite3.connect('blood_bank.db')
-    total_donors = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
-    total_patients = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
-    conn.close()
+    total_donors, total_patients = get_system_counts()
     
-    return render_template_string(INDEX_HTML, 
-                                total_donors=total_donors,
-                                total_patients=total_patients)
+    return render_template('base', 
+                         total_donors=total_donors,
+                         total_patients=total_patients)
 
 @app.route('/register_donor', methods=['GET', 'POST'])
 def register_donor():
@@ -462,19 +498,15 @@ def register_donor():
         age = int(request.form['age'])
         location = request.form['location']
         
-        conn = sqlite3.connect('blood_bank.db')
-        cursor = conn.cursor()
-        cursor.execute(
+        donor_writer.submit(
             'INSERT INTO donors (name, email, phone, blood_group, age, location) VALUES (?, ?, ?, ?, ?, ?)',
             (name, email, phone, blood_group, age, location)
         )
-        conn.commit()
-        conn.close()
         
         flash('Donor registered successfully!', 'success')
         return redirect('/')
     
-    return render_template_string(REGISTER_DONOR_HTML)
+    return render_template('register_donor')
 
 @app.route('/request_blood', methods=['GET', 'POST'])
 def request_blood():
@@ -486,7 +518,7 @@ def request_blood():
         urgency = request.form['urgency']
         
         # Save patient request
-        conn = sqlite3.connect('blood_bank.db')
+        conn = slow_queries.connect('blood_bank.db')
         cursor = conn.cursor()
         cursor.execute(
             'INSERT INTO patients (name, blood_group, location, units, urgency) VALUES (?, ?, ?, ?, ?)',
@@ -499,17 +531,18 @@ def request_blood():
         matcher = BloodDonorMatcher()
         matching_donors = matcher.find_matching_donors(blood_group)
         
-        return render_template_string(RESULTS_HTML, 
-                                    donors=matching_donors,
-                                    patient_blood_group=blood_group)
+        return render_template('results', 
+                           donors=matching_donors,
+                           patient_blood_group=blood_group)
     
-    return render_template_string(REQUEST_BLOOD_HTML)
+    return render_template('request_blood')
 
 @app.route('/search_donors')
 def search_donors():
     blood_group = request.args.get('blood_group', '')
     
-    conn = sqlite3.connect('blood_bank.db')
+    conn = slow_queries.connect('blood_bank.db')
+    conn.row_factory = sqlite3.Row
     
     if blood_group:
         donors = conn.execute(
@@ -524,14 +557,12 @@ def search_donors():
     # Convert to list of dicts
     donors_list = [dict(donor) for donor in donors]
     
-    return render_template_string(SEARCH_DONORS_HTML, donors=donors_list)
+    return render_template('search_donors', donors=donors_list)
 
 @app.route('/stats')
 def stats():
-    conn = sqlite3.connect('blood_bank.db')
-    
-    total_donors = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
-    total_patients = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
+    total_donors, total_patients = get_system_counts()
+    conn = slow_queries.connect('blood_bank.db')
     
     # Get blood group statistics
     blood_groups = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
@@ -546,19 +577,17 @@ def stats():
     
     conn.close()
     
-    return render_template_string(STATS_HTML,
-                                total_donors=total_donors,
-                                total_patients=total_patients,
-                                blood_stats=blood_stats)
+    return render_template('stats',
+                         total_donors=total_donors,
+                         total_patients=total_patients,
+                         blood_stats=blood_stats)
 
 # Base template for inheritance
 @app.context_processor
 def inject_base_template():
+    # Counts are only looked up when a template actually calls base()
     def render_base_template(content=''):
-        conn = sqlite3.connect('blood_bank.db')
-        total_donors = conn.execute('SELECT COUNT(*) FROM donors').fetchone()[0]
-        total_patients = conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
-        conn.close()
+        total_donors, total_patients = get_system_counts()
         
         return INDEX_HTML.replace('{% block content %}{% endblock %}', content).replace(
             '{{ total_donors }}', str(total_donors)).replace(
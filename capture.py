@@ -0,0 +1,94 @@
+"""Opt-in capture of sanitized request records as JSON lines for replay"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from flask import g, request
+
+# Values of these parameters are kept verbatim; everything else (names,
+# emails, phones, passwords, ...) is replaced by REDACTED and synthesized
+# again at replay time
+SAFE_PARAMS = {
+    'blood_group', 'units_needed', 'urgency', 'age', 'health_status',
+    'last_donation', 'user_type', 'fields', 'granularity', 'start', 'end', 'limit',
+    'status', 'days', 'candidates', 'region', 'compatible_for', 'min_age', 'max_age',
+    'radius_km', 'eligible_by', 'available_at', 'available_within_hours', 'units', 'ttl_minutes',
+    'patient_id',
+}
+REDACTED = '<redacted>'
+
+# Coordinates are kept to about a kilometre, enough to replay the same
+# spatial queries without pinning down an address
+COORDINATE_PARAMS = {'latitude', 'longitude'}
+COORDINATE_DECIMALS = 2
+# Free-text locations are replaced by a keyed hash, so repeats of a value
+# stay recognisable within one capture file but the text is not kept
+HASHED_PARAMS = {'location'}
+HASHED_PREFIX = 'hashed:'
+
+# Long-lived, asset and probe requests say nothing about request latency
+SKIPPED_ENDPOINTS = {'static', 'stream_dashboard', 'healthz', 'readyz'}
+
+
+def scrub(key, value, salt):
+    if isinstance(value, dict):
+        return sanitize(value, salt)
+    if isinstance(value, list):
+        return [scrub(key, item, salt) for item in value]
+    if key in COORDINATE_PARAMS:
+        try:
+            rounded = round(float(value), COORDINATE_DECIMALS)
+        except (TypeError, ValueError):
+            return REDACTED
+        return rounded if isinstance(value, (int, float)) else str(rounded)
+    if key in HASHED_PARAMS:
+        digest = hmac.new(salt, str(value).encode(), hashlib.sha256).hexdigest()
+        return HASHED_PREFIX + digest[:16]
+    return value if key in SAFE_PARAMS else REDACTED
+
+
+def sanitize(params, salt):
+    return {key: scrub(key, value, salt) for key, value in params.items()}
+
+
+class TrafficRecorder:
+    """Append one JSON line per handled request to a capture file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Fresh per recorder, so hashed values cannot be matched across captures
+        self._salt = os.urandom(16)
+        self._file = open(path, 'a', buffering=1, encoding='utf-8')
+
+    def init_app(self, app):
+        app.before_request(self._start_timer)
+        app.after_request(self._record)
+
+    def _start_timer(self):
+        g.capture_started = time.perf_counter()
+
+    def _record(self, response):
+        if request.endpoint in SKIPPED_ENDPOINTS or 'capture_started' not in g:
+            return response
+        record = {
+            'ts': round(time.time(), 6),
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'path': request.path,
+            'args': sanitize(request.args.to_dict(), self._salt),
+            'form': sanitize(request.form.to_dict(), self._salt),
+            'headers': {name: request.headers[name] for name in ('Accept-Encoding',) if name in request.headers},
+            'authenticated': 'Cookie' in request.headers,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.capture_started) * 1000, 3),
+        }
+        body = request.get_json(silent=True) if request.is_json else None
+        if body is not None:
+            record['json'] = scrub(None, body, self._salt)
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+        return response
@@ -0,0 +1,180 @@
+"""Donor density grid maintained incrementally by triggers
+
+Donors with coordinates are counted in fixed CELL_DEGREES x CELL_DEGREES
+latitude/longitude cells per blood group and availability. Triggers on
+donors keep donor_density current within the same transaction as every
+write, so reading the grid costs the number of occupied cells, however
+many donors there are. DensityGrid answers heatmap queries and picks
+the smallest search radius certain to contain enough donors.
+"""
+from sharding import haversine_km
+
+# About 5.5 km north-south
+CELL_DEGREES = 0.05
+# Added before truncating to an integer so negative coordinates floor
+# like positive ones; keeps SQL and Python cell numbers identical
+CELL_OFFSET = 100000
+# Radius searches give up beyond this many rings of cells, about 220 km
+MAX_RING = 40
+
+
+def cell_sql(column):
+    return f'(CAST({column} / {CELL_DEGREES} + {CELL_OFFSET} AS INTEGER) - {CELL_OFFSET})'
+
+
+def cell_of(value):
+    return int(value / CELL_DEGREES + CELL_OFFSET) - CELL_OFFSET
+
+
+def add_sql(row, delta):
+    """Add delta to the cell of row (NEW or OLD) if it has coordinates"""
+    return f'''
+        INSERT INTO donor_density (cell_lat, cell_lon, blood_group, availability, donors)
+        SELECT {cell_sql(f'{row}.latitude')}, {cell_sql(f'{row}.longitude')}, {row}.blood_group,
+               IFNULL({row}.availability, ''), {delta}
+        WHERE {row}.latitude IS NOT NULL AND {row}.longitude IS NOT NULL
+        ON CONFLICT (cell_lat, cell_lon, blood_group, availability) DO UPDATE SET
+            donors = donors + excluded.donors;
+        DELETE FROM donor_density
+        WHERE cell_lat = {cell_sql(f'{row}.latitude')} AND cell_lon = {cell_sql(f'{row}.longitude')}
+          AND blood_group = {row}.blood_group AND availability = IFNULL({row}.availability, '') AND donors <= 0;
+    '''
+
+
+def init_density(cursor):
+    """Create donor_density and the donors triggers that keep it current"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS donor_density (
+            cell_lat INTEGER NOT NULL,
+            cell_lon INTEGER NOT NULL,
+            blood_group TEXT NOT NULL,
+            availability TEXT NOT NULL,
+            donors INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (cell_lat, cell_lon, blood_group, availability)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_density_on_insert AFTER INSERT ON donors
+        BEGIN {add_sql('NEW', 1)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_density_on_delete AFTER DELETE ON donors
+        BEGIN {add_sql('OLD', -1)} END
+    ''')
+    # Only changes that move a donor between cells, groups or availability
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS donor_density_on_update
+        AFTER UPDATE OF latitude, longitude, blood_group, availability ON donors
+        WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+          OR OLD.blood_group IS NOT NEW.blood_group OR OLD.availability IS NOT NEW.availability
+        BEGIN {add_sql('OLD', -1)} {add_sql('NEW', 1)} END
+    ''')
+
+
+def backfill_density(cursor):
+    """Rebuild donor_density from scratch out of donors"""
+    cursor.execute('DELETE FROM donor_density')
+    cursor.execute(f'''
+        INSERT INTO donor_density (cell_lat, cell_lon, blood_group, availability, donors)
+        SELECT {cell_sql('latitude')}, {cell_sql('longitude')}, blood_group, IFNULL(availability, ''), COUNT(*)
+        FROM donors
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+
+def read_density(conn):
+    return conn.execute('SELECT cell_lat, cell_lon, blood_group, availability, donors FROM donor_density').fetchall()
+
+
+class DensityGrid:
+    """donor_density rows as of one version; never modified once built"""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        # (cell_lat, cell_lon) -> {(blood_group, availability): donors}
+        self.cells = {}
+        for cell_lat, cell_lon, blood_group, availability, donors in rows:
+            groups = self.cells.setdefault((cell_lat, cell_lon), {})
+            groups[(blood_group, availability)] = groups.get((blood_group, availability), 0) + donors
+        self._counts = {}
+
+    def counts(self, blood_groups=None, availability='Available'):
+        """Donors per cell, limited to some blood groups and an availability (None for any)"""
+        key = (tuple(sorted(blood_groups)) if blood_groups is not None else None, availability)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = {}
+            for cell, groups in self.cells.items():
+                total = sum(donors for (group, status), donors in groups.items()
+                            if (blood_groups is None or group in blood_groups)
+                            and (availability is None or status == availability))
+                if total:
+                    counts[cell] = total
+            self._counts[key] = counts
+        return counts
+
+    def heatmap(self, blood_groups=None, availability='Available'):
+        """Occupied cells with their bounds, centre and donor counts by blood group"""
+        cells = []
+        for (cell_lat, cell_lon), total in sorted(self.counts(blood_groups, availability).items()):
+            south, west = cell_lat * CELL_DEGREES, cell_lon * CELL_DEGREES
+            by_group = {}
+            for (group, status), donors in self.cells[(cell_lat, cell_lon)].items():
+                if (blood_groups is None or group in blood_groups) and (availability is None or status == availability):
+                    by_group[group] = by_group.get(group, 0) + donors
+            cells.append({
+                'bounds': [round(south, 6), round(south + CELL_DEGREES, 6), round(west, 6), round(west + CELL_DEGREES, 6)],
+                'center': [round(south + CELL_DEGREES / 2, 6), round(west + CELL_DEGREES / 2, 6)],
+                'donors': total,
+                'by_group': by_group,
+            })
+        return cells
+
+    def search_radius_km(self, lat, lon, target, blood_groups=None, availability='Available', max_ring=MAX_RING):
+        """Smallest radius around a point certain to hold at least target donors
+
+        Grows a square of cells around the point one ring at a time until
+        it holds target donors, then returns the distance to the
+        square's farthest corner, so every donor counted lies within it.
+        Returns None if the grid cannot guarantee target donors within
+        max_ring rings.
+        """
+        counts = self.counts(blood_groups, availability)
+        if sum(counts.values()) < target:
+            return None
+        center_lat, center_lon = cell_of(lat), cell_of(lon)
+        found = 0
+        for ring in range(max_ring + 1):
+            for i in range(center_lat - ring, center_lat + ring + 1):
+                if abs(i - center_lat) == ring:
+                    columns = range(center_lon - ring, center_lon + ring + 1)
+                else:
+                    columns = (center_lon - ring, center_lon + ring)
+                found += sum(counts.get((i, j), 0) for j in columns)
+            if found >= target:
+                south, north = (center_lat - ring) * CELL_DEGREES, (center_lat + ring + 1) * CELL_DEGREES
+                west, east = (center_lon - ring) * CELL_DEGREES, (center_lon + ring + 1) * CELL_DEGREES
+                return max(float(haversine_km(lat, lon, corner_lat, corner_lon))
+                           for corner_lat in (south, north) for corner_lon in (west, east))
+        return None
+
+
+class DensityMap:
+    """The latest DensityGrid, re-read only when the donors version changes"""
+
+    def __init__(self):
+        self.grid = DensityGrid([])
+
+    def get(self, version, read):
+        """The grid at version, rebuilt when the cached one is at another
+
+        read() returns a version and the rows read with it in one
+        transaction; the new grid is keyed to that version, which may be
+        newer than the one asked for.
+        """
+        grid = self.grid
+        if grid.version is None or grid.version != version:
+            version, rows = read()
+            grid = self.grid = DensityGrid(rows, version)
+        return grid
@@ -0,0 +1,280 @@
+"""Multi-criteria donor search compiled to indexed SQL
+
+DonorQuery turns search filters into one parameterized SELECT that is
+pinned with INDEXED BY to the index best suited to the combination, so
+a query either uses that index or fails loudly instead of quietly
+falling back to a table scan. check_plans() runs EXPLAIN QUERY PLAN over
+every filter combination to catch regressions.
+"""
+import itertools
+import math
+from datetime import date, datetime, timedelta
+from allocation import BLOOD_COMPATIBILITY, EARTH_RADIUS_KM
+from availability_windows import callable_sql, parse_moment, time_range
+
+# Whole blood donors must wait this long between donations
+DONATION_INTERVAL_DAYS = 56
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Every search filters on availability, so each index leads with it. The
+# eligibility index is on an expression so donors who never donated sort
+# first and "never, or on or before a date" stays a single range.
+SEARCH_INDEXES = {
+    'idx_donors_search_group': 'donors (availability, blood_group, latitude)',
+    'idx_donors_search_latitude': 'donors (availability, latitude)',
+    'idx_donors_search_age': 'donors (availability, age)',
+    'idx_donors_search_eligible': "donors (availability, IFNULL(last_donation_date, ''))",
+    'idx_donors_search_health': 'donors (availability, health_status)',
+}
+
+
+def init_search_indexes(cursor):
+    for name, definition in SEARCH_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+class DonorQuery:
+    """Donor search filters; compile() turns them into SQL
+
+    Filters left as None are not applied. blood_groups narrows to exact
+    groups and compatible_for to groups that can donate to a recipient;
+    both together keep the intersection. A latitude and longitude sort
+    results nearest first and radius_km limits how far away they may be.
+    available_at keeps donors whose availability windows let them be
+    called at that time, or with available_within_hours at some point
+    in that many hours from it (default now).
+    """
+
+    def __init__(self, blood_groups=None, compatible_for=None, min_age=None, max_age=None, latitude=None,
+                 longitude=None, radius_km=None, eligible_by=None, health_status=None, location=None,
+                 available_at=None, available_within_hours=None, limit=DEFAULT_LIMIT):
+        self.blood_groups = blood_groups
+        self.compatible_for = compatible_for
+        self.min_age = min_age
+        self.max_age = max_age
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_km = radius_km
+        self.eligible_by = eligible_by
+        self.health_status = health_status
+        self.location = location
+        self.available_at = available_at
+        self.available_within_hours = available_within_hours
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a query from request arguments, raising ValueError for bad values"""
+        def number(name, kind=float):
+            value = args.get(name, '').strip()
+            if not value:
+                return None
+            try:
+                return kind(value)
+            except ValueError:
+                raise ValueError(f'{name} must be a number') from None
+
+        blood_group = args.get('blood_group') or None
+        compatible_for = args.get('compatible_for') or None
+        for name, group in [('blood_group', blood_group), ('compatible_for', compatible_for)]:
+            if group is not None and group not in BLOOD_COMPATIBILITY:
+                raise ValueError(f'Unknown {name}: {group}')
+        eligible_by = args.get('eligible_by') or None
+        if eligible_by is not None:
+            try:
+                eligible_by = datetime.strptime(eligible_by, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError('eligible_by must be a YYYY-MM-DD date') from None
+        available_at = args.get('available_at') or None
+        if available_at == 'now':
+            available_at = datetime.now()
+        elif available_at is not None:
+            available_at = parse_moment(available_at, 'available_at')
+
+        limit = number('limit', int)
+        if limit is not None and limit < 1:
+            raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+
+        query = cls(blood_groups=[blood_group] if blood_group else None, compatible_for=compatible_for,
+                    min_age=number('min_age', int), max_age=number('max_age', int),
+                    latitude=number('latitude'), longitude=number('longitude'),
+                    radius_km=number('radius_km'), eligible_by=eligible_by,
+                    health_status=args.get('health_status') or None, location=args.get('location') or None,
+                    available_at=available_at, available_within_hours=number('available_within_hours'),
+                    limit=DEFAULT_LIMIT if limit is None else min(limit, MAX_LIMIT))
+        if (query.latitude is None) != (query.longitude is None):
+            raise ValueError('latitude and longitude must be given together')
+        if query.radius_km is not None and query.latitude is None:
+            raise ValueError('radius_km needs a latitude and longitude')
+        if query.available_within_hours is not None and query.available_within_hours < 0:
+            raise ValueError('available_within_hours cannot be negative')
+        return query
+
+    def groups(self):
+        """Blood groups to match, or None for any"""
+        groups = None
+        if self.blood_groups:
+            groups = list(self.blood_groups)
+        if self.compatible_for:
+            compatible = BLOOD_COMPATIBILITY.get(self.compatible_for, [])
+            groups = [g for g in groups if g in compatible] if groups is not None else list(compatible)
+        return groups
+
+    def window(self):
+        """(start, end) minutes donors must be callable within, or None for any time"""
+        if self.available_at is None and self.available_within_hours is None:
+            return None
+        return time_range(self.available_at, self.available_within_hours)
+
+    def choose_index(self):
+        """Pick the index to drive the search, most selective filter first
+
+        Blood groups split donors eight ways and pair with the latitude
+        band of a radius search; a radius alone is next, then age ranges,
+        eligibility and health status. With none of these the group index
+        still serves the availability prefix.
+        """
+        if self.groups() is not None:
+            return 'idx_donors_search_group'
+        if self.radius_km is not None:
+            return 'idx_donors_search_latitude'
+        if self.min_age is not None or self.max_age is not None:
+            return 'idx_donors_search_age'
+        if self.eligible_by is not None:
+            return 'idx_donors_search_eligible'
+        if self.health_status is not None:
+            return 'idx_donors_search_health'
+        return 'idx_donors_search_group'
+
+    def compile(self):
+        """Return (sql, params, index) for this search"""
+        index = self.choose_index()
+        conditions, params = ["availability = 'Available'"], []
+        select = 'donors.*'
+        order = 'id'
+
+        groups = self.groups()
+        if groups is not None:
+            conditions.append(f"blood_group IN ({', '.join('?' for _ in groups) or 'NULL'})")
+            params.extend(groups)
+        if self.min_age is not None:
+            conditions.append('age >= ?')
+            params.append(self.min_age)
+        if self.max_age is not None:
+            conditions.append('age <= ?')
+            params.append(self.max_age)
+        if self.eligible_by is not None:
+            last_allowed = self.eligible_by - timedelta(days=DONATION_INTERVAL_DAYS)
+            conditions.append("IFNULL(last_donation_date, '') <= ?")
+            params.append(last_allowed.isoformat())
+        if self.health_status is not None:
+            conditions.append('health_status = ?')
+            params.append(self.health_status)
+        if self.location is not None:
+            conditions.append('location LIKE ?')
+            params.append(f'%{self.location}%')
+        window = self.window()
+        if window is not None:
+            condition, window_params = callable_sql(*window)
+            conditions.append(condition)
+            params.extend(window_params)
+
+        select_params = []
+        if self.latitude is not None:
+            # Equirectangular distance: plain arithmetic SQLite can sort on,
+            # accurate to well under 1% at city and regional scale
+            km_per_degree = EARTH_RADIUS_KM * math.pi / 180
+            lon_scale = math.cos(math.radians(self.latitude))
+            distance_sq = '((latitude - ?) * (latitude - ?) + (longitude - ?) * (longitude - ?) * ?)'
+            distance_params = [self.latitude, self.latitude, self.longitude, self.longitude, lon_scale ** 2]
+            select = f'donors.*, {distance_sq} AS distance_sq'
+            select_params = distance_params
+            conditions.append('latitude IS NOT NULL AND longitude IS NOT NULL')
+            order = 'distance_sq, id'
+            if self.radius_km is not None:
+                # The latitude band lets the index narrow rows before the exact check
+                band = self.radius_km / km_per_degree
+                conditions.append('latitude BETWEEN ? AND ?')
+                params.extend([self.latitude - band, self.latitude + band])
+                conditions.append(f'{distance_sq} <= ?')
+                params.extend(distance_params + [band ** 2])
+
+        sql = (f'SELECT {select} FROM donors INDEXED BY {index} WHERE {" AND ".join(conditions)} '
+               f'ORDER BY {order} LIMIT ?')
+        return sql, select_params + params + [self.limit], index
+
+    def run(self, conn):
+        """Matching donors as dicts, with distance_km when searching near a point"""
+        sql, params, _ = self.compile()
+        donors = [dict(row) for row in conn.execute(sql, params)]
+        km_per_degree = EARTH_RADIUS_KM * math.pi / 180
+        for donor in donors:
+            if 'distance_sq' in donor:
+                donor['distance_km'] = math.sqrt(donor.pop('distance_sq')) * km_per_degree
+        return donors
+
+    def counted_by_density(self):
+        """True if the donor density grid counts exactly the donors this search can return
+
+        The grid only knows blood group, availability and position.
+        """
+        return (self.min_age is None and self.max_age is None and self.eligible_by is None
+                and self.health_status is None and self.location is None and self.window() is None)
+
+    def is_basic(self):
+        """True if only the blood group and location filters of the plain search form are set"""
+        return (self.compatible_for is None and self.min_age is None and self.max_age is None
+                and self.latitude is None and self.eligible_by is None and self.health_status is None
+                and self.window() is None and (self.blood_groups is None or len(self.blood_groups) == 1))
+
+
+# One sample value per filter for check_plans()
+SAMPLE_FILTERS = {
+    'blood_group': {'blood_groups': ['O-']},
+    'compatible_for': {'compatible_for': 'A+'},
+    'age': {'min_age': 25, 'max_age': 40},
+    'near': {'latitude': 12.5, 'longitude': 77.5},
+    'radius': {'latitude': 12.5, 'longitude': 77.5, 'radius_km': 10},
+    'eligible_by': {'eligible_by': date(2026, 1, 1)},
+    'health_status': {'health_status': 'Good'},
+    'location': {'location': 'north'},
+    'available': {'available_at': datetime(2026, 1, 5, 18, 0), 'available_within_hours': 6},
+}
+
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_plans(conn):
+    """Plan every combination of SAMPLE_FILTERS and return the ones that regress
+
+    A plan regresses if it scans donors, if the chosen index only
+    narrows on availability although the query has a filter that index
+    covers, or if a window lookup reads the whole R*Tree instead of
+    searching it by time. Returns a list of (filter names, sql, plan lines).
+    """
+    problems = []
+    names = list(SAMPLE_FILTERS)
+    for size in range(len(names) + 1):
+        for combo in itertools.combinations(names, size):
+            filters = {}
+            for name in combo:
+                filters.update(SAMPLE_FILTERS[name])
+            query = DonorQuery(**filters)
+            sql, params, index = query.compile()
+            try:
+                plan = explain(conn, sql, params)
+            except Exception as e:
+                problems.append((combo, sql, [str(e)]))
+                continue
+            donor_lines = [line for line in plan if ' donors ' in f'{line} ']
+            scans = [line for line in donor_lines if line.startswith('SCAN')]
+            # R*Trees plan INDEX 2 when searching by coordinates
+            scans += [line for line in plan if 'VIRTUAL TABLE' in line and 'INDEX 2:' not in line]
+            narrows = any(index in line and '(availability=? AND' in line for line in donor_lines)
+            drives = query.choose_index() != 'idx_donors_search_group' or query.groups() is not None
+            if scans or not donor_lines or (drives and not narrows):
+                problems.append((combo, sql, plan))
+    return problems
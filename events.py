@@ -0,0 +1,179 @@
+"""Dashboard change feed fanned out to server-sent event clients
+
+Events are appended to the shared change_log table, so every worker sees
+every event and the change_log id is the event id: a client can resume
+with Last-Event-ID on any worker, including one that restarted.
+"""
+import json
+import threading
+from collections import deque
+import slow_queries
+
+# Events replayed at most to a client resuming via Last-Event-ID
+HISTORY_SIZE = 200
+# Seconds between checks of change_log for events from other workers
+POLL_SECONDS = 0.5
+# Events buffered per client before a slow client is dropped
+SUBSCRIBER_QUEUE_SIZE = 500
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_SECONDS = 15
+
+
+class Subscriber:
+    """Bounded event buffer for one connected client"""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.events = deque()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, event):
+        """Buffer an event; returns False if the client has fallen too far behind"""
+        with self.condition:
+            if len(self.events) >= self.maxsize:
+                self.closed = True
+                self.events.clear()
+                self.condition.notify()
+                return False
+            self.events.append(event)
+            self.condition.notify()
+            return True
+
+    def get(self, timeout):
+        """Return the next event, or None on timeout or once closed"""
+        with self.condition:
+            if not self.events and not self.closed:
+                self.condition.wait(timeout)
+            if self.events:
+                return self.events.popleft()
+            return None
+
+
+class EventPublisher:
+    """Publish events to change_log and poll it for this worker's subscribers"""
+
+    def __init__(self, db_path, history_size=HISTORY_SIZE, interval=POLL_SECONDS):
+        self.db_path = db_path
+        self.history_size = history_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # Highest change_log id handed to subscribers
+        self._last_id = None
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        return slow_queries.connect(self.db_path, timeout=30)
+
+    def publish(self, event_type, data):
+        """Append an event to change_log and return its id
+
+        Call it after committing the change the event reports; it writes
+        through its own connection.
+        """
+        conn = self._connect()
+        try:
+            event_id = conn.execute(
+                "INSERT INTO change_log (table_name, row_id, event, payload) VALUES ('events', 0, ?, ?)",
+                (event_type, json.dumps(data, default=str))
+            ).lastrowid
+            conn.commit()
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return event_id
+
+    def _read(self, after, upto=None, limit=None):
+        """Events with after < id <= upto, the newest limit of them, oldest first"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT id, event, payload FROM change_log WHERE id > ? AND id <= ? AND event IS NOT NULL '
+                'ORDER BY id DESC LIMIT ?',
+                (after, upto if upto is not None else 2 ** 63 - 1, limit if limit is not None else -1)
+            ).fetchall()
+        finally:
+            conn.close()
+        return rows[::-1]
+
+    def _latest_id(self):
+        conn = self._connect()
+        try:
+            # sqlite_sequence keeps counting after old entries are pruned
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 0
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                print(f'Dashboard event poll failed: {e}')
+
+    def poll(self):
+        """Hand events logged since the last poll, by any worker, to this worker's subscribers"""
+        events = self._read(self._last_id)
+        if not events:
+            return
+        with self._lock:
+            events = [tuple(event) for event in events if event[0] > self._last_id]
+            if events:
+                self._last_id = events[-1][0]
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            for event in events:
+                if not subscriber.put(event):
+                    # The client stopped reading; its stream ends and it can
+                    # resume from change_log when it reconnects
+                    self.unsubscribe(subscriber)
+                    break
+
+    def subscribe(self, last_event_id=None):
+        """Register a subscriber queue, replaying events after last_event_id"""
+        subscriber = Subscriber()
+        with self._lock:
+            if self._thread is None:
+                self._last_id = self._latest_id()
+                self._thread = threading.Thread(target=self._run, name='dashboard-events', daemon=True)
+                self._thread.start()
+            # Up to _last_id from change_log; the poller delivers the rest
+            if last_event_id is not None:
+                for event in self._read(last_event_id, self._last_id, self.history_size):
+                    subscriber.put(tuple(event))
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+        """Yield server-sent event frames until the client disconnects"""
+        subscriber = self.subscribe(last_event_id)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                event = subscriber.get(timeout=heartbeat)
+                if event is None:
+                    if subscriber.closed:
+                        return
+                    yield ': keep-alive\n\n'
+                    continue
+                event_id, event_type, payload = event
+                yield f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+
+# Shared publisher for the admin dashboard feed
+dashboard_events = EventPublisher('blood_bank.db')
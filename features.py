@@ -0,0 +1,115 @@
+"""Fixed, versioned feature encoding for donor matching
+
+Donors and patients are encoded with the same schema: one-hot blood
+groups from a fixed vocabulary and numeric columns standardized with
+parameters fitted once and saved to FEATURE_SCHEMA_PATH. Reusing the
+saved parameters keeps encoded matrices comparable between requests,
+so they can be cached.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from allocation import BLOOD_COMPATIBILITY
+
+# Bump when the columns or their encoding change; saved schemas of an
+# older version are refitted
+FEATURE_SCHEMA_VERSION = 2
+FEATURE_SCHEMA_PATH = 'feature_schema.json'
+
+BLOOD_GROUPS = sorted(BLOOD_COMPATIBILITY)
+# Time since a donor's last donation is left out: a patient has no such
+# value, and any stand-in pulls matches toward donors of that recency
+NUMERIC_COLUMNS = ['age', 'latitude', 'longitude']
+# One-hot blood group columns are scaled by this so that a group mismatch
+# outweighs any plausible difference in the standardized columns
+BLOOD_GROUP_WEIGHT = 10.0
+
+
+def numeric_frame(df):
+    return pd.DataFrame({
+        'age': pd.to_numeric(df['age'], errors='coerce').to_numpy(dtype=float),
+        'latitude': pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype=float),
+        'longitude': pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype=float),
+    })
+
+
+class FeatureSchema:
+    """Category vocabularies and scaling parameters shared by donors and patients"""
+
+    def __init__(self, means, scales, blood_groups=BLOOD_GROUPS, version=FEATURE_SCHEMA_VERSION, fitted=None):
+        self.version = version
+        self.blood_groups = list(blood_groups)
+        self.means = {column: float(means[column]) for column in NUMERIC_COLUMNS}
+        self.scales = {column: float(scales[column]) for column in NUMERIC_COLUMNS}
+        self.fitted = fitted or datetime.now().isoformat(timespec='seconds')
+        self._group_index = {group: i for i, group in enumerate(self.blood_groups)}
+
+    @classmethod
+    def fit(cls, donors_df):
+        """Derive scaling parameters from a donor frame"""
+        numeric = numeric_frame(donors_df)
+        means = numeric.mean().fillna(0.0)
+        # Constant or empty columns keep unit scale instead of dividing by zero
+        scales = numeric.std(ddof=0).fillna(1.0).replace(0.0, 1.0)
+        return cls(means.to_dict(), scales.to_dict())
+
+    def to_dict(self):
+        return {'version': self.version, 'blood_groups': self.blood_groups,
+                'means': self.means, 'scales': self.scales, 'fitted': self.fitted}
+
+    @property
+    def fingerprint(self):
+        """Short hash identifying this exact encoding, for cache keys"""
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()[:12]
+
+    def save(self, path=FEATURE_SCHEMA_PATH):
+        # Write then rename so concurrent workers never read a partial file;
+        # warm-up and a first request can both save from one process
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=FEATURE_SCHEMA_PATH):
+        """Return the saved schema, or None if missing or of another version"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != FEATURE_SCHEMA_VERSION:
+            return None
+        return cls(data['means'], data['scales'], data['blood_groups'], data['version'], data['fitted'])
+
+    @classmethod
+    def load_or_fit(cls, donors_df, path=FEATURE_SCHEMA_PATH):
+        """Load the saved schema, fitting and saving one from donors_df the first time"""
+        schema = cls.load(path)
+        if schema is None:
+            schema = cls.fit(donors_df)
+            schema.save(path)
+        return schema
+
+    def transform(self, df):
+        """Encode a donor or patient frame into a float matrix
+
+        Columns are the weighted one-hot blood group followed by the
+        standardized NUMERIC_COLUMNS. Unknown blood groups encode as all zeros.
+        """
+        numeric = numeric_frame(df)
+        scaled = np.column_stack([
+            (numeric[column].fillna(self.means[column]).to_numpy(dtype=float) - self.means[column])
+            / self.scales[column]
+            for column in NUMERIC_COLUMNS
+        ]) if len(df) else np.empty((0, len(NUMERIC_COLUMNS)))
+        one_hot = np.zeros((len(df), len(self.blood_groups)))
+        codes = np.array([self._group_index.get(group, -1) for group in df['blood_group']], dtype=int)
+        known = codes >= 0
+        one_hot[np.flatnonzero(known), codes[known]] = BLOOD_GROUP_WEIGHT
+        return np.hstack([one_hot, scaled])
+
@@ -0,0 +1,89 @@
+"""Startup warm-up tracking behind the /healthz and /readyz endpoints"""
+import sqlite3
+import threading
+import time
+
+# A failed warm-up is retried after this long, doubling per failure up to the cap
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+
+class Readiness:
+    """Run a warm-up function once and record what it built
+
+    The warm-up calls record() for each component it prepares; a worker
+    is ready once the whole function has returned without raising. After
+    a failure, start() waits out a growing backoff before trying again.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.components = {}
+        self.failures = 0
+        self.retry_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, name, size, build_seconds):
+        self.components[name] = {'size': size, 'build_seconds': round(build_seconds, 4), 'built_at': time.time()}
+
+    def run(self, warm_up):
+        """Warm up in the calling thread, e.g. before the server starts listening"""
+        with self._lock:
+            if self.started_at is not None and self.error is None:
+                return
+            self.started_at, self.error = time.time(), None
+        try:
+            warm_up(self)
+        except Exception as e:
+            self.error = str(e)
+            self.failures += 1
+            self.retry_at = time.time() + min(RETRY_BASE_SECONDS * 2 ** (self.failures - 1), RETRY_MAX_SECONDS)
+            print(f'Warm-up failed: {e}')
+            return
+        self.finished_at = time.time()
+        self.failures, self.retry_at = 0, None
+        self.ready = True
+
+    def start(self, warm_up):
+        """Warm up in a background thread unless already started, done or backing off"""
+        if self.ready or (self._thread is not None and self._thread.is_alive()):
+            return
+        if self.retry_at is not None and time.time() < self.retry_at:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run, args=(warm_up,), name='warm-up', daemon=True)
+            self._thread.start()
+
+    def report(self):
+        now = time.time()
+        return {
+            'ready': self.ready,
+            'error': self.error,
+            'failures': self.failures,
+            'retry_in_seconds': round(max(self.retry_at - now, 0), 1) if self.retry_at else None,
+            'warmup_seconds': round(self.finished_at - self.started_at, 4) if self.finished_at else None,
+            'components': {name: {'size': c['size'], 'build_seconds': c['build_seconds'],
+                                  'age_seconds': round(now - c['built_at'], 1)}
+                           for name, c in self.components.items()},
+        }
+
+
+def database_status(db_path, timeout=1.0):
+    """Return (reachable, latency_ms or error message) for a trivial query"""
+    start = time.perf_counter()
+    try:
+        # mode=rw so a missing database file is reported, not created
+        conn = sqlite3.connect(f'file:{db_path}?mode=rw', uri=True, timeout=timeout)
+        try:
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return False, str(e)
+    return True, round((time.perf_counter() - start) * 1000, 3)
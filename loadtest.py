@@ -0,0 +1,242 @@
+"""Mixed-workload load generator for the blood bank web app.
+
+Starts app.py on a local port against a scratch database (or targets
+--url), drives its routes from concurrent clients with a weighted mix
+and reports throughput and latency percentiles per route:
+
+    python loadtest.py --concurrency 16 --duration 30
+    python loadtest.py --mix search_donors=10,api_inventory=5,patient_request=1
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+import numpy as np
+
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+URGENCIES = ['Low', 'Medium', 'High', 'Critical']
+LOCATIONS = ['North', 'South', 'East', 'West', 'Central']
+
+# Relative weight of each route in the default mix
+DEFAULT_MIX = {
+    'login': 1,
+    'donor_register': 2,
+    'patient_request': 1,
+    'search_donors': 6,
+    'admin_dashboard': 2,
+    'api_donors': 3,
+    'api_inventory': 5,
+}
+
+
+class HttpClient:
+    """Minimal cookie-keeping HTTP client; redirects are not followed"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.cookie = None
+
+    def request(self, method, path, form=None, headers=None, json_body=None):
+        """Send a request with a form or a JSON body and return (status, response headers, body)"""
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        return response.status, response.headers, data
+
+    def login(self, username='admin', password='admin123'):
+        return self.request('POST', '/login', {'username': username, 'password': password})
+
+
+def random_person(rng):
+    n = rng.randrange(10 ** 9)
+    return {
+        'name': f'Load Test {n}',
+        'email': f'load{n}-{time.monotonic_ns()}@example.com',
+        'phone': f'9{n:09d}',
+        'blood_group': rng.choice(BLOOD_GROUPS),
+        'age': str(rng.randint(18, 65)),
+        'location': rng.choice(LOCATIONS),
+    }
+
+
+def make_request(client, route, rng):
+    """Issue one request for a named route and return its HTTP status"""
+    if route == 'login':
+        return client.login()[0]
+    if route == 'donor_register':
+        return client.request('POST', '/donor/register', random_person(rng))[0]
+    if route == 'patient_request':
+        form = random_person(rng)
+        form.update(units_needed=str(rng.randint(1, 4)), urgency=rng.choice(URGENCIES))
+        return client.request('POST', '/patient/request', form)[0]
+    if route == 'search_donors':
+        query = urlencode({'blood_group': rng.choice(BLOOD_GROUPS + ['']), 'location': rng.choice(LOCATIONS + [''])})
+        return client.request('GET', f'/search/donors?{query}')[0]
+    if route == 'admin_dashboard':
+        return client.request('GET', '/admin/dashboard')[0]
+    if route == 'api_donors':
+        return client.request('GET', '/api/donors', headers={'Accept-Encoding': 'gzip'})[0]
+    if route == 'api_inventory':
+        return client.request('GET', '/api/inventory')[0]
+    raise ValueError(f'Unknown route: {route}')
+
+
+def start_local_server(seed_donors=1000):
+    """Serve app.py on a free local port against a scratch database
+
+    Returns (base_url, server). The process working directory moves to a
+    temporary directory because the app opens blood_bank.db relatively.
+    """
+    from werkzeug.serving import make_server
+
+    os.chdir(tempfile.mkdtemp(prefix='blood_bank_load_'))
+    import app as blood_bank_app
+
+    blood_bank_app.init_db()
+    rng = random.Random(0)
+    conn = blood_bank_app.get_db_connection()
+    conn.executemany('''
+        INSERT INTO donors (user_id, name, email, phone, blood_group, age, location, latitude, longitude)
+        VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(p['name'], p['email'], p['phone'], p['blood_group'], int(p['age']), p['location'],
+           rng.uniform(12.0, 13.0), rng.uniform(77.0, 78.0))
+          for p in (random_person(rng) for _ in range(seed_donors))])
+    conn.commit()
+    conn.close()
+
+    # Per-request access logs would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, blood_bank_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def percentiles(latencies):
+    """Return (p50, p95, p99) in milliseconds"""
+    if not latencies:
+        return 0.0, 0.0, 0.0
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return p50, p95, p99
+
+
+def print_report(results, elapsed, title='Load test'):
+    """Print per-route throughput, errors and latency percentiles"""
+    total = sum(len(r['latencies']) for r in results.values())
+    print(f'\n{title}: {total} requests in {elapsed:.1f}s ({total / elapsed:,.1f} req/s)')
+    width = max([len(route) for route in results] + [16]) + 2
+    print(f"{'route':<{width}}{'count':>8}{'req/s':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    for route in sorted(results):
+        r = results[route]
+        p50, p95, p99 = percentiles(r['latencies'])
+        statuses = ', '.join(f'{s}x{n}' for s, n in sorted(r['statuses'].items(), key=str))
+        print(f"{route:<{width}}{len(r['latencies']):>8}{len(r['latencies']) / elapsed:>9.1f}{r['errors']:>8}"
+              f'{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}  {statuses}')
+
+
+def run_load(base_url, mix, concurrency, duration=None, total_requests=None, seed=0):
+    """Drive the mix from concurrent clients until duration or total_requests is reached"""
+    routes, weights = zip(*mix.items())
+    results = defaultdict(lambda: {'latencies': [], 'statuses': defaultdict(int), 'errors': 0})
+    lock = threading.Lock()
+    issued = [0]
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = HttpClient(base_url)
+        client.login()
+        while True:
+            with lock:
+                if total_requests is not None and issued[0] >= total_requests:
+                    return
+                issued[0] += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            route = rng.choices(routes, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = make_request(client, route, rng)
+            except (OSError, http.client.HTTPException):
+                status = 'failed'
+            latency = time.perf_counter() - start
+            with lock:
+                r = results[route]
+                r['latencies'].append(latency)
+                r['statuses'][status] += 1
+                if status == 'failed' or status >= 500:
+                    r['errors'] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def parse_mix(text):
+    """Parse 'route=weight,route=weight' into a mix dictionary"""
+    mix = {}
+    for item in text.split(','):
+        route, _, weight = item.partition('=')
+        route = route.strip()
+        if route not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown route '{route}' (choose from {', '.join(DEFAULT_MIX)})")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Target an already running server instead of starting one')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run (default 10)')
+    parser.add_argument('--requests', type=int, help='Stop after this many requests instead')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='Weighted route mix')
+    parser.add_argument('--seed-donors', type=int, default=1000, help='Donors loaded into the scratch database')
+    args = parser.parse_args()
+
+    base_url = args.url
+    server = None
+    if base_url is None:
+        base_url, server = start_local_server(args.seed_donors)
+        print(f'Started local server at {base_url} with {args.seed_donors} donors')
+
+    results, elapsed = run_load(base_url, args.mix, args.concurrency,
+                                duration=None if args.requests else args.duration,
+                                total_requests=args.requests)
+    print_report(results, elapsed)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""Transactional outbox and background dispatcher for donor notifications"""
+import json
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import slow_queries
+
+BATCH_SIZE = 50
+# Messages handed to the transport per second, across all batches
+RATE_LIMIT_PER_SECOND = 20
+MAX_ATTEMPTS = 5
+# Retry n waits RETRY_BASE_SECONDS * 2 ** (n - 1)
+RETRY_BASE_SECONDS = 30
+POLL_INTERVAL_SECONDS = 5
+# A claimed batch goes back to the queue if its worker has not recorded
+# an outcome by then, e.g. because it was killed mid-send
+CLAIM_LEASE_SECONDS = 300
+
+
+def init_outbox(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            donor_id INTEGER NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_date TEXT DEFAULT CURRENT_TIMESTAMP,
+            sent_date TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients (id),
+            FOREIGN KEY (donor_id) REFERENCES donors (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox (status, next_attempt_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_patient ON notification_outbox (patient_id)')
+
+
+def enqueue_donor_notifications(cursor, patient_id, patient, donors):
+    """Queue one message per matched donor using the caller's transaction
+
+    The rows commit or roll back together with the match result, and
+    nothing is sent until the dispatcher picks them up.
+    """
+    subject = f"Urgent: {patient['blood_group']} blood needed"
+    rows = []
+    for donor in donors:
+        message = (f"Hello {donor['name']}, a {patient['urgency'].lower()} priority request for "
+                   f"{patient['units_needed']} unit(s) of {patient['blood_group']} blood was made near "
+                   f"{patient['location']}. If you are able to donate, please contact the blood bank.")
+        rows.append((patient_id, int(donor['id']), donor['email'], subject, message))
+    cursor.executemany('''
+        INSERT INTO notification_outbox (patient_id, donor_id, recipient, subject, message)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    return len(rows)
+
+
+class FileTransport:
+    """Append messages to a JSON lines file; a local stand-in for e-mail"""
+
+    def __init__(self, path='notifications.jsonl'):
+        self.path = path
+
+    def send_batch(self, messages):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps({**message, 'sent_at': datetime.now().isoformat()}) + '\n')
+        return [None] * len(messages)
+
+
+class SMTPTransport:
+    """Send messages over one SMTP session per batch"""
+
+    def __init__(self, host='localhost', port=25, sender='noreply@bloodbank.local'):
+        self.host, self.port, self.sender = host, int(port), sender
+
+    def send_batch(self, messages):
+        errors = []
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message['recipient']
+                email['Subject'] = message['subject']
+                email.set_content(message['message'])
+                try:
+                    smtp.send_message(email)
+                    errors.append(None)
+                except smtplib.SMTPException as e:
+                    errors.append(str(e))
+        return errors
+
+
+def transport_from_env():
+    """Build the transport named by BLOOD_BANK_NOTIFY, e.g. 'file:out.jsonl' or 'smtp:localhost:1025'"""
+    kind, _, target = os.environ.get('BLOOD_BANK_NOTIFY', 'file:notifications.jsonl').partition(':')
+    if kind == 'smtp':
+        host, _, port = target.partition(':')
+        return SMTPTransport(host or 'localhost', port or 25)
+    return FileTransport(target or 'notifications.jsonl')
+
+
+class NotificationDispatcher:
+    """Deliver due outbox rows in rate-limited batches from a background thread
+
+    Transports implement send_batch(messages) and return one entry per
+    message: None when delivered, or an error string. Failed messages are
+    retried with exponential backoff and marked Failed after MAX_ATTEMPTS.
+    Each batch is claimed as Sending before it is sent, so dispatchers in
+    several worker processes never send the same rows.
+    """
+
+    def __init__(self, db_path, transport, batch_size=BATCH_SIZE, rate_limit=RATE_LIMIT_PER_SECOND,
+                 max_attempts=MAX_ATTEMPTS, poll_interval=POLL_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.transport = transport
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start the dispatcher thread if it is not running; it drains any due rows first"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Start the dispatcher if needed and have it look at the outbox now"""
+        self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        conn = slow_queries.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        while True:
+            self._wakeup.clear()
+            try:
+                sent = self.dispatch_once(conn)
+            except sqlite3.Error as e:
+                print(f'Notification dispatch failed: {e}')
+                sent = 0
+            if sent < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+
+    def claim_batch(self, conn):
+        """Mark up to batch_size due rows Sending under a lease and return them
+
+        Rows still Sending after their lease expired belonged to a worker
+        that died, and are claimed again.
+        """
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=CLAIM_LEASE_SECONDS)
+        batch = conn.execute('''
+            UPDATE notification_outbox SET status = 'Sending', next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM notification_outbox
+                WHERE status IN ('Pending', 'Sending') AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, patient_id, donor_id, recipient, subject, message, attempts
+        ''', (lease.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'), self.batch_size)).fetchall()
+        conn.commit()
+        return sorted(batch, key=lambda row: row['id'])
+
+    def dispatch_once(self, conn):
+        """Claim and send one batch of due messages and record their outcome"""
+        batch = self.claim_batch(conn)
+        if not batch:
+            return 0
+
+        started = time.monotonic()
+        messages = [dict(row) for row in batch]
+        try:
+            errors = self.transport.send_batch(messages)
+        except Exception as e:
+            errors = [str(e)] * len(messages)
+
+        sent, retries = [], []
+        for message, error in zip(messages, errors):
+            if error is None:
+                sent.append((message['id'],))
+                continue
+            attempts = message['attempts'] + 1
+            status = 'Failed' if attempts >= self.max_attempts else 'Pending'
+            retry_at = datetime.utcnow() + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+            retries.append((status, attempts, retry_at.strftime('%Y-%m-%d %H:%M:%S'), error, message['id']))
+
+        conn.executemany('''
+            UPDATE notification_outbox
+            SET status = 'Sent', attempts = attempts + 1, sent_date = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ?
+        ''', sent)
+        conn.executemany('''
+            UPDATE notification_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+            WHERE id = ?
+        ''', retries)
+        conn.commit()
+
+        # Hold the batch rate to rate_limit messages per second
+        min_duration = len(messages) / self.rate_limit
+        elapsed = time.monotonic() - started
+        if elapsed < min_duration:
+            time.sleep(min_duration - elapsed)
+        return len(messages)
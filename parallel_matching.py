@@ -0,0 +1,93 @@
+"""Parallel nearest-donor queries for large batches of patients
+
+The encoded donor matrix is written once to a .npy file that every
+process worker memory-maps, so workers share the page cache instead of
+each receiving a pickled copy. Patient rows are split into chunks,
+queried in the pool and merged back in their original order.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from sklearn.neighbors import KDTree
+
+# Patients per task handed to a worker
+CHUNK_SIZE = 2048
+LEAF_SIZE = 40
+
+
+def default_workers():
+    """BLOOD_BANK_MATCH_WORKERS if set, otherwise one worker per core"""
+    return int(os.environ.get('BLOOD_BANK_MATCH_WORKERS', 0)) or os.cpu_count() or 1
+
+
+# Set in each process worker by _init_worker
+_worker_tree = None
+
+
+def _init_worker(path, leaf_size):
+    global _worker_tree
+    _worker_tree = KDTree(np.load(path, mmap_mode='r'), leaf_size=leaf_size)
+
+
+def _query_chunk(queries, k):
+    return _worker_tree.query(queries, k=k)
+
+
+class ParallelKNN:
+    """k-nearest-neighbour queries over a fixed matrix, split across workers
+
+    mode='process' gives each worker process its own tree over the shared
+    memory-mapped matrix; mode='thread' shares one tree between threads,
+    which helps less as tree queries hold the GIL for part of their work.
+    With one worker everything runs inline.
+    """
+
+    def __init__(self, features, workers=None, mode='process', chunk_size=CHUNK_SIZE, leaf_size=LEAF_SIZE):
+        self.workers = workers or default_workers()
+        self.chunk_size = chunk_size
+        self.n_samples = len(features)
+        self._directory = None
+        self._pool = None
+        self._tree = None
+        features = np.ascontiguousarray(features, dtype=np.float64)
+
+        if self.workers == 1 or mode == 'thread':
+            self._tree = KDTree(features, leaf_size=leaf_size)
+            if self.workers > 1:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='knn')
+        else:
+            self._directory = tempfile.mkdtemp(prefix='donor-index-')
+            path = os.path.join(self._directory, 'features.npy')
+            np.save(path, features)
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(path, leaf_size))
+
+    def query(self, queries, k=5):
+        """Return (distances, indices) arrays of shape (len(queries), k), nearest first"""
+        k = min(k, self.n_samples)
+        queries = np.ascontiguousarray(queries, dtype=np.float64)
+        if len(queries) == 0 or k == 0:
+            return np.empty((len(queries), k)), np.empty((len(queries), k), dtype=int)
+        if self._pool is None:
+            return self._tree.query(queries, k=k)
+
+        chunks = [queries[start:start + self.chunk_size] for start in range(0, len(queries), self.chunk_size)]
+        if self._tree is not None:
+            results = self._pool.map(lambda chunk: self._tree.query(chunk, k=k), chunks)
+        else:
+            results = self._pool.map(_query_chunk, chunks, [k] * len(chunks))
+        distances, indices = zip(*results)
+        return np.vstack(distances), np.vstack(indices)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
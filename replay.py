@@ -0,0 +1,168 @@
+"""Replay captured traffic against a local instance and compare builds.
+
+Capture traffic by starting the app with BLOOD_BANK_CAPTURE set to a
+JSON lines file, then stream that file back:
+
+    python replay.py traffic.jsonl --speed 10 --save new.json
+    python replay.py traffic.jsonl --speed 0 --compare old.json
+
+--speed 1 keeps the original pacing, higher values compress it and 0
+sends requests as fast as the clients allow.
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+from capture import HASHED_PREFIX, REDACTED
+from loadtest import LOCATIONS, HttpClient, percentiles, print_report, random_person, start_local_server
+
+
+def read_records(path):
+    """Stream captured records from a JSON lines file"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def fill_redacted(params, rng):
+    """Swap redacted and hashed values, including nested JSON ones, for synthetic ones of the right shape"""
+    person = random_person(rng)
+    person.update(username=f'replay{rng.randrange(10 ** 9)}', password='replay-password')
+
+    def fill(key, value):
+        if isinstance(value, dict):
+            return {name: fill(name, item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [fill(key, item) for item in value]
+        if value == REDACTED:
+            return person.get(key, 'replay')
+        if isinstance(value, str) and value.startswith(HASHED_PREFIX):
+            # One hashed location always replays as the same location
+            return LOCATIONS[int(value[len(HASHED_PREFIX):], 16) % len(LOCATIONS)]
+        return value
+    return fill(None, params)
+
+
+def replay(base_url, records, speed=1.0, concurrency=8, seed=0):
+    """Send records from a shared queue, paced by their original timestamps"""
+    results = defaultdict(lambda: {'latencies': [], 'statuses': defaultdict(int), 'errors': 0})
+    lock = threading.Lock()
+    pending = queue.Queue(maxsize=concurrency * 4)
+    started = time.perf_counter()
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = HttpClient(base_url)
+        client.login()
+        while True:
+            record = pending.get()
+            if record is None:
+                return
+            path = record['path']
+            args = fill_redacted(record.get('args', {}), rng)
+            if args:
+                path = f'{path}?{urlencode(args)}'
+            form = fill_redacted(record['form'], rng) if record.get('form') else None
+            json_body = fill_redacted(record['json'], rng) if 'json' in record else None
+            route = f"{record['method']} {record.get('route') or record['path']}"
+
+            start = time.perf_counter()
+            try:
+                status = client.request(record['method'], path, form, record.get('headers'), json_body)[0]
+            except (OSError, http.client.HTTPException):
+                status = 'failed'
+            latency = time.perf_counter() - start
+            with lock:
+                r = results[route]
+                r['latencies'].append(latency)
+                r['statuses'][status] += 1
+                if status == 'failed' or status >= 500:
+                    r['errors'] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    first_ts = None
+    for record in records:
+        if speed > 0:
+            first_ts = record['ts'] if first_ts is None else first_ts
+            delay = (record['ts'] - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        pending.put(record)
+
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results):
+    """Reduce raw results to per-route counts and percentiles for saving"""
+    summary = {}
+    for route, r in results.items():
+        p50, p95, p99 = percentiles(r['latencies'])
+        summary[route] = {'count': len(r['latencies']), 'errors': r['errors'],
+                          'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+    return summary
+
+
+def print_comparison(baseline, current):
+    """Print per-route latency percentiles of two runs side by side"""
+    print(f"\n{'route':<36}{'metric':>8}{'baseline':>11}{'current':>11}{'change':>9}")
+    for route in sorted(set(baseline) | set(current)):
+        before, after = baseline.get(route), current.get(route)
+        if before is None or after is None:
+            print(f"{route:<36}{'only in ' + ('current' if before is None else 'baseline'):>39}")
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f'{route:<36}{metric[:3]:>8}{before[metric]:>11.1f}{after[metric]:>11.1f}{change:>+8.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help='JSON lines capture file')
+    parser.add_argument('--url', help='Target an already running server instead of starting one')
+    parser.add_argument('--speed', type=float, default=1.0, help='Pacing factor; 0 replays as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed-donors', type=int, default=1000, help='Donors loaded into the scratch database')
+    parser.add_argument('--save', help='Write the latency summary of this run to a JSON file')
+    parser.add_argument('--compare', help='Compare against a summary saved by an earlier --save')
+    args = parser.parse_args()
+    # The local server changes the working directory
+    for name in ('capture', 'save', 'compare'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    base_url = args.url
+    server = None
+    if base_url is None:
+        base_url, server = start_local_server(args.seed_donors)
+
+    results, elapsed = replay(base_url, read_records(args.capture), args.speed, args.concurrency)
+    print_report(results, elapsed, title='Replay')
+    summary = summarize(results)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), summary)
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
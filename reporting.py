@@ -0,0 +1,126 @@
+"""Time-bucketed request rollups maintained incrementally by triggers"""
+
+# Rollup table name and the strftime format of its bucket column
+GRANULARITIES = {
+    'hourly': ('request_rollups_hourly', '%Y-%m-%d %H:00'),
+    'daily': ('request_rollups_daily', '%Y-%m-%d'),
+}
+
+# A request counts as matched once it has any outcome other than these
+UNRESOLVED_STATUS = 'Pending'
+NO_MATCH_STATUS = 'No Match'
+# Patient columns a rollup row depends on
+ROLLUP_COLUMNS = ['status', 'blood_group', 'urgency', 'units_needed', 'request_date']
+
+
+def matched_expr(status):
+    return f"COALESCE({status} NOT IN ('{UNRESOLVED_STATUS}', '{NO_MATCH_STATUS}'), 0)"
+
+
+def no_match_expr(status):
+    return f"COALESCE({status} = '{NO_MATCH_STATUS}', 0)"
+
+
+def upsert_sql(table, bucket_format, row, requests, units, matched, no_match):
+    """Build an upsert adding the given deltas to the bucket of row"""
+    return f'''
+        INSERT INTO {table} (bucket, blood_group, urgency, requests, units_requested, matched, no_match)
+        VALUES (strftime('{bucket_format}', {row}.request_date), {row}.blood_group, {row}.urgency,
+                {requests}, {units}, {matched}, {no_match})
+        ON CONFLICT (bucket, blood_group, urgency) DO UPDATE SET
+            requests = requests + excluded.requests,
+            units_requested = units_requested + excluded.units_requested,
+            matched = matched + excluded.matched,
+            no_match = no_match + excluded.no_match;
+    '''
+
+
+def init_rollups(cursor):
+    """Create rollup tables and the triggers that keep them current"""
+    for granularity, (table, bucket_format) in GRANULARITIES.items():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                blood_group TEXT NOT NULL,
+                urgency TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                units_requested INTEGER NOT NULL DEFAULT 0,
+                matched INTEGER NOT NULL DEFAULT 0,
+                no_match INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, blood_group, urgency)
+            ) WITHOUT ROWID
+        ''')
+
+        # New requests add to their bucket, including any outcome they
+        # were inserted with
+        insert_upsert = upsert_sql(table, bucket_format, 'NEW', 1, 'NEW.units_needed',
+                                   matched_expr('NEW.status'), no_match_expr('NEW.status'))
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_on_insert AFTER INSERT ON patients
+            BEGIN {insert_upsert} END
+        ''')
+
+        # Edits take the old row out of its bucket and add the new one, so
+        # a changed status, group, urgency, unit count or date all land
+        remove_upsert = upsert_sql(table, bucket_format, 'OLD', -1, '-OLD.units_needed',
+                                   f"-{matched_expr('OLD.status')}", f"-{no_match_expr('OLD.status')}")
+        add_upsert = upsert_sql(table, bucket_format, 'NEW', 1, 'NEW.units_needed',
+                                matched_expr('NEW.status'), no_match_expr('NEW.status'))
+        changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in ROLLUP_COLUMNS)
+        # Earlier schemas only followed status changes
+        cursor.execute(f'DROP TRIGGER IF EXISTS {table}_on_status')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_on_update AFTER UPDATE OF {', '.join(ROLLUP_COLUMNS)} ON patients
+            WHEN {changed}
+            BEGIN
+                {remove_upsert}
+                DELETE FROM {table} WHERE bucket = strftime('{bucket_format}', OLD.request_date)
+                    AND blood_group = OLD.blood_group AND urgency = OLD.urgency AND requests = 0;
+                {add_upsert}
+            END
+        ''')
+
+
+def backfill_rollups(conn, sources=('patients',), commit=True):
+    """Rebuild every rollup table from scratch out of the given patient tables"""
+    cursor = conn.cursor()
+    union = ' UNION ALL '.join(
+        f'SELECT request_date, blood_group, urgency, units_needed, status FROM {source}'
+        for source in sources
+    )
+    for table, bucket_format in GRANULARITIES.values():
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+            INSERT INTO {table} (bucket, blood_group, urgency, requests, units_requested, matched, no_match)
+            SELECT strftime('{bucket_format}', request_date), blood_group, urgency,
+                   COUNT(*), SUM(units_needed), SUM({matched_expr('status')}), SUM({no_match_expr('status')})
+            FROM ({union})
+            GROUP BY 1, 2, 3
+        ''')
+    if commit:
+        conn.commit()
+
+
+def request_report(conn, granularity='daily', start=None, end=None, blood_group=None, urgency=None):
+    """Read rollup rows for a bucket range, optionally filtered"""
+    table, _ = GRANULARITIES[granularity]
+    clauses, params = [], []
+    if start:
+        clauses.append('bucket >= ?')
+        params.append(start)
+    if end:
+        clauses.append('bucket <= ?')
+        params.append(end)
+    if blood_group:
+        clauses.append('blood_group = ?')
+        params.append(blood_group)
+    if urgency:
+        clauses.append('urgency = ?')
+        params.append(urgency)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return conn.execute(f'''
+        SELECT bucket, blood_group, urgency, requests, units_requested, matched, no_match
+        FROM {table} {where}
+        ORDER BY bucket, blood_group, urgency
+    ''', params).fetchall()
@@ -0,0 +1,133 @@
+"""Reservations of blood inventory units for patients
+
+Reserving moves units out of blood_inventory.units_available into an
+Active reservation within one transaction. The move is a single
+conditional UPDATE that only matches while enough units are free, so
+concurrent reservations can never oversubscribe a blood group and no
+read-modify-write is needed. Releasing or expiring a reservation puts
+its units back; consuming it marks them as used.
+"""
+from collections import Counter
+
+DEFAULT_TTL_MINUTES = 30
+MAX_TTL_MINUTES = 7 * 24 * 60
+# Reservations returned by one listing
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+
+STATUSES = ('Active', 'Released', 'Consumed', 'Expired')
+
+
+def init_reservations(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            blood_group TEXT NOT NULL,
+            units INTEGER NOT NULL CHECK (units > 0),
+            patient_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'Active',
+            created TEXT DEFAULT CURRENT_TIMESTAMP,
+            expires_at TEXT NOT NULL,
+            closed TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients (id)
+        )
+    ''')
+    # The expiry sweep reads Active rows in expiry order
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservations_status_expires '
+                   'ON inventory_reservations (status, expires_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservations_patient ON inventory_reservations (patient_id)')
+
+
+def take_units(conn, blood_group, units):
+    """Subtract units from a group if at least that many are free; True if they were"""
+    cursor = conn.execute(
+        'UPDATE blood_inventory SET units_available = units_available - ?, last_updated = CURRENT_TIMESTAMP '
+        'WHERE blood_group = ? AND units_available >= ?',
+        (units, blood_group, units)
+    )
+    return cursor.rowcount == 1
+
+
+def return_units(conn, units_by_group):
+    conn.executemany(
+        'UPDATE blood_inventory SET units_available = units_available + ?, last_updated = CURRENT_TIMESTAMP '
+        'WHERE blood_group = ?',
+        [(units, group) for group, units in units_by_group.items()]
+    )
+
+
+def reserve(conn, blood_group, units, patient_id=None, ttl_minutes=DEFAULT_TTL_MINUTES):
+    """Hold units of a blood group for ttl_minutes
+
+    Returns the reservation id, or None if fewer units are free. When
+    the group is short, expired reservations are swept first in case
+    their units are enough. Raises ValueError for bad arguments.
+    """
+    if not isinstance(units, int) or isinstance(units, bool) or units <= 0:
+        raise ValueError('units must be a positive whole number')
+    if not 1 <= ttl_minutes <= MAX_TTL_MINUTES:
+        raise ValueError(f'ttl_minutes must be between 1 and {MAX_TTL_MINUTES}')
+
+    if not take_units(conn, blood_group, units):
+        conn.rollback()
+        if not expire_reservations(conn).get(blood_group) or not take_units(conn, blood_group, units):
+            conn.rollback()
+            return None
+    cursor = conn.execute(
+        "INSERT INTO inventory_reservations (blood_group, units, patient_id, expires_at) "
+        "VALUES (?, ?, ?, datetime('now', ?))",
+        (blood_group, units, patient_id, f'+{int(ttl_minutes * 60)} seconds')
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def close_reservation(conn, reservation_id, status):
+    """Move an Active reservation to Released or Consumed
+
+    Released units go back to the inventory. A reservation past its
+    expiry can still be released but no longer consumed. Returns the
+    reservation's blood group, or None if it was not open.
+    """
+    if status not in ('Released', 'Consumed'):
+        raise ValueError(f'Cannot close a reservation as {status}')
+    condition = " AND expires_at > datetime('now')" if status == 'Consumed' else ''
+    rows = conn.execute(
+        'UPDATE inventory_reservations SET status = ?, closed = CURRENT_TIMESTAMP '
+        f"WHERE id = ? AND status = 'Active'{condition} RETURNING blood_group, units",
+        (status, reservation_id)
+    ).fetchall()
+    if not rows:
+        conn.rollback()
+        return None
+    blood_group, units = rows[0]
+    if status == 'Released':
+        return_units(conn, {blood_group: units})
+    conn.commit()
+    return blood_group
+
+
+def release(conn, reservation_id):
+    return close_reservation(conn, reservation_id, 'Released')
+
+
+def consume(conn, reservation_id):
+    return close_reservation(conn, reservation_id, 'Consumed')
+
+
+def expire_reservations(conn):
+    """Expire overdue Active reservations and return their units
+
+    Returns {blood_group: units returned}.
+    """
+    rows = conn.execute(
+        "UPDATE inventory_reservations SET status = 'Expired', closed = CURRENT_TIMESTAMP "
+        "WHERE status = 'Active' AND expires_at <= datetime('now') RETURNING blood_group, units"
+    ).fetchall()
+    returned = Counter()
+    for blood_group, units in rows:
+        returned[blood_group] += units
+    if returned:
+        return_units(conn, returned)
+    conn.commit()
+    return dict(returned)
@@ -0,0 +1,42 @@
+"""Schema version bookkeeping so init_db can skip its work on warm starts"""
+import sqlite3
+
+
+def schema_is_current(conn, component, version):
+    """Return True if component's schema and seed data are at version"""
+    try:
+        row = conn.execute('SELECT version FROM schema_meta WHERE component = ?', (component,)).fetchone()
+    except sqlite3.OperationalError:
+        # No schema_meta table yet: a fresh or pre-versioning database
+        return False
+    return row is not None and row[0] == version
+
+
+def begin_schema_setup(conn, component, version):
+    """Take the database write lock if component still needs setting up
+
+    Returns False when the schema is already current, either at the
+    first cheap check or after waiting for another worker that was
+    setting it up concurrently. Returns True with an IMMEDIATE
+    transaction open otherwise; finish with mark_schema_current().
+    """
+    if schema_is_current(conn, component, version):
+        return False
+    conn.execute('BEGIN IMMEDIATE')
+    if schema_is_current(conn, component, version):
+        conn.rollback()
+        return False
+    return True
+
+
+def mark_schema_current(conn, component, version):
+    """Record component's version and commit the setup transaction"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            component TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            updated TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('INSERT OR REPLACE INTO schema_meta (component, version) VALUES (?, ?)', (component, version))
+    conn.commit()
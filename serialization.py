@@ -0,0 +1,61 @@
+"""JSON serialization helpers for the API endpoints"""
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Responses at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = 4096
+GZIP_LEVEL = 5
+
+
+def table_columns(conn, table):
+    """Return the column names of a table in declaration order"""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def parse_fields(fields_arg, columns):
+    """Turn a ?fields=a,b,c argument into a validated column list
+
+    Returns all columns when the argument is empty and raises ValueError
+    for names that are not columns of the table, so only known
+    identifiers ever reach the SQL text.
+    """
+    if not fields_arg:
+        return list(columns)
+    fields = [field.strip() for field in fields_arg.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def fetch_projected(conn, table, fields, where='', params=()):
+    """Select only the given columns and return them as plain tuples"""
+    cursor = conn.cursor()
+    # Tuples are much cheaper to build than sqlite3.Row objects
+    cursor.row_factory = None
+    rows = cursor.execute(f'SELECT {", ".join(fields)} FROM {table} {where}', params).fetchall()
+    return fields, rows
+
+
+def dumps_rows(columns, rows):
+    """Serialize row tuples to a JSON array of objects, as UTF-8 bytes"""
+    records = [dict(zip(columns, row)) for row in rows]
+    if orjson is not None:
+        return orjson.dumps(records)
+    return json.dumps(records, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def compress_body(body, accept_gzip):
+    """Gzip body when the client accepts it and it is worth compressing
+
+    Returns (body, content_encoding) where content_encoding is None for
+    an uncompressed body.
+    """
+    if accept_gzip and len(body) >= GZIP_MIN_BYTES:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
@@ -0,0 +1,284 @@
+"""Region-sharded donor storage with scatter-gather queries
+
+Sharding is off unless BLOOD_BANK_SHARDS names a JSON file listing the
+shards, each a plain SQLite file with an optional bounding box:
+
+    [
+        {"name": "north", "path": "shards/north.db", "bounds": [12.5, 13.0, 77.0, 78.0]},
+        {"name": "south", "path": "shards/south.db", "bounds": [12.0, 12.5, 77.0, 78.0]},
+        {"name": "other", "path": "shards/other.db"}
+    ]
+
+bounds are [min_lat, max_lat, min_lon, max_lon]; donors outside every
+box go to the first shard without one.
+
+Donor emails are claimed in a donor_emails table in the main database
+before a donor is written to its shard, so an email stays unique across
+shards. Donors registered before sharding was switched on stay in the
+main database until migrate_donors moves them.
+"""
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from allocation import BLOOD_COMPATIBILITY, EARTH_RADIUS_KM
+from availability_windows import WINDOW_ID_BITS
+import slow_queries
+from schema import begin_schema_setup, mark_schema_current
+from write_batcher import GroupCommitWriter
+
+# Shard i hands out donor ids from [i * SHARD_ID_BLOCK, (i + 1) * SHARD_ID_BLOCK)
+# so ids stay unique across shards and point back to their shard
+SHARD_ID_BLOCK = 10 ** 12
+# Nearest-donor searches without a radius start here and widen 4x until
+# k donors are found or the radius covers the globe
+NEAREST_START_KM = 25
+MAX_DISTANCE_KM = np.pi * EARTH_RADIUS_KM
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from one point to arrays of points"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class Shard:
+    def __init__(self, index, name, path, bounds=None):
+        self.index = index
+        self.name = name
+        self.path = path
+        self.bounds = tuple(bounds) if bounds else None
+        self.writer = GroupCommitWriter(path)
+
+    def connect(self):
+        conn = slow_queries.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def contains(self, lat, lon):
+        if self.bounds is None or lat is None or lon is None:
+            return False
+        min_lat, max_lat, min_lon, max_lon = self.bounds
+        return min_lat <= lat < max_lat and min_lon <= lon < max_lon
+
+    def min_distance_km(self, lat, lon):
+        """Distance from a point to the nearest edge of this shard's box"""
+        if self.bounds is None:
+            return 0.0
+        min_lat, max_lat, min_lon, max_lon = self.bounds
+        nearest_lat = min(max(lat, min_lat), max_lat)
+        nearest_lon = min(max(lon, min_lon), max_lon)
+        return float(haversine_km(lat, lon, nearest_lat, nearest_lon))
+
+
+def init_email_registry(cursor):
+    """Create the main database's donor_emails table, one row per sharded donor"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS donor_emails (
+            email TEXT PRIMARY KEY,
+            shard TEXT NOT NULL
+        )
+    ''')
+
+
+class ShardRouter:
+    def __init__(self, shards, registry_path='blood_bank.db'):
+        self.shards = shards
+        self.registry_path = registry_path
+        self.pool = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='donor-shard')
+
+    @classmethod
+    def from_config(cls, path):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        return cls([Shard(i, entry['name'], entry['path'], entry.get('bounds')) for i, entry in enumerate(config)])
+
+    @classmethod
+    def from_env(cls):
+        """Build a router from BLOOD_BANK_SHARDS, or return None when unsharded"""
+        path = os.environ.get('BLOOD_BANK_SHARDS')
+        return cls.from_config(path) if path else None
+
+    def init_shards(self, setup, version):
+        """Run setup(cursor) on every shard not yet at version and reserve its id block"""
+        for shard in self.shards:
+            directory = os.path.dirname(shard.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = slow_queries.connect(shard.path, timeout=30)
+            if begin_schema_setup(conn, 'donor_shard', version):
+                setup(conn.cursor())
+                if conn.execute("SELECT COUNT(*) FROM sqlite_sequence WHERE name = 'donors'").fetchone()[0] == 0:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('donors', ?)",
+                                 (shard.index * SHARD_ID_BLOCK,))
+                mark_schema_current(conn, 'donor_shard', version)
+            conn.close()
+
+    def register_emails(self, conn):
+        """Claim the emails of donors already in the shards, e.g. after an upgrade"""
+        for shard, emails in zip(self.shards, self.scatter(lambda shard_conn: shard_conn.execute(
+                'SELECT email FROM donors').fetchall())):
+            conn.executemany('INSERT OR IGNORE INTO donor_emails (email, shard) VALUES (?, ?)',
+                             [(row[0], shard.name) for row in emails])
+
+    def shard_for(self, lat, lon):
+        """Pick the shard a donor at (lat, lon) belongs to"""
+        for shard in self.shards:
+            if shard.contains(lat, lon):
+                return shard
+        for shard in self.shards:
+            if shard.bounds is None:
+                return shard
+        if lat is None or lon is None:
+            return self.shards[0]
+        return min(self.shards, key=lambda shard: shard.min_distance_km(lat, lon))
+
+    def shard_for_id(self, donor_id):
+        return self.shards[int(donor_id) // SHARD_ID_BLOCK]
+
+    def by_name(self, names):
+        wanted = set(names)
+        return [shard for shard in self.shards if shard.name in wanted]
+
+    def within(self, lat, lon, radius_km):
+        """Shards whose region comes within radius_km of a point"""
+        return [shard for shard in self.shards if shard.min_distance_km(lat, lon) <= radius_km]
+
+    def scatter(self, fn, shards=None):
+        """Run fn(conn) on each shard in parallel and return the results in shard order"""
+        def run(shard):
+            conn = shard.connect()
+            try:
+                return fn(conn)
+            finally:
+                conn.close()
+        return list(self.pool.map(run, shards if shards is not None else self.shards))
+
+    def insert_donor(self, sql, params, lat, lon, email):
+        """Write a donor to its region's shard through that shard's group commit writer
+
+        The email is claimed in the registry first, so a duplicate raises
+        sqlite3.IntegrityError whichever shard holds the other donor.
+        """
+        shard = self.shard_for(lat, lon)
+        registry = slow_queries.connect(self.registry_path, timeout=30)
+        try:
+            registry.execute('INSERT INTO donor_emails (email, shard) VALUES (?, ?)', (email, shard.name))
+            registry.commit()
+            try:
+                return shard.writer.submit(sql, params)
+            except Exception:
+                registry.execute('DELETE FROM donor_emails WHERE email = ?', (email,))
+                registry.commit()
+                raise
+        finally:
+            registry.close()
+
+    def migrate_donors(self, conn, references=(), batch_size=500):
+        """Move the donors left in the main database (conn) into their shards
+
+        Each donor gets a new id in its shard's block, its availability
+        windows move with it, and every (table, column) in references is
+        rewritten to the new id. A donor is committed to its shard before
+        it is deleted from conn, and one already in a shard is found again
+        by email, so an interrupted run can simply be repeated. Returns
+        the number of donors moved.
+        """
+        # Keep new ids in the first shard above every id still to be moved,
+        # so rewriting references never merges an old id with a new one
+        highest = conn.execute('SELECT IFNULL(MAX(id), 0) FROM donors').fetchone()[0]
+        first = self.shards[0].connect()
+        first.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'donors'", (highest,))
+        first.commit()
+        first.close()
+
+        moved = 0
+        while True:
+            donors = conn.execute('SELECT * FROM donors ORDER BY id LIMIT ?', (batch_size,)).fetchall()
+            if not donors:
+                return moved
+            by_shard = {}
+            for donor in donors:
+                by_shard.setdefault(self.shard_for(donor['latitude'], donor['longitude']), []).append(donor)
+            for shard, group in by_shard.items():
+                new_ids = self._copy_donors(conn, shard, group)
+                conn.executemany('INSERT OR IGNORE INTO donor_emails (email, shard) VALUES (?, ?)',
+                                 [(donor['email'], shard.name) for donor in group])
+                for table, column in references:
+                    conn.executemany(f'UPDATE {table} SET {column} = ? WHERE {column} = ?',
+                                     [(new_ids[donor['id']], donor['id']) for donor in group])
+                conn.executemany('DELETE FROM donors WHERE id = ?', [(donor['id'],) for donor in group])
+                conn.commit()
+                moved += len(group)
+
+    def _copy_donors(self, conn, shard, donors):
+        """Insert donors and their windows into shard; returns {old id: new id}"""
+        columns = [column for column in donors[0].keys() if column != 'id']
+        shard_conn = shard.connect()
+        try:
+            shard_conn.execute('BEGIN IMMEDIATE')
+            new_ids = {}
+            for donor in donors:
+                existing = shard_conn.execute('SELECT id FROM donors WHERE email = ?', (donor['email'],)).fetchone()
+                if existing is not None:
+                    new_ids[donor['id']] = existing[0]
+                    continue
+                new_ids[donor['id']] = shard_conn.execute(
+                    f"INSERT INTO donors ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                    [donor[column] for column in columns]).lastrowid
+            for donor in donors:
+                windows = conn.execute('SELECT * FROM donor_windows WHERE donor_id = ?', (donor['id'],)).fetchall()
+                for window in windows:
+                    window = dict(window)
+                    # The low bits number the window within its donor
+                    low = window['id'] - (donor['id'] << WINDOW_ID_BITS)
+                    window['donor_id'] = new_ids[donor['id']]
+                    window['id'] = (window['donor_id'] << WINDOW_ID_BITS) + low
+                    shard_conn.execute(
+                        f"INSERT OR IGNORE INTO donor_windows ({', '.join(window)}) VALUES ({', '.join('?' for _ in window)})",
+                        list(window.values()))
+            shard_conn.commit()
+            return new_ids
+        finally:
+            shard_conn.close()
+
+    def find_nearest_donors(self, blood_group, lat, lon, k=5, radius_km=None):
+        """Top-k compatible available donors by distance, gathered from the relevant shards"""
+        if radius_km is None:
+            # k donors within a radius are the nearest k anywhere, so widen
+            # a bounded search rather than ranking every donor
+            radius = NEAREST_START_KM
+            while True:
+                nearest = self.find_nearest_donors(blood_group, lat, lon, k, radius)
+                if len(nearest) >= k or radius >= MAX_DISTANCE_KM:
+                    return nearest
+                radius *= 4
+
+        compatible = BLOOD_COMPATIBILITY.get(blood_group, [blood_group])
+        placeholders = ', '.join('?' for _ in compatible)
+        shards = self.within(lat, lon, radius_km)
+
+        # Donors within radius_km are within this many degrees of latitude
+        degrees = radius_km / (EARTH_RADIUS_KM * np.pi / 180)
+        params = list(compatible) + [lat - degrees, lat + degrees]
+
+        def top_k(conn):
+            rows = conn.execute(f'''
+                SELECT * FROM donors
+                WHERE availability = 'Available' AND blood_group IN ({placeholders})
+                  AND latitude BETWEEN ? AND ? AND longitude IS NOT NULL
+            ''', params).fetchall()
+            if not rows:
+                return []
+            distances = haversine_km(lat, lon,
+                                     np.array([row['latitude'] for row in rows]),
+                                     np.array([row['longitude'] for row in rows]))
+            nearest = np.argsort(distances)[:k]
+            return [dict(rows[i], distance_score=float(distances[i])) for i in nearest
+                    if distances[i] <= radius_km]
+
+        merged = [donor for part in self.scatter(top_k, shards) for donor in part]
+        return sorted(merged, key=lambda donor: donor['distance_score'])[:k]
@@ -0,0 +1,70 @@
+"""Coalescing of identical concurrent computations
+
+When several threads ask for the same key at once, only the first runs
+the computation; the rest wait for it and receive the same result, or
+the same exception. Nothing is cached once the call has finished, so a
+later caller always computes afresh.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """One in-flight computation per key, shared by every concurrent caller
+
+    computations counts the calls that ran, coalesced the callers that
+    were handed another caller's result instead of computing their own.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.computations = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """Return fn(*args), or the result of an identical call already running under key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.computations += 1
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        return {
+            'computations': self.computations,
+            'coalesced': self.coalesced,
+            'max_waiters': self.max_waiters,
+            'in_flight': len(self._calls),
+        }
@@ -0,0 +1,227 @@
+"""Opt-in slow-query log for SQLite connections
+
+Set BLOOD_BANK_SLOW_QUERY_MS to a threshold in milliseconds to turn it
+on. Connections opened through connect() then time every statement,
+including the time spent fetching its rows, and append the ones over
+the threshold to a rotating JSON lines log (BLOOD_BANK_SLOW_QUERY_LOG,
+slow_queries.jsonl by default) with the parameter types, the calling
+route and the statement's EXPLAIN QUERY PLAN. Parameter values are
+never logged.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+SLOW_QUERY_LOG = 'slow_queries.jsonl'
+MAX_LOG_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+# Statements EXPLAIN QUERY PLAN can describe
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def threshold_ms():
+    value = os.environ.get('BLOOD_BANK_SLOW_QUERY_MS')
+    return float(value) if value else None
+
+
+def log_path():
+    return os.environ.get('BLOOD_BANK_SLOW_QUERY_LOG', SLOW_QUERY_LOG)
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    """A logger writing bare JSON lines to the rotating slow-query log"""
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            handler = logging.handlers.RotatingFileHandler(
+                log_path(), maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger('blood_bank.slow_queries')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+    return _logger
+
+
+def normalize_sql(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def params_shape(params):
+    """Describe parameters by type only, e.g. ['str', 'int'] or {'id': 'int'}"""
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params or ()]
+
+
+def calling_route():
+    """The Flask route being served, or the current thread's name outside requests"""
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            rule = request.url_rule.rule if request.url_rule else request.path
+            return f'{request.method} {rule}'
+    except ImportError:
+        pass
+    return f'thread:{threading.current_thread().name}'
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that adds up execute and fetch time per statement"""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self._statement = None
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._statement = [sql, parameters, 0.0, calling_route(), None]
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        rows = list(seq_of_parameters)
+        self._statement = [sql, rows[0] if rows else (), 0.0, calling_route(), len(rows)]
+        return self._timed(super().executemany, sql, rows)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size if size is not None else self.arraysize)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        sql, parameters, elapsed, route, batch = statement
+        limit = threshold_ms()
+        if limit is None or elapsed * 1000 < limit:
+            return
+        record = {
+            'ts': round(time.time(), 3),
+            'duration_ms': round(elapsed * 1000, 3),
+            'sql': normalize_sql(sql),
+            'params': params_shape(parameters),
+            'route': route,
+            'plan': self._plan(sql, parameters),
+        }
+        if batch is not None:
+            record['batch_size'] = batch
+        get_logger().info(json.dumps(record, separators=(',', ':')))
+
+    def _plan(self, sql, parameters):
+        if not normalize_sql(sql).upper().startswith(EXPLAINABLE):
+            return None
+        try:
+            # A plain cursor, so planning is neither timed nor logged itself
+            rows = sqlite3.Cursor(self.connection).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+        except sqlite3.Error as e:
+            return [f'unavailable: {e}']
+        return [row[3] for row in rows]
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(database, **kwargs):
+    """sqlite3.connect(), with statement timing when the slow-query log is on"""
+    if threshold_ms() is not None:
+        kwargs.setdefault('factory', TimedConnection)
+    return sqlite3.connect(database, **kwargs)
+
+
+def read_log(path=None):
+    """All records from the log and its rotated backups, oldest file first"""
+    path = path or log_path()
+    records = []
+    for name in [f'{path}.{i}' for i in range(LOG_BACKUPS, 0, -1)] + [path]:
+        try:
+            with open(name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return records
+
+
+def worst_offenders(records, limit=50):
+    """Group records by statement, worst total time first"""
+    groups = defaultdict(list)
+    for record in records:
+        groups[record['sql']].append(record)
+    summary = []
+    for sql, group in groups.items():
+        durations = sorted(record['duration_ms'] for record in group)
+        latest = max(group, key=lambda record: record['ts'])
+        summary.append({
+            'sql': sql,
+            'count': len(group),
+            'total_ms': round(sum(durations), 3),
+            'max_ms': durations[-1],
+            'median_ms': durations[len(durations) // 2],
+            'routes': sorted({record['route'] for record in group}),
+            'params': latest['params'],
+            'plan': latest['plan'],
+            'last_seen': latest['ts'],
+        })
+    summary.sort(key=lambda item: item['total_ms'], reverse=True)
+    return summary[:limit]
@@ -0,0 +1,341 @@
+"""In-memory snapshots of read-mostly tables
+
+Triggers append every changed row id to change_log. A background thread
+applies those changes to each table's snapshot in place, under that
+snapshot's lock, so a refresh costs as much as the rows it changes and
+readers, who take the same lock, never see a half-applied update.
+Writers call catch_up() so their own change is visible to their next read.
+"""
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+import slow_queries
+
+# Seconds between change_log polls when nobody calls wake()
+REFRESH_INTERVAL_SECONDS = 0.5
+# change_log rows older than this are pruned; a snapshot that falls
+# further behind reloads its tables from scratch
+CHANGE_LOG_RETENTION_MINUTES = 10
+# Rows re-read per SELECT when applying changes
+FETCH_CHUNK_SIZE = 500
+
+
+def init_change_log(cursor, tables):
+    """Create change_log and the triggers that feed it for each table
+
+    Rows with an event carry a dashboard event and its JSON payload
+    instead of a table change; see events.py.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            changed TEXT DEFAULT CURRENT_TIMESTAMP,
+            event TEXT,
+            payload TEXT
+        )
+    ''')
+    # Dashboard events moved into change_log after the first release
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(change_log)')]
+    for column in ['event', 'payload']:
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE change_log ADD COLUMN {column} TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_changed ON change_log (changed)')
+    for table in tables:
+        for event, row in [('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')]:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_changelog_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id) VALUES ('{table}', {row}.id);
+                END
+            ''')
+
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', str(text).lower()) if text is not None else []
+
+
+def update_postings(index, removed, added):
+    """Remove ids from and add ids to some keys of an index {key: set(ids)} in place"""
+    for key in removed.keys() | added.keys():
+        ids = index.setdefault(key, set())
+        ids -= removed.get(key, set())
+        ids |= added.get(key, set())
+        if not ids:
+            del index[key]
+
+
+class TableSnapshot:
+    """One table's rows at a given version, with secondary indexes
+
+    rows maps id to a row tuple in column order and keeps id order.
+    apply() changes them in place; read through project() and search(),
+    which hold lock, or take lock yourself.
+    """
+
+    def __init__(self, table, columns, rows, version, last_modified, index_columns=(), token_columns=(),
+                 indexes=None):
+        self.table = table
+        self.columns = columns
+        self.positions = {column: i for i, column in enumerate(columns)}
+        self.rows = rows
+        self.version = version
+        self.last_modified = last_modified
+        self.index_columns = tuple(index_columns)
+        self.token_columns = tuple(token_columns)
+        self.indexes = indexes if indexes is not None else self._build_indexes()
+        self.lock = threading.Lock()
+
+    def _keys(self, column, row):
+        value = row[self.positions[column]]
+        return tokenize(value) if column in self.token_columns else [value]
+
+    def _build_indexes(self):
+        indexes = {}
+        for column in self.index_columns + self.token_columns:
+            postings = {}
+            for row_id, row in self.rows.items():
+                for key in self._keys(column, row):
+                    postings.setdefault(key, set()).add(row_id)
+            indexes[column] = postings
+        return indexes
+
+    def apply(self, changed, deleted, version, last_modified):
+        """Upsert changed rows ({id: row}) and drop deleted ids in place; returns self"""
+        # Rows and postings are worked out first, so the lock is held only for the swap-ins
+        removed_by_column, added_by_column = {}, {}
+        for column in self.indexes:
+            removed = removed_by_column[column] = {}
+            added = added_by_column[column] = {}
+            for row_id in deleted | changed.keys():
+                row = self.rows.get(row_id)
+                if row is not None:
+                    for key in self._keys(column, row):
+                        removed.setdefault(key, set()).add(row_id)
+            for row_id, row in changed.items():
+                for key in self._keys(column, row):
+                    added.setdefault(key, set()).add(row_id)
+        new_ids = sorted(changed.keys() - self.rows.keys())
+        with self.lock:
+            for column, index in self.indexes.items():
+                update_postings(index, removed_by_column[column], added_by_column[column])
+            for row_id in deleted:
+                self.rows.pop(row_id, None)
+            for row_id, row in changed.items():
+                if row_id in self.rows:
+                    self.rows[row_id] = row
+            if new_ids and self.rows and new_ids[0] < next(reversed(self.rows)):
+                # An id below the newest one, e.g. a reused id, would break id order
+                self.rows.update((row_id, changed[row_id]) for row_id in new_ids)
+                self.rows = dict(sorted(self.rows.items()))
+            else:
+                self.rows.update((row_id, changed[row_id]) for row_id in new_ids)
+            self.version, self.last_modified = version, last_modified
+        return self
+
+    def state(self):
+        """(version, last_modified) read together"""
+        with self.lock:
+            return self.version, self.last_modified
+
+    def project(self, fields):
+        """All rows as tuples of the given columns"""
+        with self.lock:
+            if fields == self.columns:
+                return list(self.rows.values())
+            positions = [self.positions[field] for field in fields]
+            return [tuple(row[i] for i in positions) for row in self.rows.values()]
+
+    def search(self, equals=None, contains=None):
+        """Rows as dicts matching every equals {column: value} and contains {column: text}
+
+        equals columns must be indexed and contains columns token-indexed;
+        contains keeps the case-insensitive substring semantics of LIKE.
+        """
+        with self.lock:
+            return self._search(equals, contains)
+
+    def _search(self, equals, contains):
+        candidates = None
+        for column, value in (equals or {}).items():
+            ids = self.indexes[column].get(value, set())
+            candidates = ids if candidates is None else candidates & ids
+        for column, text in (contains or {}).items():
+            needle = text.lower()
+            tokens = tokenize(text)
+            ids = set()
+            if tokens:
+                # Any row containing the text has a token containing its
+                # longest token, so only those postings need checking
+                longest = max(tokens, key=len)
+                for token, posting in self.indexes[column].items():
+                    if longest in token:
+                        ids |= posting
+            else:
+                ids = set(self.rows)
+            position = self.positions[column]
+            ids = {row_id for row_id in (ids if candidates is None else ids & candidates)
+                   if needle in str(self.rows[row_id][position]).lower()}
+            candidates = ids
+        if candidates is None:
+            candidates = self.rows.keys()
+        return [dict(zip(self.columns, self.rows[row_id])) for row_id in sorted(candidates)]
+
+
+class ReadSnapshot:
+    """Keep TableSnapshots of some tables current from change_log
+
+    tables maps each table name to {'index': [...], 'tokens': [...]}, the
+    columns to index by exact value and by lower-cased word.
+    """
+
+    def __init__(self, db_path, tables, interval=REFRESH_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.tables = tables
+        self.interval = interval
+        self.refreshes = 0
+        # time.time() of the last refresh that reached the database
+        self.checked_at = None
+        self._snapshots = None
+        self._last_change_id = 0
+        self._last_prune = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        # One refresh at a time, whether from the thread or catch_up()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def get(self, table):
+        """The current snapshot of a table, loading all tables on first use"""
+        snapshots = self._snapshots
+        if snapshots is None:
+            with self._lock:
+                if self._snapshots is None:
+                    self.refresh()
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='read-snapshot', daemon=True)
+                    self._thread.start()
+            snapshots = self._snapshots
+        return snapshots[table]
+
+    def wake(self):
+        """Have the refresher apply pending changes soon"""
+        self._wakeup.set()
+
+    def catch_up(self):
+        """Apply every change committed so far before returning, e.g. right after a write
+
+        A writer calling this after its commit sees its own change on its
+        next read, without waiting for the background refresh.
+        """
+        if self._snapshots is None:
+            return
+        self.refresh()
+
+    def close(self):
+        """Stop the refresh thread, e.g. before the database is deleted"""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._closed:
+                return
+            try:
+                self.refresh()
+                self._prune()
+            except sqlite3.Error as e:
+                print(f'Read snapshot refresh failed: {e}')
+
+    def _connect(self):
+        conn = slow_queries.connect(self.db_path, timeout=30)
+        conn.execute('BEGIN')
+        return conn
+
+    def _table_version(self, conn, table):
+        version, last_modified = conn.execute(
+            'SELECT version, last_modified FROM table_versions WHERE table_name = ?', (table,)
+        ).fetchone()
+        return version, datetime.strptime(last_modified, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+    def _load(self, conn, table):
+        config = self.tables[table]
+        cursor = conn.execute(f'SELECT * FROM {table} ORDER BY id')
+        columns = [description[0] for description in cursor.description]
+        rows = {row[0]: row for row in cursor}
+        return TableSnapshot(table, columns, rows, *self._table_version(conn, table),
+                             config.get('index', ()), config.get('tokens', ()))
+
+    def refresh(self):
+        """Apply change_log entries since the last refresh to the snapshots"""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        # One read transaction, so rows, change ids and versions agree
+        conn = self._connect()
+        try:
+            # sqlite_sequence keeps counting after old entries are pruned
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+            last_id = row[0] if row else 0
+            if self._snapshots is not None and last_id == self._last_change_id:
+                self.checked_at = time.time()
+                return
+            oldest_id = conn.execute('SELECT MIN(id) FROM change_log').fetchone()[0] or last_id + 1
+            snapshots = self._snapshots
+            if snapshots is None or oldest_id > self._last_change_id + 1:
+                snapshots = {table: self._load(conn, table) for table in self.tables}
+            else:
+                changes = {}
+                for table, row_id in conn.execute(
+                        'SELECT table_name, row_id FROM change_log WHERE id > ? AND id <= ?',
+                        (self._last_change_id, last_id)):
+                    changes.setdefault(table, set()).add(row_id)
+                snapshots = dict(snapshots)
+                for table, row_ids in changes.items():
+                    if table not in snapshots:
+                        continue
+                    if len(row_ids) > len(snapshots[table].rows) // 2:
+                        # Bulk changes: a reload is cheaper than patching
+                        snapshots[table] = self._load(conn, table)
+                        continue
+                    changed = {}
+                    ids = list(row_ids)
+                    for start in range(0, len(ids), FETCH_CHUNK_SIZE):
+                        chunk = ids[start:start + FETCH_CHUNK_SIZE]
+                        placeholders = ', '.join('?' for _ in chunk)
+                        for row in conn.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', chunk):
+                            changed[row[0]] = row
+                    snapshots[table] = snapshots[table].apply(
+                        changed, row_ids - changed.keys(), *self._table_version(conn, table))
+            conn.commit()
+        finally:
+            conn.close()
+        self._snapshots = snapshots
+        self._last_change_id = last_id
+        self.refreshes += 1
+        self.checked_at = time.time()
+
+    def _prune(self):
+        """Drop old change_log rows, at most once a minute and never blocking on writers"""
+        now = datetime.now()
+        if self._last_prune is not None and (now - self._last_prune).total_seconds() < 60:
+            return
+        self._last_prune = now
+        conn = slow_queries.connect(self.db_path, timeout=0.1)
+        try:
+            conn.execute("DELETE FROM change_log WHERE changed < datetime('now', ?)",
+                         (f'-{CHANGE_LOG_RETENTION_MINUTES} minutes',))
+            conn.commit()
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
@@ -0,0 +1,125 @@
+"""Fingerprinted, precompressed static assets
+
+At startup every stylesheet and script next to the app is read once,
+named by a hash of its content (style.css becomes style.3f2a9c1b0d.css)
+and compressed with gzip, and with brotli when the brotli package is
+installed. url_for('static', filename='style.css') resolves to the
+fingerprinted name, which is served from memory with immutable caching:
+any change to the file changes its URL, so browsers never need to
+revalidate. The plain name still works but is revalidated every time.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from flask import abort, current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_EXTENSIONS = ('.css', '.js', '.svg')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Smaller files gain nothing from compression
+COMPRESS_MIN_BYTES = 512
+
+FINGERPRINT_PATTERN = re.compile(r'\.[0-9a-f]{10}(?=\.[^.]+$)')
+
+
+class Asset:
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()[:10]
+        stem, extension = os.path.splitext(name)
+        self.fingerprinted = f'{stem}.{self.digest}{extension}'
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        # content_encoding -> body, smallest first, all smaller than the original
+        self.variants = {}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(body, quality=11)
+            for encoding, data in sorted(compressed.items(), key=lambda item: len(item[1])):
+                if len(data) < len(body):
+                    self.variants[encoding] = data
+
+    def negotiate(self, accept_encodings):
+        """The smallest variant the client accepts, as (body, content_encoding or None)"""
+        for encoding, data in self.variants.items():
+            if encoding in accept_encodings:
+                return data, encoding
+        return self.body, None
+
+
+class StaticAssets:
+    """Serve a directory's assets under /static with fingerprinted URLs
+
+    The Flask app must be created with static_folder=None so that this
+    can register the 'static' endpoint templates already use. In debug
+    mode changed files are picked up on the next request.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.assets = {}
+        self.by_fingerprint = {}
+        self._mtimes = None
+        self.build()
+
+    def _scan(self):
+        return {name: os.path.getmtime(os.path.join(self.directory, name))
+                for name in sorted(os.listdir(self.directory))
+                if name.endswith(ASSET_EXTENSIONS) and os.path.isfile(os.path.join(self.directory, name))}
+
+    def build(self):
+        mtimes = self._scan()
+        assets = {}
+        for name in mtimes:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                assets[name] = Asset(name, f.read())
+        # Swap whole dicts so concurrent requests see one build or the other
+        self.by_fingerprint = {asset.fingerprinted: asset for asset in assets.values()}
+        self.assets = assets
+        self._mtimes = mtimes
+
+    def refresh_if_changed(self):
+        if self._scan() != self._mtimes:
+            self.build()
+
+    def init_app(self, app):
+        app.add_url_rule('/static/<path:filename>', 'static', self.serve)
+        app.url_defaults(self.fingerprint_url)
+
+    def fingerprint_url(self, endpoint, values):
+        if endpoint != 'static' or 'filename' not in values:
+            return
+        if current_app.debug:
+            self.refresh_if_changed()
+        asset = self.assets.get(values['filename'])
+        if asset is not None:
+            values['filename'] = asset.fingerprinted
+
+    def serve(self, filename):
+        asset = self.by_fingerprint.get(filename)
+        immutable = asset is not None
+        if asset is None:
+            if current_app.debug:
+                self.refresh_if_changed()
+            # Pages cached from before a deploy may ask for an old
+            # fingerprint; give them the current file, uncached
+            asset = self.assets.get(FINGERPRINT_PATTERN.sub('', filename))
+        if asset is None:
+            abort(404)
+
+        body, encoding = asset.negotiate(request.accept_encodings)
+        response = current_app.response_class(body, mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        # Each encoding is a different representation, so needs its own tag
+        response.set_etag(f'{asset.digest}-{encoding}' if encoding else asset.digest)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+from allocation import run_allocation
+from app import SCHEMA_VERSION, init_donor_shard
+from sharding import Shard, ShardRouter
+
+PATIENT_SQL = '''
+    CREATE TABLE patients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, blood_group TEXT, location TEXT, urgency TEXT,
+        units_needed INTEGER, status TEXT, latitude REAL, longitude REAL
+    )
+'''
+ALLOCATIONS_SQL = '''
+    CREATE TABLE donor_allocations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id INTEGER NOT NULL,
+        donor_id INTEGER NOT NULL UNIQUE, distance_km REAL,
+        allocated_date TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+DONOR_SQL = ('INSERT INTO donors (name, email, phone, blood_group, age, location, latitude, longitude) '
+             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def sharded_bank(directory):
+    """A main database with two open requests and a donor router over two regions"""
+    router = ShardRouter([Shard(0, 'north', os.path.join(directory, 'north.db'), [12.5, 13.0, 77.0, 78.0]),
+                          Shard(1, 'south', os.path.join(directory, 'south.db'), [12.0, 12.5, 77.0, 78.0])])
+    router.init_shards(init_donor_shard, SCHEMA_VERSION)
+    for shard, lat in [(router.shards[0], 12.8), (router.shards[1], 12.2)]:
+        conn = shard.connect()
+        conn.executemany(DONOR_SQL, [(f'{shard.name} {i}', f'{shard.name}{i}@example.com', '9800000000',
+                                      'O+', 30, shard.name, lat + i * 0.01, 77.5) for i in range(3)])
+        conn.commit()
+        conn.close()
+
+    conn = sqlite3.connect(os.path.join(directory, 'blood_bank.db'))
+    conn.row_factory = sqlite3.Row
+    conn.execute(PATIENT_SQL)
+    conn.execute(ALLOCATIONS_SQL)
+    conn.executemany('INSERT INTO patients (blood_group, location, urgency, units_needed, status, latitude, longitude) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     [('O+', 'north', 'High', 2, 'Pending', 12.8, 77.5),
+                      ('A+', 'south', 'Low', 2, 'Pending', 12.2, 77.5)])
+    conn.commit()
+    return conn, router
+
+
+def test_allocation_reads_and_marks_donors_on_their_shards(tmp_path):
+    conn, router = sharded_bank(str(tmp_path))
+
+    summary = run_allocation(conn, shards=router)
+
+    assert summary['donors_considered'] == 6
+    assert summary['units_allocated'] == 4
+    allocated = [row['donor_id'] for row in conn.execute('SELECT donor_id FROM donor_allocations')]
+    assert len(set(allocated)) == 4
+    for donor_id in allocated:
+        shard_conn = router.shard_for_id(donor_id).connect()
+        availability = shard_conn.execute('SELECT availability FROM donors WHERE id = ?', (donor_id,)).fetchone()
+        shard_conn.close()
+        assert availability[0] == 'Allocated'
+    statuses = [row[0] for row in conn.execute('SELECT status FROM patients ORDER BY id')]
+    assert statuses == ['Allocated', 'Allocated']
+
+    # The second run only sees the two donors left
+    again = run_allocation(conn, shards=router)
+    assert again['donors_considered'] == 2
+    assert again['units_allocated'] == 0
+    conn.close()
@@ -0,0 +1,40 @@
+import sqlite3
+import pytest
+from app import init_donor_shard
+from donor_search import SAMPLE_FILTERS, DonorQuery, check_plans, explain
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    init_donor_shard(conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_every_filter_combination_uses_its_index(conn):
+    assert check_plans(conn) == []
+
+
+@pytest.mark.parametrize('filters, index', [
+    ({}, 'idx_donors_search_group'),
+    ({'blood_groups': ['O-']}, 'idx_donors_search_group'),
+    ({'compatible_for': 'A+'}, 'idx_donors_search_group'),
+    ({'compatible_for': 'A+', 'min_age': 25, **SAMPLE_FILTERS['radius']}, 'idx_donors_search_group'),
+    (SAMPLE_FILTERS['radius'], 'idx_donors_search_latitude'),
+    ({'min_age': 25, **SAMPLE_FILTERS['radius']}, 'idx_donors_search_latitude'),
+    (SAMPLE_FILTERS['near'], 'idx_donors_search_group'),
+    ({'min_age': 25}, 'idx_donors_search_age'),
+    ({'max_age': 40, **SAMPLE_FILTERS['eligible_by']}, 'idx_donors_search_age'),
+    (SAMPLE_FILTERS['eligible_by'], 'idx_donors_search_eligible'),
+    ({'health_status': 'Good', **SAMPLE_FILTERS['eligible_by']}, 'idx_donors_search_eligible'),
+    (SAMPLE_FILTERS['health_status'], 'idx_donors_search_health'),
+    (SAMPLE_FILTERS['location'], 'idx_donors_search_group'),
+    (SAMPLE_FILTERS['available'], 'idx_donors_search_group'),
+])
+def test_choose_index(conn, filters, index):
+    query = DonorQuery(**filters)
+    assert query.choose_index() == index
+    sql, params, compiled_index = query.compile()
+    assert compiled_index == index
+    assert any(f'USING INDEX {index} ' in f'{line} ' for line in explain(conn, sql, params))
@@ -0,0 +1,68 @@
+import random
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import reservations
+
+STOCK = {'O-': 25, 'A+': 40}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'reservations.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE blood_inventory (id INTEGER PRIMARY KEY, blood_group TEXT UNIQUE, '
+                 'units_available INTEGER, last_updated TEXT)')
+    conn.executemany('INSERT INTO blood_inventory (blood_group, units_available) VALUES (?, ?)', STOCK.items())
+    reservations.init_reservations(conn)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_concurrent_reservations_never_oversubscribe(db_path):
+    clients, attempts = 16, 40
+    done = threading.Event()
+    lowest = dict(STOCK)
+
+    def client(seed):
+        # Together the clients ask for several times the stock
+        rng = random.Random(seed)
+        conn = sqlite3.connect(db_path, timeout=60)
+        held = {group: 0 for group in STOCK}
+        for _ in range(attempts):
+            group, units = rng.choice(list(STOCK)), rng.randint(1, 3)
+            if reservations.reserve(conn, group, units) is not None:
+                held[group] += units
+        conn.close()
+        return held
+
+    def watch():
+        conn = sqlite3.connect(db_path, timeout=60)
+        while not done.is_set():
+            for group, units in conn.execute('SELECT blood_group, units_available FROM blood_inventory'):
+                lowest[group] = min(lowest[group], units)
+        conn.close()
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    try:
+        with ThreadPoolExecutor(clients) as pool:
+            results = list(pool.map(client, range(clients)))
+    finally:
+        done.set()
+        watcher.join()
+
+    conn = sqlite3.connect(db_path)
+    available = dict(conn.execute('SELECT blood_group, units_available FROM blood_inventory'))
+    active = dict(conn.execute("SELECT blood_group, SUM(units) FROM inventory_reservations "
+                               "WHERE status = 'Active' GROUP BY blood_group"))
+    conn.close()
+    for group, stock in STOCK.items():
+        reserved = sum(held[group] for held in results)
+        assert reserved <= stock
+        assert reserved == active.get(group, 0)
+        assert available[group] + reserved == stock
+        assert lowest[group] >= 0
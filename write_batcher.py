@@ -0,0 +1,92 @@
+"""Group commit of small writes from a single writer thread"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+import slow_queries
+
+# A batch is committed once it holds this many writes...
+MAX_BATCH_SIZE = 64
+# ...or once its first write has waited this many seconds
+MAX_BATCH_DELAY = 0.005
+
+
+class GroupCommitWriter:
+    """Queue single-row writes and commit them together in small batches
+
+    Callers block in submit() until the transaction holding their write
+    has committed, so a returned row id is as durable as with a direct
+    commit. Each write runs in its own savepoint: a failing write (e.g. a
+    duplicate email) raises only for its own caller and the rest of the
+    batch still commits.
+    """
+
+    def __init__(self, db_path, max_batch_size=MAX_BATCH_SIZE, max_batch_delay=MAX_BATCH_DELAY):
+        self.db_path = db_path
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches_committed = 0
+        self.writes_committed = 0
+
+    def submit(self, sql, params=(), timeout=None):
+        """Run one INSERT/UPDATE through the batch writer and return its lastrowid"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future.result(timeout)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_batch_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = slow_queries.connect(self.db_path, isolation_level=None)
+        while True:
+            batch = self._next_batch()
+            results = []
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for sql, params, future in batch:
+                    conn.execute('SAVEPOINT write')
+                    try:
+                        results.append((future, conn.execute(sql, params).lastrowid, None))
+                        conn.execute('RELEASE write')
+                    except sqlite3.Error as e:
+                        conn.execute('ROLLBACK TO write')
+                        conn.execute('RELEASE write')
+                        results.append((future, None, e))
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                # Nothing in the batch is durable, so every caller sees the failure
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches_committed += 1
+            self.writes_committed += sum(1 for _, _, error in results if error is None)
+            for future, rowid, error in results:
+                if error is None:
+                    future.set_result(rowid)
+                else:
+                    future.set_exception(error)